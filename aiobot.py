@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""The bot on a single asyncio event loop.
+
+Same commands as ``bot.py``, but the Telegram long polling, the command
+handlers and the Modbus RTU bus all run as tasks of one loop instead of
+the dispatcher thread pool, one thread per device actor and the poll
+threads. Usage: ``python aiobot.py <token>``.
+"""
+
+import sys
+import json
+import asyncio
+
+from asynchttp import HttpPool
+from botlog import BotLogger, FULL_ACCESS_USER_IDS_FILE
+from jokes import JOKE_DEFAULTS, parse_joke
+from mbdevs import mb_settings
+from mbdevs.aiodevices import AsyncDoorInterlock, AsyncTrafficLight, \
+    AsyncToilet, AsyncIvitMRS, AsyncPaperAlarm, schema_device
+from mbdevs.aiortu import AsyncRtuClient, Tasks
+from mbdevs.common import find_device
+from mbdevs.health import DeviceHealth, Health
+from mbdevs.ivitmrs import REGS as IVIT_MRS_REGS
+from mbdevs.trafflight import TrafficLight
+
+TELEGRAM_API = "https://api.telegram.org/bot{token}/{method}"
+LONG_POLL_TIMEOUT = 30
+
+KEYBOARD = [["/open_door"], ["/open_door_2"],
+            ["/get_temperature_and_humidity"], ["/is_paper_left"],
+            ["/get_toilet_score"], ["/tell_a_joke"]]
+
+
+class AsyncTelegram:
+    def __init__(self, token, http):
+        self._token = token
+        self._http = http
+
+    async def call(self, method, http_timeout=None, **params):
+        resp = await self._http.post_json(
+            TELEGRAM_API.format(token=self._token, method=method),
+            params,
+            timeout=http_timeout)
+        data = json.loads(resp.body.decode('utf-8'))
+        if not data.get("ok"):
+            raise IOError("Telegram error: {}".format(
+                data.get("description")))
+        return data["result"]
+
+    async def get_updates(self, offset):
+        return await self.call(
+            "getUpdates",
+            http_timeout=LONG_POLL_TIMEOUT + 10,
+            offset=offset,
+            timeout=LONG_POLL_TIMEOUT)
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        params = {"chat_id": chat_id, "text": text}
+        if reply_markup:
+            params["reply_markup"] = reply_markup
+        return await self.call("sendMessage", **params)
+
+
+class AsyncBot:
+    def __init__(self, token, full_access_ids_file=FULL_ACCESS_USER_IDS_FILE):
+        self._log = BotLogger.instance()
+        self._tasks = Tasks()
+        self._http = HttpPool()
+        self._telegram = AsyncTelegram(token, self._http)
+
+        with open(full_access_ids_file) as f:
+            self._full_access_users = json.load(f)["ids"]
+
+        settings = mb_settings()
+        port = find_device(0x0403, 0x6015).device
+        self._client = AsyncRtuClient(port, settings.MB_BAUDRATE,
+                                      settings.MB_PARITY, settings.MB_TIMEOUT)
+
+        tasks = self._tasks
+        self._ivt_mrs = AsyncIvitMRS(self._client, tasks)
+        self._door = schema_device("dooropener", self._client, tasks)
+        self._door2 = schema_device("dooropener2", self._client, tasks)
+        self._trafflight = AsyncTrafficLight(self._client, tasks)
+        self._emergency = schema_device("emergency", self._client, tasks)
+        self._toiletdudka = schema_device("toiletdudka", self._client, tasks)
+        self._toilet = AsyncToilet(self._client, tasks)
+
+        self._handlers = {
+            "start": self.start,
+            "open_door": self.open_door,
+            "open_door_2": self.open_door_2,
+            "tell_a_joke": self.tell_a_joke,
+            "get_temperature_and_humidity": self.get_temperature_and_humidity,
+            "get_toilet_score": self.get_toilet_score,
+            "is_paper_left": self.is_paper_left,
+        }
+
+    def setup_devices(self):
+        """Starts the devices in tasks, commands are served meanwhile."""
+        self._client.open()
+        DeviceHealth.monitor().set(self._ivt_mrs.health_name, Health.READY)
+        for dev in (self._door, self._door2, self._trafflight,
+                    self._emergency, self._toiletdudka, self._toilet):
+            self._tasks.spawn(dev.start())
+
+        interlock = AsyncDoorInterlock({
+            "door": self._door2,
+            "door2": self._door,
+        }, self._tasks)
+        self._door.events.subscribe(interlock.on_event)
+        self._door2.events.subscribe(interlock.on_event)
+
+        alarm = AsyncPaperAlarm(self._toiletdudka, self._trafflight,
+                                self._tasks)
+        self._toilet.events.subscribe(alarm.on_event, ("paper_absent", ))
+
+        for dev in (self._ivt_mrs, self._door, self._door2, self._emergency,
+                    self._toiletdudka, self._toilet):
+            dev.start_polling()
+
+    async def run(self):
+        self.setup_devices()
+        try:
+            await self._serve()
+        finally:
+            await self._tasks.cancel_all()
+            self._client.close()
+            self._http.close()
+
+    async def _serve(self):
+        offset = None
+        while True:
+            try:
+                updates = await self._telegram.get_updates(offset)
+            except Exception:
+                self._log.error("Cannot get updates!", exc_info=True)
+                await asyncio.sleep(1)
+                continue
+
+            for update in updates:
+                offset = update["update_id"] + 1
+                self._tasks.spawn(self._dispatch(update))
+
+    async def _dispatch(self, update):
+        message = update.get("message")
+        if not message or not message.get("text", "").startswith("/"):
+            return
+
+        command = message["text"][1:].split()[0].split("@")[0]
+        handler = self._handlers.get(command)
+        if handler is None:
+            return
+
+        try:
+            await handler(message)
+        except Exception as e:
+            self._log.warning('Update "%s" caused error "%s"', update, e)
+
+    async def _reply(self, message, text, reply_markup=None):
+        await self._telegram.send_message(message["chat"]["id"], text,
+                                          reply_markup)
+
+    async def _device_ready(self, name, message):
+        if DeviceHealth.monitor().is_ready(name):
+            return True
+
+        await self._reply(message,
+                          'The device is not ready yet, try again later.')
+        return False
+
+    def _traffic_light(self):
+        '''Just for lulz aka test'''
+        self._trafflight.sequence(
+            0.1, (TrafficLight.Color.GREEN, TrafficLight.Color.YELLOW,
+                  TrafficLight.Color.RED, TrafficLight.Color.GREEN,
+                  TrafficLight.Color.YELLOW, TrafficLight.Color.YELLOW,
+                  TrafficLight.Color.GREEN, TrafficLight.Color.RED,
+                  TrafficLight.Color.YELLOW, TrafficLight.Color.GREEN))
+        self._trafflight.turn_off(TrafficLight.Color.ALL)
+
+    async def start(self, message):
+        await self._reply(message, 'Hi!', {
+            "keyboard": KEYBOARD,
+            "resize_keyboard": True
+        })
+
+    async def get_temperature_and_humidity(self, message):
+        if not await self._device_ready(self._ivt_mrs.health_name, message):
+            return
+
+        try:
+            t, h = await self._ivt_mrs.temp_and_humidity()
+            msg = 'Temperature: {t:0.1f}{t_units:s}. '\
+                'Humidity: {h:0.1f}{h_units:s}.'.format(
+                t=t, t_units=IVIT_MRS_REGS.temp.unit,
+                h=h, h_units=IVIT_MRS_REGS.humidity.unit)
+            await self._reply(message, msg)
+        except Exception:
+            self._log.error(
+                "Error while connection with a temp sensor!", exc_info=True)
+            await self._reply(message, 'Something goes wrong!')
+
+        self._traffic_light()
+
+    async def is_paper_left(self, message):
+        if await self._device_ready(self._toilet.health_name, message):
+            await self._reply(message, self._toilet.buttons.paper_msg)
+
+    async def get_toilet_score(self, message):
+        if await self._device_ready(self._toilet.health_name, message):
+            await self._reply(message, self._toilet.buttons.score_msg)
+
+    async def open_door(self, message):
+        await self._open_door(message, self._door)
+
+    async def open_door_2(self, message):
+        await self._open_door(message, self._door2)
+
+    async def _open_door(self, message, door):
+        self._log.info("User opening door: {}".format(message["chat"]["id"]))
+
+        if not await self._check_user_access(message):
+            return
+        if not await self._device_ready(door.health_name, message):
+            return
+
+        await self._reply(message, 'Opening the door...')
+        try:
+            if await door.act("OPEN"):
+                await self._reply(message, 'The door was opened.')
+                self._trafflight.sequence(0.5, (TrafficLight.Color.GREEN, ) * 6)
+            else:
+                await self._reply(message, 'The door is already opened.')
+        except Exception:
+            self._log.error(
+                "Error while connection with a door opener!", exc_info=True)
+            await self._reply(message, 'Cannot open the door.')
+
+    async def tell_a_joke(self, message):
+        try:
+            r = await self._http.get(JOKE_DEFAULTS.URL,
+                                     timeout=JOKE_DEFAULTS.READ_TIMEOUT)
+            joke = parse_joke((r.body, ))
+        except (IOError, asyncio.TimeoutError):
+            self._log.warning("Cannot fetch a joke!", exc_info=True)
+            joke = None
+        await self._reply(message,
+                          joke or 'No jokes right now, try again later.')
+
+    async def _check_user_access(self, message):
+        if message["chat"]["id"] not in self._full_access_users:
+            await self._reply(message, 'Sorry, but this function is not '
+                              'avaliable for you, pal.')
+            self._log.warning(
+                'An attempt of a restricted access, user {}'.format(
+                    message["chat"]["id"]))
+            return False
+        return True
+
+
+def main():
+    """Start the bot on an asyncio event loop."""
+
+    log = BotLogger.instance()
+
+    try:
+        bot = AsyncBot(sys.argv[1])
+    except Exception as e:
+        log.error("Can not create a bot instance:", exc_info=True)
+        raise e
+
+    try:
+        asyncio.run(bot.run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
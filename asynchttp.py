@@ -0,0 +1,149 @@
+import ssl
+import json
+import asyncio
+
+from collections import namedtuple, deque
+from urllib.parse import urlsplit, urlencode
+
+Response = namedtuple('Response', ['status', 'headers', 'body'])
+
+
+class HttpError(IOError):
+    pass
+
+
+class HttpPool:
+    """Minimal asyncio HTTP/1.1 client with keep-alive connection pooling."""
+
+    def __init__(self, max_idle=4, timeout=10):
+        self._max_idle = max_idle
+        self._timeout = timeout
+        self._idle = dict()
+        self._ssl = ssl.create_default_context()
+
+    async def get(self, url, params=None, timeout=None):
+        if params:
+            url = '{}?{}'.format(url, urlencode(params))
+        return await self.request('GET', url, timeout=timeout)
+
+    async def post_json(self, url, data, timeout=None):
+        return await self.request(
+            'POST',
+            url,
+            body=json.dumps(data).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            timeout=timeout)
+
+    async def request(self, method, url, body=None, headers=None,
+                      timeout=None):
+        return await asyncio.wait_for(
+            self._request(method, url, body, headers or dict()),
+            timeout or self._timeout)
+
+    def close(self):
+        for conns in self._idle.values():
+            for _, writer in conns:
+                writer.close()
+        self._idle.clear()
+
+    async def _request(self, method, url, body, headers):
+        parts = urlsplit(url)
+        secure = parts.scheme == 'https'
+        key = (parts.hostname, parts.port or (443 if secure else 80), secure)
+        path = parts.path or '/'
+        if parts.query:
+            path = '{}?{}'.format(path, parts.query)
+
+        lines = [
+            '{} {} HTTP/1.1'.format(method, path),
+            'Host: {}'.format(parts.netloc),
+            'Connection: keep-alive',
+            'Content-Length: {}'.format(len(body) if body else 0),
+        ]
+        lines += ['{}: {}'.format(k, v) for k, v in headers.items()]
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin1') + \
+            (body or b'')
+
+        # A pooled connection may have been closed by the server meanwhile,
+        # so a failure on a reused connection is retried on a fresh one.
+        reused, conn = await self._acquire(key)
+        try:
+            return await self._exchange(key, conn, request)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            if not reused:
+                raise
+        _, conn = await self._acquire(key, fresh=True)
+        return await self._exchange(key, conn, request)
+
+    async def _acquire(self, key, fresh=False):
+        idle = self._idle.get(key)
+        while idle and not fresh:
+            reader, writer = idle.pop()
+            if not reader.at_eof():
+                return True, (reader, writer)
+            writer.close()
+
+        host, port, secure = key
+        conn = await asyncio.open_connection(
+            host, port, ssl=self._ssl if secure else None)
+        return False, conn
+
+    def _release(self, key, conn):
+        idle = self._idle.setdefault(key, deque())
+        if len(idle) < self._max_idle:
+            idle.append(conn)
+        else:
+            conn[1].close()
+
+    async def _exchange(self, key, conn, request):
+        # A timeout or a cancel leaves a half read response on the
+        # connection, so any failure closes it instead of pooling it.
+        try:
+            return await self._exchange_on(key, conn, request)
+        except BaseException:
+            conn[1].close()
+            raise
+
+    async def _exchange_on(self, key, conn, request):
+        reader, writer = conn
+        writer.write(request)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed")
+        try:
+            status = int(status_line.split()[1])
+        except (IndexError, ValueError):
+            raise HttpError("Bad status line: {!r}".format(status_line))
+
+        headers = dict()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if not size:
+                    await reader.readline()
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()
+            body = bytes(body)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            headers['connection'] = 'close'
+
+        if headers.get('connection', '').lower() == 'close':
+            writer.close()
+        else:
+            self._release(key, conn)
+
+        return Response(status, headers, body)
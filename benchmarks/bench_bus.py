@@ -0,0 +1,166 @@
+"""Bus throughput and latency per device on the simulated RTU line.
+
+Usage: python -m benchmarks.bench_bus [--latency S] [--count N] [--threads N]
+
+Every device runs alone first, then all of them at once, which is what the
+bot does. Reported per run: operations/s, p50/p99 latency of an operation
+and the depth of the Modbus actor queue, sampled every millisecond. The
+door commands are interactive, so their latency should stay low in the
+all devices run; the queue wait of every priority class is printed last.
+"""
+
+import time
+import argparse
+import threading
+
+import pykka
+
+from mbdevs import dooropener, dooropener2, emergency, ivitmrs, toilet, \
+    toiletdudka, trafflight
+from mbdevs.connection import ConnectionManager
+from mbdevs.modbus import Modbus, ModbusUser, BusPriority
+from mbdevs.simulator import RtuSimulator
+
+
+def _reader(regs):
+    return lambda user, i: user.read_many(regs)
+
+
+def _toggler(regs, priority=None):
+    return lambda user, i: user._write_many(regs, [i % 2] * len(regs),
+                                            priority)
+
+
+# name, slave address, operation
+SCENARIOS = (
+    ("ivitmrs", 247, _reader((ivitmrs.REGS.temp, ivitmrs.REGS.humidity))),
+    ("door", 1, _reader((dooropener.REGS.door_button, ))),
+    ("door open", 1, _toggler((dooropener.REGS.door, ),
+                              BusPriority.INTERACTIVE)),
+    ("door2", 2, _reader((dooropener2.REGS.door_button, ))),
+    ("toilet", 5, _reader((toilet.REGS.button_end, toilet.REGS.button_like,
+                           toilet.REGS.button_dislike))),
+    ("emergency", 2, _reader((emergency.REGS.button, ))),
+    ("trafflight", 2, _toggler(trafflight.LIGHTS)),
+    ("dudka", 2, _toggler((toiletdudka.REGS.sound, ))),
+)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class QueueSampler(threading.Thread):
+    def __init__(self, actor, period=0.001):
+        super().__init__(daemon=True)
+        self._inbox = actor.actor_inbox
+        self._period = period
+        self._done = threading.Event()
+        self.samples = []
+
+    def run(self):
+        while not self._done.is_set():
+            self.samples.append(self._inbox.qsize())
+            time.sleep(self._period)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def _worker(user, operation, count, latencies):
+    for i in range(count):
+        start = time.perf_counter()
+        operation(user, i)
+        latencies.append(time.perf_counter() - start)
+
+
+def run(port, scenarios, count, threads):
+    """Returns {name: (ops/s, p50, p99)} and the queue depth samples."""
+    manager = ConnectionManager.manager()
+    workers = []
+    results = dict()
+    for name, address, operation in scenarios:
+        user = ModbusUser(manager.instrument(port, address))
+        latencies = []
+        results[name] = latencies
+        workers += [
+            threading.Thread(target=_worker,
+                             args=(user, operation, count, latencies))
+            for _ in range(threads)
+        ]
+
+    sampler = QueueSampler(Modbus.for_port(port))
+    sampler.start()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    sampler.stop()
+
+    return {
+        name: (len(latencies) / elapsed, percentile(latencies, 50),
+               percentile(latencies, 99))
+        for name, latencies in results.items()
+    }, sampler.samples, elapsed
+
+
+def report(title, results, samples, elapsed, requests):
+    print("\n{} ({:.0f} bus transactions/s)".format(title,
+                                                   requests / elapsed))
+    print("{:<12}{:>10}{:>10}{:>10}".format("device", "ops/s", "p50 ms",
+                                            "p99 ms"))
+    for name, (rate, p50, p99) in results.items():
+        print("{:<12}{:>10.0f}{:>10.2f}{:>10.2f}".format(
+            name, rate, p50 * 1000, p99 * 1000))
+    print("actor queue depth: mean {:.2f}, max {}".format(
+        sum(samples) / max(len(samples), 1), max(samples or [0])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--latency", type=float, default=0.002,
+                        help="slave response latency, s")
+    parser.add_argument("--count", type=int, default=200,
+                        help="operations per thread")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="threads per device")
+    args = parser.parse_args()
+
+    sim = RtuSimulator.with_devices(latency=args.latency).start()
+    try:
+        for scenario in SCENARIOS:
+            before = sim.stats().requests
+            results, samples, elapsed = run(sim.port, (scenario, ),
+                                            args.count, args.threads)
+            report(scenario[0], results, samples, elapsed,
+                   sim.stats().requests - before)
+
+        before = sim.stats().requests
+        results, samples, elapsed = run(sim.port, SCENARIOS, args.count,
+                                        args.threads)
+        report("all devices", results, samples, elapsed,
+               sim.stats().requests - before)
+
+        for bus in Modbus.stats():
+            print("\nbus {}: {} transactions, {} errors, {:.0f}% busy".format(
+                bus.port, bus.transactions, bus.errors,
+                bus.utilization * 100))
+        for stats in Modbus.queue_stats():
+            print("  {:<12} {:>6} requests, wait mean {:.2f} ms, "
+                  "max {:.2f} ms".format(
+                      stats.priority.name.lower(), stats.requests,
+                      stats.mean_wait * 1000, stats.max_wait * 1000))
+    finally:
+        pykka.ActorRegistry.stop_all()
+        ConnectionManager.manager().close_all()
+        sim.stop()
+
+
+if __name__ == "__main__":
+    main()
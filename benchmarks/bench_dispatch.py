@@ -0,0 +1,95 @@
+"""CPU cost of a message in every actor, without the bus.
+
+Usage: python -m benchmarks.bench_dispatch [--count N]
+
+Every device is built on the simulated RTU line but not started, its
+``on_receive`` is called directly with an action which does not touch the
+bus, so the time is the dispatch of the message and its handler. The bus
+part is decoding the result of a block read of the registers a device
+polls, done for every transaction. Reported in microseconds per message.
+"""
+
+import time
+import argparse
+
+import pykka
+
+from mbdevs import dooropener, emergency, ivitmrs, planner, toilet, \
+    trafflight
+from mbdevs.connection import ConnectionManager
+from mbdevs.scheduler import BusScheduler
+from mbdevs.simulator import RtuSimulator
+
+# name, actor class, slave address, message
+ACTORS = (
+    ("door", dooropener.DoorOpener, 1,
+     {"action": dooropener.Action.VALUES}),
+    ("emergency", emergency.Emergency, 2,
+     {"action": emergency.Emergency.Action.VALUES}),
+    ("toilet", toilet.Toilet, 5, {"action": 'is_paper_left'}),
+    ("trafflight", trafflight.TrafficLight, 2,
+     {"action": trafflight.TrafficLight.Action.CANCEL}),
+)
+
+# name, polled registers
+PLANS = (
+    ("ivitmrs", (ivitmrs.REGS.temp, ivitmrs.REGS.humidity)),
+    ("door", (dooropener.REGS.door_button, )),
+    ("toilet", (toilet.REGS.button_end, toilet.REGS.button_like,
+                toilet.REGS.button_dislike)),
+)
+
+
+def per_call(func, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return (time.perf_counter() - start) / count
+
+
+def bench_actor(actor, msg, count):
+    return per_call(lambda: actor.on_receive(dict(msg)), count)
+
+
+def bench_decode(regs, count):
+    plan = planner.plan_reads(regs)
+    raws = [[0] * block.count for block in plan]
+
+    def decode():
+        values = dict()
+        for block, raw in zip(plan, raws):
+            for reg, decode in block.decoders:
+                values[reg] = decode(raw)
+        return values
+
+    return per_call(decode, count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--count", type=int, default=100000,
+                        help="messages per actor")
+    args = parser.parse_args()
+
+    sim = RtuSimulator.with_devices(latency=0).start()
+    try:
+        print("{:<12}{:<24}{:>10}".format("actor", "action", "us/msg"))
+        for name, cls, address, msg in ACTORS:
+            actor = cls(sim.port, address)
+            print("{:<12}{:<24}{:>10.2f}".format(
+                name, str(msg["action"]).split(".")[-1],
+                bench_actor(actor, msg, args.count) * 1e6))
+
+        for name, regs in PLANS:
+            print("{:<12}{:<24}{:>10.2f}".format(
+                "bus", "decode " + name,
+                bench_decode(regs, args.count) * 1e6))
+    finally:
+        BusScheduler.scheduler(sim.port).stop()
+        pykka.ActorRegistry.stop_all()
+        ConnectionManager.manager().close_all()
+        sim.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,64 +5,80 @@ import sys
 import json
 import time
 
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters
-from telegram import ChatAction, ReplyKeyboardMarkup
+from telegram.ext import Updater, CommandHandler
+from telegram import ReplyKeyboardMarkup
 
-import logging
-import requests 
-import html2text
+from concurrent.futures import ThreadPoolExecutor
+from threading import Timer
+from pykka import ThreadingActor
 
-from logging.handlers import RotatingFileHandler
-from threading import Thread
-
-from mbdevs.dooropener import DoorOpener, Action
+from botlog import BotLogger, FULL_ACCESS_USER_IDS_FILE
+from jokes import JokeClient, JokePrefetcher, JOKE_DEFAULTS
+from mbdevs.dooropener import DoorOpener
 from mbdevs.dooropener import Action as DoorAction
 from mbdevs.dooropener2 import DoorOpener2
 from mbdevs.dooropener2 import Action as DoorAction2
+from mbdevs.doorinterlock import DoorInterlock
 from mbdevs.trafflight import TrafficLight
 from mbdevs.emergency import Emergency
-from mbdevs import ivitmrs
+from mbdevs import metrics, tracing
 from mbdevs.ivitmrs import IvitMRS
 from mbdevs.ivitmrs import REGS as IVIT_MRS_REGS
 from mbdevs.toilet import Toilet
 from mbdevs.toiletdudka import ToiletDudka
-
-
-class _BotLogger():
-    def __init__(self):
-        if not _BotLogger.is_inited:
-            __formatter = logging.Formatter(
-                '%(asctime)s_%(name)s_%(levelname)s: %(message)s')
-
-            __ch = logging.StreamHandler()
-            __ch.setFormatter(__formatter)
-            __ch.setLevel(logging.INFO)
-
-            __fh = RotatingFileHandler(
-                "log.txt", maxBytes=1048576, backupCount=5)
-            __fh.setFormatter(__formatter)
-            __fh.setLevel(logging.DEBUG)
-
-            self._logger = logging.getLogger(__name__)
-            self._logger.addHandler(__fh)
-            self._logger.addHandler(__ch)
-            self._logger.setLevel(logging.DEBUG)
-
-            _BotLogger.is_inited = True
+from mbdevs.breaker import Breakers
+from mbdevs.effects import Effect, Effects
+from mbdevs.health import DeviceHealth, Health, STARTUP_DEFAULTS
+from mbdevs.history import History, parse_window
+from mbdevs.modbus import Modbus
+from mbdevs.ports import PortRegistry
+from mbdevs.scheduler import BusScheduler, Priority
+from mbdevs.telemetry import Telemetry
+from mbdevs.events import Edge, Event
+
+
+DEVICES = (("ivitmrs", IvitMRS), ("door", DoorOpener), ("door2", DoorOpener2),
+           ("trafflight", TrafficLight), ("emergency", Emergency),
+           ("toiletdudka", ToiletDudka), ("toilet", Toilet))
+
+
+class _PaperAlarm(ThreadingActor):
+    """Sounds and blinks while the toilet paper is out."""
+
+    def __init__(self, toiletdudka, trafflight):
+        super().__init__()
+        self._toiletdudka = toiletdudka
+        self._trafflight = trafflight
+
+    def on_receive(self, msg):
+        if not isinstance(msg, Event):
+            return
+
+        scheduler = BusScheduler.scheduler()
+        if msg.edge == Edge.RISING:
+            self._alarm()
+            scheduler.register(
+                "paper alarm", 0.5, self._alarm, priority=Priority.LOW)
         else:
-            self._logger = logging.getLogger(__name__)
-
-    @property
-    def logger(self):
-        return self._logger
-
-    def instance():
-        return _BotLogger()._logger
-
-    is_inited = False
-
+            scheduler.unregister("paper alarm")
+            self._toiletdudka.tell({"action":ToiletDudka.Action.SOUND_OFF})
+            self._trafflight.tell({
+                "action": TrafficLight.Action.OFF,
+                "color": TrafficLight.Color.ALL
+            })
 
-FULL_ACCESS_USER_IDS_FILE = "ids.json"
+    def _alarm(self):
+        self._toiletdudka.tell({"action":ToiletDudka.Action.SOUND_ON})
+        self._trafflight.tell({
+            "action":
+            TrafficLight.Action.SEQUENCE,
+            "sleep_time":
+            0.05,
+            "colors":
+            (TrafficLight.Color.GREEN, TrafficLight.Color.YELLOW,
+             TrafficLight.Color.RED, TrafficLight.Color.GREEN,
+             TrafficLight.Color.YELLOW, TrafficLight.Color.RED)
+        })
 
 
 class Bot(object):
@@ -71,28 +87,57 @@ class Bot(object):
             cls,
             full_access_ids_file=FULL_ACCESS_USER_IDS_FILE,
     ):
-        log = _BotLogger.instance()
+        log = BotLogger.instance()
         return cls._BotImpl(full_access_ids_file)
 
     class _BotImpl(object):
         def __init__(self, full_access_ids_file):
             self._full_access_users = list()
-            self._log = _BotLogger.instance()
-            self._ivt_mrs = IvitMRS.from_vid_pid(0x0403, 0x6015)
-            self._door = DoorOpener.from_vid_pid(0x0403, 0x6015)
-            self._door2 = DoorOpener2.from_vid_pid(0x0403, 0x6015)
-            self._trafflight = TrafficLight.from_vid_pid(0x0403, 0x6015)
-            self._emergency = Emergency.from_vid_pid(0x0403, 0x6015)
-            self._toiletdudka = ToiletDudka.from_vid_pid(0x0403, 0x6015)
-            self._toilet = Toilet.from_vid_pid(0x0403, 0x6015)
-            self._toilet.ask({"action":'connected'})
-
-            self._door_manager_th = Thread(target = self._door_manager_thread)
-            self._door_manager_th.start()
-
-            self._button_check_th = Thread(target=self._button_check_thread)
-            self._button_check_th.start()
-
+            self._log = BotLogger.instance()
+
+            start = time.monotonic()
+            devices = self._start_devices()
+            self._ivt_mrs = devices.get("ivitmrs")
+            self._door = devices.get("door")
+            self._door2 = devices.get("door2")
+            self._trafflight = devices.get("trafflight")
+            self._emergency = devices.get("emergency")
+            self._toiletdudka = devices.get("toiletdudka")
+            self._toilet = devices.get("toilet")
+
+            self.startup_time = time.monotonic() - start
+            self._effects = Effects.start()
+            self._jokes = JokePrefetcher(JokeClient()).start()
+            ports = PortRegistry.registry().stats()
+            self._log.info(
+                "Devices started in {:.3f} s, {} port scan(s) took {:.3f} s".
+                format(self.startup_time, ports.scans, ports.total_scan_time))
+
+            if self._toilet:
+                self._toilet.tell({"action": 'connected'})
+
+            if self._door and self._door2:
+                self._door_manager = DoorInterlock.start({
+                    "door": (self._door2, DoorAction2.OPEN),
+                    "door2": (self._door, DoorAction.OPEN),
+                })
+                self._door.tell({
+                    "action": DoorAction.SUBSCRIBE_TO_BUTTON,
+                    "subscriber": self._door_manager
+                })
+                self._door2.tell({
+                    "action": DoorAction2.SUBSCRIBE_TO_BUTTON,
+                    "subscriber": self._door_manager
+                })
+
+            if self._toilet and self._toiletdudka and self._trafflight:
+                self._paper_alarm = _PaperAlarm.start(self._toiletdudka,
+                                                      self._trafflight)
+                self._toilet.tell({
+                    "action": Toilet.Action.SUBSCRIBE_TO_BUTTON,
+                    "subscriber": self._paper_alarm,
+                    "names": ("paper_absent", )
+                })
 
             try:
                 with open(full_access_ids_file) as f:
@@ -103,70 +148,49 @@ class Bot(object):
                         full_access_ids_file))
                 raise e
 
-        def _door_manager_thread(self):
-            prevButtonState1 = True
-            prevButtonState2 = True
-            tim1 = 0
-            tim2 = 0
-            while True:
-                buttonState2 = self._door2.ask({"action":DoorAction2.CHECK_BUTTON})
-                buttonState1 = self._door.ask({"action":DoorAction.CHECK_BUTTON})
-                
-                if buttonState2 != prevButtonState2:
-                    if buttonState2 == False:
-                        if tim1 <= 2:
-                            time.sleep(3)
-                            self._door.tell(({"action":DoorAction.OPEN}))
-                            time.sleep(3)
-                            self._door.tell(({"action":DoorAction.OPEN}))
-                            time.sleep(3)
-                            self._door.tell(({"action":DoorAction.OPEN}))
-                        tim1 = 0
-
-                if buttonState1 != prevButtonState1:
-                    if buttonState1 == False:
-                        if tim2 <= 2:
-                            time.sleep(3)
-                            self._door2.tell(({"action":DoorAction2.OPEN}))
-                            time.sleep(3)
-                            self._door2.tell(({"action":DoorAction2.OPEN}))
-                            time.sleep(3)
-                            self._door2.tell(({"action":DoorAction2.OPEN}))
-                        tim2 = 0
-
-                prevButtonState1 = buttonState1
-                prevButtonState2 = buttonState2
-                time.sleep(0.05)
-                tim1 = tim1 + 0.05
-                tim2 = tim2 + 0.05
-
-        def _button_check_thread(self):
-            prev_msg = 'abcd'
-            while True:
-                msg = self._toilet.ask({"action":'is_paper_left'})
-                if msg != prev_msg:
-                    if msg == 'No paper left!':
-                        self._toiletdudka.tell({"action":ToiletDudka.Action.SOUND_ON})
-                    else:
-                        self._toiletdudka.tell({"action":ToiletDudka.Action.SOUND_OFF})
-                        self._trafflight.tell({
-                        "action": TrafficLight.Action.OFF,
-                        "color": TrafficLight.Color.ALL
-                        })
-                if msg == 'No paper left!':
-                        self._toiletdudka.tell({"action":ToiletDudka.Action.SOUND_ON})
-                        self._trafflight.tell({
-                        "action":
-                        TrafficLight.Action.SEQUENCE,
-                        "sleep_time":
-                        0.05,
-                        "colors":
-                        (TrafficLight.Color.GREEN, TrafficLight.Color.YELLOW,
-                        TrafficLight.Color.RED,TrafficLight.Color.GREEN, TrafficLight.Color.YELLOW,
-                        TrafficLight.Color.RED)
-                        })
-                prev_msg = msg
-                time.sleep(0.5)
+        def _start_devices(self):
+            """Starts all the devices at once, without waiting for slow ones.
+
+            Devices get ready in the background while commands are served,
+            ``_device_ready()`` turns away the ones for a device which is not.
+            A device still starting at the startup deadline is marked
+            degraded; a device which cannot be started at all is left out.
+            """
+            health = DeviceHealth.monitor()
+            with ThreadPoolExecutor(max_workers=len(DEVICES)) as pool:
+                futures = [(name, pool.submit(cls.from_vid_pid, 0x0403,
+                                              0x6015))
+                           for name, cls in DEVICES]
+
+            devices = dict()
+            for name, future in futures:
+                try:
+                    devices[name] = future.result()
+                except Exception as e:
+                    self._log.error("Cannot start \"{}\"!".format(name),
+                                    exc_info=True)
+                    health.set(name, Health.DEGRADED, str(e))
+
+            # The sensor needs no initialization.
+            if "ivitmrs" in devices:
+                health.set("ivitmrs", Health.READY)
+
+            deadline = Timer(
+                STARTUP_DEFAULTS.DEADLINE, health.degrade_starting,
+                (list(devices), "not ready in {} s".format(
+                    STARTUP_DEFAULTS.DEADLINE)))
+            deadline.daemon = True
+            deadline.start()
+
+            return devices
+
+        def _device_ready(self, name, update):
+            if DeviceHealth.monitor().is_ready(name):
+                return True
+
+            self._reply(update,
+                        'The device is not ready yet, try again later.')
+            return False
 
         def start(self, bot, update):
             """Send a message when the command /start is issued."""
@@ -179,65 +203,165 @@ class Bot(object):
                                ["/tell_a_joke"]]
             reply_markup = ReplyKeyboardMarkup(
                 custom_keyboard, resize_keyboard=True)
-            update.message.reply_text('Hi!', reply_markup=reply_markup)
+            self._reply(update, 'Hi!', reply_markup=reply_markup)
 
         def _traffic_light(self):
             '''Just for lulz aka test'''
 
-            self._trafflight.tell({
-                "action":
-                TrafficLight.Action.SEQUENCE,
-                "sleep_time":
-                0.1,
-                "colors":
-                (TrafficLight.Color.GREEN, TrafficLight.Color.YELLOW,
-                 TrafficLight.Color.RED, TrafficLight.Color.GREEN,
-                 TrafficLight.Color.YELLOW, TrafficLight.Color.YELLOW,
-                 TrafficLight.Color.GREEN, TrafficLight.Color.RED,
-                 TrafficLight.Color.YELLOW, TrafficLight.Color.GREEN)
-            })
-
-            self._trafflight.tell({
+            colors = (TrafficLight.Color.GREEN, TrafficLight.Color.YELLOW,
+                      TrafficLight.Color.RED, TrafficLight.Color.GREEN,
+                      TrafficLight.Color.YELLOW, TrafficLight.Color.YELLOW,
+                      TrafficLight.Color.GREEN, TrafficLight.Color.RED,
+                      TrafficLight.Color.YELLOW, TrafficLight.Color.GREEN)
+            self._play_effect("traffic light", 0.1 * len(colors), {
+                "action": TrafficLight.Action.SEQUENCE,
+                "sleep_time": 0.1,
+                "colors": colors
+            }, {
                 "action": TrafficLight.Action.OFF,
                 "color": TrafficLight.Color.ALL
             })
 
+        def _door_opened(self):
+            colors = (TrafficLight.Color.GREEN, ) * 6
+            self._play_effect("door opened", 0.5 * len(colors), {
+                "action": TrafficLight.Action.SEQUENCE,
+                "sleep_time": 0.5,
+                "colors": colors
+            })
+
+        def _play_effect(self, name, duration, *messages):
+            # Effects run after the reply and never hold the handler.
+            if self._trafflight:
+                self._effects.tell({
+                    "action": Effects.Action.PLAY,
+                    "effect": Effect(name, self._trafflight, messages,
+                                     duration)
+                })
+
+        @tracing.command("get_temperature_and_humidity")
         def get_temperature_and_humidity(self, bot, update):
+            if not self._device_ready("ivitmrs", update):
+                return
+
             try:
                 msg = 'Temperature: {t:0.1f}{t_units:s}. '\
                     'Humidity: {h:0.1f}{h_units:s}.'.format(
                     t=self._ivt_mrs.temp, t_units=IVIT_MRS_REGS.temp.unit,
                     h=self._ivt_mrs.humidity, h_units=IVIT_MRS_REGS.humidity.unit)
 
-                update.message.reply_text(msg)
+                self._reply(update, msg)
             except Exception as e:
                 self._log.error(
                     "Error while connection with a temp sensor!",
                     exc_info=True)
-                update.message.reply_text('Something goes wrong!')
+                self._reply(update, 'Something goes wrong!')
 
             self._traffic_light()
 
+        @tracing.command("is_paper_left")
         def is_paper_left(self, bot, update):
+            if not self._device_ready("toilet", update):
+                return
+
             try:
-                msg = self._toilet.ask({"action":'is_paper_left'})
-                update.message.reply_text(msg)
+                msg = tracing.ask(self._toilet, {"action": 'is_paper_left'},
+                                  "toilet")
+                self._reply(update, msg)
             except Exception as e:
                 self._log.error(
                     "Error while connection with a paper button!",
                     exc_info=True)
-                update.message.reply_text('Something goes wrong!')
+                self._reply(update, 'Something goes wrong!')
 
+        @tracing.command("get_toilet_score")
         def get_toilet_score(self, bot, update):
+            if not self._device_ready("toilet", update):
+                return
+
             try:
-                msg = self._toilet.ask({"action":'get_paper_score'})
-                update.message.reply_text(msg)
+                msg = tracing.ask(self._toilet, {"action": 'get_paper_score'},
+                                  "toilet")
+                self._reply(update, msg)
             except Exception as e:
                 self._log.error(
                     "Error while connection with a paper module!",
                     exc_info=True)
-                update.message.reply_text('Something goes wrong!')
+                self._reply(update, 'Something goes wrong!')
+
+        @tracing.command("status")
+        def status(self, bot, update):
+            if not self._check_user_access(update):
+                return
+
+            lines = []
+            for name, status in sorted(DeviceHealth.monitor().report().items()):
+                lines.append("{}: {}{}".format(
+                    name, status.health.name.lower(),
+                    " ({})".format(status.reason) if status.reason else ""))
+            for bus in Modbus.stats():
+                lines.append(
+                    "{}: {} transactions, {} errors, {:.0%} busy".format(
+                        bus.port, bus.transactions, bus.errors,
+                        bus.utilization))
+            for queue in Modbus.queue_stats():
+                if queue.requests:
+                    lines.append(
+                        "{} {}: waited {:.0f} ms, at most {:.0f} ms".format(
+                            queue.port, queue.priority.name.lower(),
+                            queue.mean_wait * 1000, queue.max_wait * 1000))
+            effects = self._effects.ask({"action": Effects.Action.STATS})
+            lines.append("effects: {} played, {} collapsed".format(
+                effects.played, effects.collapsed))
+            for slave in Breakers.registry().report():
+                lines.append(
+                    "{} slave {}: {}, timeout {:.2f}s, {} skipped".format(
+                        slave.port, slave.address,
+                        slave.state.name.lower().replace('_', ' '),
+                        slave.timeout, slave.skipped))
+
+            self._reply(update, "\n".join(lines) or "No devices.")
+
+        @tracing.command("history")
+        def history(self, bot, update):
+            """/history <value> [window], e.g. /history temperature 24h"""
+            args = update.message.text.split()[1:]
+            store = History.store()
+            if not args:
+                self._reply(update, "Usage: /history <value> [24h]\n" +
+                            "\n".join("{} {}".format(*key).lower()
+                                      for key in store.names()))
+                return
 
+            window, seconds = "24h", parse_window("24h")
+            if len(args) > 1:
+                try:
+                    seconds = parse_window(args[-1])
+                    window = args.pop()
+                except ValueError:
+                    pass
+
+            found = store.find(" ".join(args))
+            if not found:
+                self._reply(update, "No history of \"{}\".".format(
+                    " ".join(args)))
+                return
+
+            lines = []
+            for series in found:
+                stats = series.stats(seconds)
+                if not stats.count:
+                    lines.append("{} {}: no values in {}".format(
+                        stats.source, stats.name.lower(), window))
+                    continue
+                lines.append(
+                    "{} {}, {}: min {:.1f}{u}, avg {:.1f}{u}, max {:.1f}{u}"
+                    " ({} values)".format(
+                        stats.source, stats.name.lower(), window, stats.min,
+                        stats.avg, stats.max, stats.count, u=stats.unit))
+            self._reply(update, "\n".join(lines))
+
+        @tracing.command("open_door")
         def open_door(self, bot, update):
             self._log.info("User opening door: {}".format(
                 update.message.chat.id))
@@ -245,37 +369,33 @@ class Bot(object):
             if not self._check_user_access(update):
                 return
 
-            update.message.reply_text('Opening the door...')
+            if not self._device_ready("door", update):
+                return
+
+            self._reply(update, 'Opening the door...')
             try:
-                not_is_opened = self._door.ask({"action": DoorAction.OPEN})
+                not_is_opened = tracing.ask(self._door,
+                                            {"action": DoorAction.OPEN},
+                                            "door")
                 if not_is_opened:
-                    update.message.reply_text('The door was opened.')
-                    self._trafflight.tell({
-                        "action":
-                        TrafficLight.Action.SEQUENCE,
-                        "sleep_time":
-                        0.5,
-                        "colors":
-                        (TrafficLight.Color.GREEN, TrafficLight.Color.GREEN,
-                        TrafficLight.Color.GREEN, TrafficLight.Color.GREEN,
-                        TrafficLight.Color.GREEN, TrafficLight.Color.GREEN)
-                    })
+                    self._reply(update, 'The door was opened.')
+                    self._door_opened()
                 else:
-                    update.message.reply_text('The door is already opened.')
+                    self._reply(update, 'The door is already opened.')
             except Exception as e:
                 self._log.error(
                     "Error while connection with a door opener!",
                     exc_info=True)
-                update.message.reply_text('Cannot open the door.')
+                self._reply(update, 'Cannot open the door.')
         
+        @tracing.command("tell_a_joke")
         def tell_a_joke(self,bot,update):
-            url = 'https://bash.im/random/'
-            r = requests.get(url)
-            i = r.text.find('<div class="text">')
-            k = r.text.find('</div>',i)
-            update.message.reply_text(html2text.html2text(r.text[i:k+6]))
+            with tracing.span("joke buffer"):
+                joke = self._jokes.get(JOKE_DEFAULTS.WAIT)
+            self._reply(update, joke or 'No jokes right now, try again later.')
 
 
+        @tracing.command("open_door_2")
         def open_door_2(self, bot, update):
             self._log.info("User opening door: {}".format(
                 update.message.chat.id))
@@ -283,38 +403,41 @@ class Bot(object):
             if not self._check_user_access(update):
                 return
 
-            update.message.reply_text('Opening the door...')
+            if not self._device_ready("door2", update):
+                return
+
+            self._reply(update, 'Opening the door...')
             try:
-                not_is_opened = self._door2.ask({"action": DoorAction2.OPEN})
+                not_is_opened = tracing.ask(self._door2,
+                                            {"action": DoorAction2.OPEN},
+                                            "door2")
                 if not_is_opened:
-                    update.message.reply_text('The door was opened.')
-                    self._trafflight.tell({
-                        "action":
-                        TrafficLight.Action.SEQUENCE,
-                        "sleep_time":
-                        0.5,
-                        "colors":
-                        (TrafficLight.Color.GREEN, TrafficLight.Color.GREEN,
-                        TrafficLight.Color.GREEN, TrafficLight.Color.GREEN,
-                        TrafficLight.Color.GREEN, TrafficLight.Color.GREEN)
-                    })
+                    self._reply(update, 'The door was opened.')
+                    self._door_opened()
                 else:
-                    update.message.reply_text('The door is already opened.')
+                    self._reply(update, 'The door is already opened.')
             except Exception as e:
                 self._log.error(
                     "Error while connection with a door opener!",
                     exc_info=True)
-                update.message.reply_text('Cannot open the door.')
+                self._reply(update, 'Cannot open the door.')
 
 
         def error(self, bot, update, error):
             """Log Errors caused by Updates."""
             self._log.warning('Update "%s" caused error "%s"', update, error)
 
+        def _reply(self, update, text, **kwargs):
+            with tracing.span("reply"):
+                return update.message.reply_text(text, **kwargs)
+
         def _check_user_access(self, update):
-            if update.message.chat.id not in self._full_access_users:
-                update.message.reply_text('Sorry, but this function is not '
-                                          'avaliable for you, pal.')
+            with tracing.span("access"):
+                allowed = update.message.chat.id in self._full_access_users
+
+            if not allowed:
+                self._reply(update, 'Sorry, but this function is not '
+                                    'avaliable for you, pal.')
                 self._log.warn(
                     'An attempt of a restricted access, user {}'.format(
                         update.message.chat.id))
@@ -328,7 +451,13 @@ class Bot(object):
 def main():
     """Start the bot."""
 
-    log = _BotLogger.instance()
+    log = BotLogger.instance()
+
+    # Samples of the polled registers on disk, the bot works without them
+    try:
+        Telemetry.log().start()
+    except OSError:
+        log.warning("Can not log telemetry:", exc_info=True)
 
     # Make a bot instance
     try:
@@ -337,6 +466,12 @@ def main():
         log.error("Can not create a bot instance:", exc_info=True)
         raise e
 
+    # Bus metrics for Prometheus, the bot works without them
+    try:
+        metrics.serve()
+    except OSError:
+        log.warning("Can not serve metrics:", exc_info=True)
+
     # Create the EventHandler and pass it your bot's token.
     updater = Updater(sys.argv[1])
 
@@ -353,6 +488,8 @@ def main():
                        bot.get_temperature_and_humidity))
     dp.add_handler(CommandHandler("get_toilet_score", bot.get_toilet_score))
     dp.add_handler(CommandHandler("is_paper_left", bot.is_paper_left))
+    dp.add_handler(CommandHandler("status", bot.status))
+    dp.add_handler(CommandHandler("history", bot.history))
     
 
     # Log all errors
@@ -0,0 +1,42 @@
+"""Logger and settings shared by ``bot.py`` and ``aiobot.py``."""
+
+import logging
+
+from logging.handlers import RotatingFileHandler
+
+
+class BotLogger():
+    def __init__(self):
+        if not BotLogger.is_inited:
+            __formatter = logging.Formatter(
+                '%(asctime)s_%(name)s_%(levelname)s: %(message)s')
+
+            __ch = logging.StreamHandler()
+            __ch.setFormatter(__formatter)
+            __ch.setLevel(logging.INFO)
+
+            __fh = RotatingFileHandler(
+                "log.txt", maxBytes=1048576, backupCount=5)
+            __fh.setFormatter(__formatter)
+            __fh.setLevel(logging.DEBUG)
+
+            self._logger = logging.getLogger("bot")
+            self._logger.addHandler(__fh)
+            self._logger.addHandler(__ch)
+            self._logger.setLevel(logging.DEBUG)
+
+            BotLogger.is_inited = True
+        else:
+            self._logger = logging.getLogger("bot")
+
+    @property
+    def logger(self):
+        return self._logger
+
+    def instance():
+        return BotLogger()._logger
+
+    is_inited = False
+
+
+FULL_ACCESS_USER_IDS_FILE = "ids.json"
@@ -0,0 +1,223 @@
+"""Jokes for ``/tell_a_joke``, fetched ahead of time.
+
+``JokePrefetcher`` keeps a few parsed jokes in memory and refills the
+buffer from a background thread, so a reply never waits for the site.
+The page is parsed while it downloads and the download stops at the end
+of the first ``<div class="text">``.
+
+``python jokes.py [url]`` fetches and prints one joke.
+"""
+
+import sys
+import time
+import codecs
+import threading
+
+from collections import namedtuple, deque
+from contextlib import closing
+from html.parser import HTMLParser
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from mbdevs.common import Logger
+
+JokeDefaults = namedtuple('JokeDefaults', [
+    'URL', 'BUFFER', 'WAIT', 'CONNECT_TIMEOUT', 'READ_TIMEOUT', 'RETRIES',
+    'CHUNK', 'MAX_BYTES', 'BACKOFF', 'MAX_BACKOFF'
+])
+
+# BUFFER jokes are kept ready, a reply waits at most WAIT seconds for one
+# when they ran out. A page is read in CHUNK bytes and given up after
+# MAX_BYTES without a joke. A failed refill is retried after BACKOFF
+# seconds, doubling up to MAX_BACKOFF.
+JOKE_DEFAULTS = JokeDefaults(
+    URL='https://bash.im/random/',
+    BUFFER=5,
+    WAIT=1,
+    CONNECT_TIMEOUT=3,
+    READ_TIMEOUT=5,
+    RETRIES=2,
+    CHUNK=4096,
+    MAX_BYTES=512 * 1024,
+    BACKOFF=5,
+    MAX_BACKOFF=300)
+
+JokeStats = namedtuple('JokeStats',
+                       ['buffered', 'fetched', 'served', 'empty', 'errors'])
+
+
+class JokeNotFound(IOError):
+    pass
+
+
+class JokeParser(HTMLParser):
+    """Collects the text of the first ``<div class="text">``."""
+
+    def __init__(self):
+        super().__init__()
+        self._depth = 0
+        self._parts = []
+        self.done = False
+
+    @property
+    def text(self):
+        return ''.join(self._parts).strip() if self.done else None
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if self._depth:
+            if tag == 'br':
+                self._parts.append('\n')
+            elif tag == 'div':
+                self._depth += 1
+        elif tag == 'div' and 'text' in (dict(attrs).get('class') or
+                                         '').split():
+            self._depth = 1
+
+    def handle_startendtag(self, tag, attrs):
+        if self._depth and not self.done and tag == 'br':
+            self._parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if self._depth and not self.done and tag == 'div':
+            self._depth -= 1
+            self.done = not self._depth
+
+    def handle_data(self, data):
+        if self._depth and not self.done:
+            self._parts.append(data)
+
+
+def parse_joke(chunks, encoding='utf-8', max_bytes=JOKE_DEFAULTS.MAX_BYTES):
+    """Feeds byte chunks of a page until the joke is complete."""
+    parser = JokeParser()
+    decoder = codecs.getincrementaldecoder(encoding)('replace')
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        parser.feed(decoder.decode(chunk))
+        if parser.done:
+            return parser.text
+        if size >= max_bytes:
+            break
+
+    raise JokeNotFound("No joke in {} bytes of the page".format(size))
+
+
+class JokeClient:
+    """Fetches jokes over a pooled keep-alive session."""
+
+    def __init__(self, url=JOKE_DEFAULTS.URL, config=JOKE_DEFAULTS):
+        self._url = url
+        self._config = config
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=2,
+            max_retries=Retry(
+                total=config.RETRIES,
+                backoff_factor=0.5,
+                status_forcelist=(500, 502, 503, 504)))
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def fetch(self):
+        response = self._session.get(
+            self._url,
+            stream=True,
+            timeout=(self._config.CONNECT_TIMEOUT, self._config.READ_TIMEOUT))
+        # Leaving the page half read drops the connection instead of
+        # downloading the rest just to keep it alive.
+        with closing(response):
+            response.raise_for_status()
+            return parse_joke(
+                response.iter_content(self._config.CHUNK),
+                response.encoding or 'utf-8', self._config.MAX_BYTES)
+
+    def close(self):
+        self._session.close()
+
+
+class JokePrefetcher:
+    """Keeps up to BUFFER jokes ready, refilled by a daemon thread."""
+
+    def __init__(self, client, config=JOKE_DEFAULTS):
+        self._log = Logger.for_name(__name__)
+        self._client = client
+        self._config = config
+        self._cond = threading.Condition()
+        self._jokes = deque(maxlen=config.BUFFER)
+        self._stopped = False
+        self._fetched = 0
+        self._served = 0
+        self._empty = 0
+        self._errors = 0
+
+    def start(self):
+        threading.Thread(
+            target=self._run, name="JokePrefetcher", daemon=True).start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def get(self, timeout=0):
+        """Returns a joke from the buffer, or None if none came in time."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._jokes:
+                left = deadline - time.monotonic()
+                if left <= 0 or self._stopped:
+                    self._empty += 1
+                    return None
+                self._cond.wait(left)
+
+            self._served += 1
+            joke = self._jokes.popleft()
+            self._cond.notify_all()
+            return joke
+
+    def stats(self):
+        with self._cond:
+            return JokeStats(
+                len(self._jokes), self._fetched, self._served, self._empty,
+                self._errors)
+
+    def _run(self):
+        backoff = self._config.BACKOFF
+        while True:
+            with self._cond:
+                while len(self._jokes) >= self._config.BUFFER and \
+                        not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+
+            try:
+                joke = self._client.fetch()
+            except Exception as e:
+                with self._cond:
+                    self._errors += 1
+                self._log.warning(
+                    "Cannot fetch a joke, retry in {} s: {}".format(
+                        backoff, e))
+                with self._cond:
+                    self._cond.wait_for(lambda: self._stopped, backoff)
+                backoff = min(backoff * 2, self._config.MAX_BACKOFF)
+                continue
+
+            backoff = self._config.BACKOFF
+            with self._cond:
+                self._fetched += 1
+                self._jokes.append(joke)
+                self._cond.notify_all()
+
+
+if __name__ == "__main__":
+    client = JokeClient(*sys.argv[1:2])
+    print(client.fetch())
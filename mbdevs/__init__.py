@@ -9,19 +9,32 @@ MB_DEFAULTS = ModBusDefaults(
     MB_BAUDRATE=115200,
     MB_PARITY='N',
     MB_TIMEOUT=3,
-    CLOSE_PORT_AFTER_EACH_CALL=True)
+    CLOSE_PORT_AFTER_EACH_CALL=False)
 
 minimalmodbus.BAUDRATE = MB_DEFAULTS.MB_BAUDRATE
 minimalmodbus.TIMEOUT = MB_DEFAULTS.MB_TIMEOUT
 minimalmodbus.PARITY = MB_DEFAULTS.MB_PARITY
 minimalmodbus.CLOSE_PORT_AFTER_EACH_CALL = MB_DEFAULTS.CLOSE_PORT_AFTER_EACH_CALL
 
+_mb_settings = MB_DEFAULTS
+
 
 def mb_init(baudrate=MB_DEFAULTS.MB_BAUDRATE,
             parity=MB_DEFAULTS.MB_PARITY,
             timeout=MB_DEFAULTS.MB_TIMEOUT,
             close_port_after_each_call=MB_DEFAULTS.CLOSE_PORT_AFTER_EACH_CALL):
+    global _mb_settings
+    _mb_settings = ModBusDefaults(
+        MB_BAUDRATE=baudrate,
+        MB_PARITY=parity,
+        MB_TIMEOUT=timeout,
+        CLOSE_PORT_AFTER_EACH_CALL=close_port_after_each_call)
+
     minimalmodbus.BAUDRATE = baudrate
     minimalmodbus.PARITY = parity
     minimalmodbus.TIMEOUT = timeout
     minimalmodbus.CLOSE_PORT_AFTER_EACH_CALL = close_port_after_each_call
+
+
+def mb_settings():
+    return _mb_settings
@@ -0,0 +1,328 @@
+"""The devices of the bot on an asyncio event loop.
+
+They are built from the same definitions as the actors: the schema
+devices (doors, emergency button, toilet dudka) from their schemas in
+``mbdevs/schemas``, the toilet from ``toilet.ToiletButtons``, the traffic
+light from the patterns of ``trafflight`` and the door interlock from
+``doorinterlock.DoublePress``. Health goes to ``DeviceHealth`` like the
+actors' and the bus goes through ``aiortu.AsyncRtuClient``.
+"""
+
+import time
+import asyncio
+
+from collections import deque
+from functools import partial
+from . import trafflight
+from .aiortu import AsyncModbusUser
+from .common import Logger
+from .device import Reactions, load_schema
+from .doorinterlock import INTERLOCK_DEFAULTS, DoublePress
+from .events import Edge, EdgeDetector
+from .exceptions import CannotReadARegisterValue
+from .health import DeviceHealth, Health, STARTUP_DEFAULTS
+from .ivitmrs import HISTORY_PERIOD, IvitMRS, REGS as IVIT_MRS_REGS
+from .toilet import REGS as TOILET_REGS, ToiletButtons
+from .trafflight import TrafficLight
+
+
+async def poll_forever(period, poll):
+    """Awaits ``poll()`` every ``period`` seconds without drifting."""
+    log = Logger.for_name(__name__)
+    next_due = time.monotonic()
+    while True:
+        try:
+            await poll()
+        except CannotReadARegisterValue as e:
+            log.warning(str(e))
+        except Exception:
+            log.error("Poll failed!", exc_info=True)
+        next_due = max(next_due + period, time.monotonic())
+        await asyncio.sleep(next_due - time.monotonic())
+
+
+class _AsyncPublisher:
+    def __init__(self):
+        self._subscribers = []
+
+    def subscribe(self, callback, names=None):
+        self._subscribers.append((callback, frozenset(names)
+                                  if names else None))
+
+    def publish(self, events):
+        for event in events:
+            for callback, names in self._subscribers:
+                if names is None or event.name in names:
+                    callback(event)
+
+
+class AsyncStartup:
+    """The asyncio ``health.DeviceStartup``.
+
+    ``start()`` runs ``_initialize()`` until the device takes its
+    configuration, the device is degraded meanwhile.
+    """
+
+    startup_retry = STARTUP_DEFAULTS.RETRY
+
+    async def start(self):
+        health = DeviceHealth.monitor()
+        health.set(self.health_name, Health.STARTING)
+        while True:
+            try:
+                ready = await self._initialize() is not False
+                reason = "device does not answer"
+            except Exception as e:
+                self._log.error(
+                    "Cannot initialize \"{}\"!".format(self.health_name),
+                    exc_info=True)
+                ready = False
+                reason = str(e)
+
+            if ready:
+                health.set(self.health_name, Health.READY)
+                return
+            health.set(self.health_name, Health.DEGRADED, reason)
+            await asyncio.sleep(self.startup_retry)
+
+    async def _initialize(self):
+        return True
+
+
+class AsyncDevice(AsyncStartup, AsyncModbusUser):
+    """A schema device, see ``device.ModbusDevice``.
+
+    ``act(name)`` runs an action of the schema, the later steps in a task;
+    an exclusive action returns False while its steps run.
+    """
+
+    def __init__(self, client, schema, tasks, dev_addr=None):
+        super().__init__(client, dev_addr or schema.address, tasks)
+        self.schema = schema
+        self.health_name = schema.name
+        self.values = dict()
+        self.events = _AsyncPublisher()
+        self._fields = dict((reg, field)
+                            for field, reg in schema.regs.items())
+        self._reactions = Reactions(schema)
+        self._running = set()
+        self._edges = dict(
+            (poll.name,
+             EdgeDetector(schema.name, [self._fields[reg]
+                                        for reg in poll.regs]))
+            for poll in schema.polls if poll.events)
+
+    async def _initialize(self):
+        if not self.schema.config:
+            return True
+        return await self._write_many(tuple(self.schema.config),
+                                      tuple(self.schema.config.values()))
+
+    def start_polling(self):
+        for poll in self.schema.polls:
+            self._tasks.spawn(
+                poll_forever(poll.period, partial(self._poll, poll)))
+
+    async def _poll(self, poll):
+        values = await self.poll(poll.regs)
+        for reg, value in zip(poll.regs, values):
+            self.values[self._fields[reg]] = value
+        for name in self._reactions.update(poll.regs, values):
+            await self.act(name)
+        if poll.name in self._edges:
+            self.events.publish(self._edges[poll.name].update(values))
+
+    async def act(self, name):
+        spec = self.schema.actions[name]
+        if spec.exclusive and name in self._running:
+            return False
+
+        self._log.info("\"{}\": {}".format(self.health_name, name))
+        first = spec.steps[0]
+        await self._write_many(first.regs, first.values)
+        if len(spec.steps) > 1:
+            self._running.add(name)
+            self._tasks.spawn(self._later_steps(spec))
+        return True
+
+    async def _later_steps(self, spec):
+        try:
+            for step in spec.steps[1:]:
+                await asyncio.sleep(step.delay)
+                await self._write_many(step.regs, step.values)
+        finally:
+            self._running.discard(spec.name)
+
+
+def schema_device(name, client, tasks, dev_addr=None):
+    """``AsyncDevice`` of the schema ``mbdevs/schemas/<name>.json``."""
+    return AsyncDevice(client, load_schema(name), tasks, dev_addr)
+
+
+class AsyncDoorInterlock:
+    """The asyncio ``DoorInterlock``: double press opens the other door.
+
+    ``doors`` maps an event source to the ``AsyncDevice`` door it opens.
+    """
+
+    def __init__(self, doors, tasks, config=INTERLOCK_DEFAULTS):
+        self._log = Logger.for_name(__name__)
+        self._config = config
+        self._doors = doors
+        self._tasks = tasks
+        self._presses = {source: DoublePress(config) for source in doors}
+        self._pulsing = dict()
+
+    def on_event(self, event):
+        presses = self._presses.get(event.source)
+        if presses is None or not presses.update(event):
+            return
+
+        self._log.info("Door button \"{}\" pressed twice".format(
+            event.source))
+        task = self._pulsing.get(event.source)
+        if task:
+            task.cancel()
+        self._pulsing[event.source] = self._tasks.spawn(
+            self._pulses(self._doors[event.source], event.time))
+
+    async def _pulses(self, door, press_time):
+        at = press_time + self._config.FIRST_PULSE
+        for _ in range(self._config.PULSES):
+            await asyncio.sleep(max(0, at - time.monotonic()))
+            await door.act("OPEN")
+            lag = time.monotonic() - at
+            if lag > self._config.LATENCY_BOUND:
+                self._log.warning("Door pulse is {:.0f} ms late".format(
+                    lag * 1000))
+            at += self._config.PULSE_PERIOD
+
+
+class AsyncTrafficLight(AsyncStartup, AsyncModbusUser):
+    health_name = TrafficLight.health_name
+
+    def __init__(self, client, tasks, dev_addr=2):
+        super().__init__(client, dev_addr, tasks)
+        self._values = (False, False, False)
+        self._patterns = deque()
+        self._player = None
+
+    async def _initialize(self):
+        regs = trafflight.REGS
+        ok = await self._write_many(
+            (regs.red_config, regs.yellow_config, regs.green_config),
+            (1, 1, 1))
+        await self._show((False, False, False))
+        return ok
+
+    async def _show(self, values):
+        self._values = tuple(values)
+        await self._write_many(trafflight.LIGHTS, [int(v) for v in values])
+
+    def turn_on(self, color):
+        self._submit(partial(trafflight.compile_set, color, True))
+
+    def turn_off(self, color):
+        self._submit(partial(trafflight.compile_set, color, False))
+
+    def toggle(self, colors):
+        self._submit(partial(trafflight.compile_toggle, colors))
+
+    def sequence(self, sleep_time, colors, replace=False):
+        self._submit(
+            partial(trafflight.compile_sequence, sleep_time, colors), replace)
+
+    def cancel(self):
+        self._patterns.clear()
+        if self._player:
+            self._player.cancel()
+            self._player = None
+
+    def _submit(self, compile, replace=False):
+        if replace:
+            self.cancel()
+        self._patterns.append(compile)
+        if self._player is None or self._player.done():
+            self._player = self._tasks.spawn(self._play())
+
+    async def _play(self):
+        while self._patterns:
+            for frame in self._patterns.popleft()(self._values):
+                if frame.values != self._values:
+                    await self._show(frame.values)
+                if frame.delay:
+                    await asyncio.sleep(frame.delay)
+
+
+class AsyncToilet(AsyncStartup, AsyncModbusUser):
+    health_name = "toilet"
+
+    def __init__(self, client, tasks, dev_addr=5):
+        super().__init__(client, dev_addr, tasks)
+        self.buttons = ToiletButtons()
+        self.events = _AsyncPublisher()
+
+    async def _initialize(self):
+        regs = TOILET_REGS
+        ok = await self._write_many(
+            (regs.button_end_config, regs.button_like_config,
+             regs.button_dislike_config, regs.lamp_config_button,
+             regs.lamp_config_green, regs.lamp_config_red,
+             regs.lamp_config_connection),
+            (0, 0, 0, 1, 1, 1, 1))
+        return ok and await self._write_reg(regs.lamp_connection, 1)
+
+    def start_polling(self, period=0.05):
+        self._tasks.spawn(poll_forever(period, self._button_check))
+
+    async def _button_check(self):
+        regs = TOILET_REGS
+        writes, events = self.buttons.update(await self.poll(
+            (regs.button_end, regs.button_like, regs.button_dislike)))
+        if writes:
+            await self._write_many(*zip(*writes))
+        self.events.publish(events)
+
+
+class AsyncIvitMRS(AsyncModbusUser):
+    health_name = IvitMRS.history_source
+    cache_ttls = IvitMRS.cache_ttls
+
+    def __init__(self, client, tasks, dev_addr=247):
+        super().__init__(client, dev_addr, tasks)
+
+    def start_polling(self):
+        self._tasks.spawn(poll_forever(
+            HISTORY_PERIOD,
+            partial(self.poll, (IVIT_MRS_REGS.temp, IVIT_MRS_REGS.humidity))))
+
+    async def temp_and_humidity(self):
+        return await self.read_many((IVIT_MRS_REGS.temp,
+                                     IVIT_MRS_REGS.humidity))
+
+
+class AsyncPaperAlarm:
+    """The asyncio ``_PaperAlarm`` of the bot."""
+
+    def __init__(self, toiletdudka, trafflight, tasks):
+        self._toiletdudka = toiletdudka
+        self._trafflight = trafflight
+        self._tasks = tasks
+        self._task = None
+
+    def on_event(self, event):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if event.edge == Edge.RISING:
+            self._task = self._tasks.spawn(poll_forever(0.5, self._alarm))
+        else:
+            self._tasks.spawn(self._toiletdudka.act("SOUND_OFF"))
+            self._trafflight.turn_off(TrafficLight.Color.ALL)
+
+    async def _alarm(self):
+        await self._toiletdudka.act("SOUND_ON")
+        self._trafflight.sequence(
+            0.05, (TrafficLight.Color.GREEN, TrafficLight.Color.YELLOW,
+                   TrafficLight.Color.RED, TrafficLight.Color.GREEN,
+                   TrafficLight.Color.YELLOW, TrafficLight.Color.RED))
@@ -0,0 +1,294 @@
+import time
+import asyncio
+import serial
+
+from . import planner, rtu
+from .breaker import Breakers
+from .cache import RegisterCache
+from .common import Logger
+from .exceptions import CannotReadARegisterValue, ModbusNoResponse
+from .history import History
+from .modbus import CoilShadow, error_kind
+from .telemetry import Telemetry
+
+
+class Tasks:
+    """Tasks of the asyncio runtime, kept until they end.
+
+    A task which fails is logged when it ends, ``cancel_all()`` stops the
+    ones still running on shutdown.
+    """
+
+    def __init__(self):
+        self._log = Logger.for_name(__name__)
+        self._tasks = set()
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self._log.error("Task failed!", exc_info=task.exception())
+
+    async def cancel_all(self):
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class AsyncRtuClient:
+    """Modbus RTU master for an asyncio event loop.
+
+    The serial port is non-blocking and read through ``add_reader``, so a
+    transaction never blocks the loop. One client owns the line; its lock
+    keeps transactions of all devices strictly one after another.
+
+    Like the ``Modbus`` actor, a slave which stopped answering is skipped
+    by its breaker and gets an adaptive timeout, and the coil writes go
+    to the shadow of the port.
+    """
+
+    def __init__(self, port, baudrate, parity='N', timeout=3):
+        self._log = Logger.for_name(__name__)
+        self._loop = None
+        self._lock = asyncio.Lock()
+        self._timeout = timeout
+        self._serial = serial.Serial(
+            baudrate=baudrate, parity=parity, bytesize=8, stopbits=1,
+            timeout=0)
+        self._serial.port = str(port)
+        char_time = (10 if parity == 'N' else 11) / baudrate
+        self._silent = max(3.5 * char_time, 0.00175)
+        self._last_io = 0
+        self._buffer = bytearray()
+        self._waiter = None
+        self._expected = 0
+        self.opens = 0
+
+    @property
+    def port(self):
+        return self._serial.port
+
+    def open(self):
+        """Opens the port, called on the event loop of the client."""
+        self._loop = asyncio.get_running_loop()
+        self._serial.open()
+        self._loop.add_reader(self._serial.fileno(), self._on_readable)
+        self.opens += 1
+        self._log.info('Port {} opened'.format(self.port))
+
+    def close(self):
+        if self._serial.is_open:
+            self._loop.remove_reader(self._serial.fileno())
+            self._serial.close()
+
+    def _on_readable(self):
+        self._buffer.extend(self._serial.read(self._serial.in_waiting or 1))
+        if self._waiter and not self._waiter.done():
+            if len(self._buffer) >= self._expected or \
+               (len(self._buffer) >= 5 and self._buffer[1] & rtu.EXCEPTION_FLAG):
+                self._waiter.set_result(None)
+
+    async def transact(self, slave, request):
+        """Sends a request PDU and returns the parsed response."""
+        breaker = Breakers.registry().breaker(self.port, slave)
+        if not breaker.allow():
+            raise ModbusNoResponse("Slave {} on {} is skipped".format(
+                slave, self.port))
+
+        try:
+            rtt, response = await self._transact(
+                slave, request, breaker.timeout(self._timeout))
+        except Exception as e:
+            # An exception response is an answer, but not a clean one.
+            if error_kind(e) != 'slave':
+                breaker.failure()
+            CoilShadow.for_port(self.port).forget_slave(slave)
+            raise
+
+        breaker.success(rtt)
+        return response
+
+    async def _transact(self, slave, request, timeout):
+        async with self._lock:
+            wait = self._silent - (time.monotonic() - self._last_io)
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            self._buffer = bytearray()
+            self._expected = rtu.response_length(request) + 3
+            self._waiter = asyncio.get_running_loop().create_future()
+            self._serial.reset_input_buffer()
+            start = time.perf_counter()
+            self._serial.write(rtu.frame(slave, request))
+            try:
+                await asyncio.wait_for(self._waiter, timeout)
+            except asyncio.TimeoutError:
+                raise ModbusNoResponse(
+                    "No answer from slave {} on {}".format(slave, self.port))
+            finally:
+                self._waiter = None
+                self._last_io = time.monotonic()
+
+            rtt = time.perf_counter() - start
+            adu = bytes(self._buffer[:self._expected])
+
+        _, response = rtu.unframe(adu if len(adu) == self._expected else
+                                  adu[:5])
+        return rtt, rtu.parse_response(request, response)
+
+    async def read_bits(self, slave, addr, count, func_code):
+        return await self.transact(slave,
+                                   rtu.read_request(func_code, addr, count))
+
+    async def read_registers(self, slave, addr, count, func_code):
+        return await self.transact(slave,
+                                   rtu.read_request(func_code, addr, count))
+
+    async def write_bit(self, slave, addr, value):
+        await self.transact(slave, rtu.write_bit_request(addr, value))
+        CoilShadow.for_port(self.port).set(slave, addr, value)
+
+    async def write_bits(self, slave, addr, values):
+        await self.transact(slave, rtu.write_bits_request(addr, values))
+        shadow = CoilShadow.for_port(self.port)
+        for i, value in enumerate(values):
+            shadow.set(slave, addr + i, value)
+
+    async def write_registers(self, slave, addr, values):
+        if len(values) == 1:
+            await self.transact(slave,
+                                rtu.write_register_request(addr, values[0]))
+        else:
+            await self.transact(slave,
+                                rtu.write_registers_request(addr, values))
+
+
+class AsyncModbusUser:
+    """Register level access to one slave, the asyncio ``ModbusUser``.
+
+    Takes the ``cache_ttls`` of the ``ModbusUser`` and drops a coil write
+    which would not change the value in the shadow of the port.
+    """
+
+    read_gaps = (planner.PLANNER_DEFAULTS.BIT_GAP,
+                 planner.PLANNER_DEFAULTS.WORD_GAP)
+
+    # Register -> seconds its value may be served from the cache.
+    cache_ttls = dict()
+
+    health_name = None
+
+    def __init__(self, client, dev_addr, tasks):
+        self._client = client
+        self._addr = dev_addr
+        self._tasks = tasks
+        self._log = Logger.for_name(__name__)
+        self._read_plans = dict()
+        self._cache = RegisterCache(self.cache_ttls)
+        self._shadow = CoilShadow.for_port(client.port)
+        self.suppressed_writes = 0
+
+    @property
+    def history_source(self):
+        """Name of the device in ``mbdevs.history``."""
+        return self.health_name or "slave {}".format(self._addr)
+
+    async def poll(self, regs):
+        """Reads ``regs`` for a poll, recorded like the scheduler's polls."""
+        values = await self.read_many(regs)
+        History.store().record_regs(self.history_source, regs, values)
+        Telemetry.log().record_regs(self._client.port, self._addr, regs,
+                                    values)
+        return values
+
+    async def read_many(self, regs):
+        regs = tuple(regs)
+        if not any(self._cache.ttl(reg) for reg in regs):
+            return await self._read_many(regs)
+
+        cached, token = self._cache.lookup(regs)
+        missing = tuple(reg for reg in regs if reg not in cached)
+        if missing:
+            loaded = dict(zip(missing, await self._read_many(missing)))
+            self._cache.store(loaded, token)
+            cached.update(loaded)
+        return [cached[reg] for reg in regs]
+
+    async def _read_many(self, regs):
+        plan = self._read_plans.get(regs)
+        if plan is None:
+            plan = planner.plan_reads(regs, *self.read_gaps)
+            self._read_plans[regs] = plan
+
+        decoded = dict()
+        for block in plan:
+            try:
+                if planner.is_bit(block.regs[0]):
+                    raw = await self._client.read_bits(
+                        self._addr, block.addr, block.count,
+                        block.func_code.value.read)
+                else:
+                    raw = await self._client.read_registers(
+                        self._addr, block.addr, block.count,
+                        block.func_code.value.read)
+            except IOError:
+                self._log.error(
+                    "Cannot read registers {}!".format(", ".join(
+                        "\"{}\"".format(reg.name) for reg in block.regs)),
+                    exc_info=True)
+                raise CannotReadARegisterValue(block.regs[0])
+
+            for reg, decode in block.decoders:
+                decoded[reg] = decode(raw)
+
+        return [decoded[reg] for reg in regs]
+
+    async def _read_reg(self, reg):
+        return (await self.read_many((reg, )))[0]
+
+    async def _write_reg(self, reg, val):
+        return await self._write_many((reg, ), (val, ))
+
+    async def _write_many(self, regs, values):
+        """Returns False if some of the registers were not written."""
+        self._cache.invalidate(regs)
+        self._shadow.check_opens(self._client.opens)
+        writes = []
+        for reg, value in zip(regs, values):
+            if planner.is_bit(reg) and \
+               self._shadow.get(self._addr, reg.addr) == bool(value):
+                self.suppressed_writes += 1
+                continue
+            writes.append((reg, value))
+        if not writes:
+            return True
+
+        regs, values = zip(*writes)
+        self._shadow.forget(self._addr,
+                            [reg.addr for reg in regs if planner.is_bit(reg)])
+        ok = True
+        for block in planner.plan_writes(regs, values):
+            try:
+                if planner.is_bit(block.regs[0]) and len(block.regs) > 1:
+                    await self._client.write_bits(self._addr, block.addr,
+                                                  block.values)
+                elif planner.is_bit(block.regs[0]):
+                    await self._client.write_bit(self._addr, block.addr,
+                                                 block.values[0])
+                else:
+                    await self._client.write_registers(
+                        self._addr, block.addr,
+                        planner.encode(block.regs[0], block.values[0]))
+            except IOError:
+                ok = False
+                self._log.error(
+                    "Cannot write to registers {}!".format(", ".join(
+                        "\"{}\"".format(reg.name) for reg in block.regs)),
+                    exc_info=True)
+        return ok
@@ -0,0 +1,154 @@
+import enum
+import time
+import threading
+
+from collections import namedtuple, deque
+from .common import Logger
+
+BreakerDefaults = namedtuple('BreakerDefaults', [
+    'FAILURES', 'PROBE_INTERVAL', 'MAX_PROBE_INTERVAL', 'RTT_FACTOR',
+    'MIN_TIMEOUT', 'MIN_SAMPLES', 'WINDOW'
+])
+
+# A slave is skipped after FAILURES failed transactions in a row (no
+# answer, a CRC error or an invalid response) and probed every
+# PROBE_INTERVAL seconds, doubling up to MAX_PROBE_INTERVAL. Its timeout
+# is RTT_FACTOR times the p99 of the last WINDOW round trips, once there
+# are MIN_SAMPLES of them.
+BREAKER_DEFAULTS = BreakerDefaults(
+    FAILURES=3,
+    PROBE_INTERVAL=5,
+    MAX_PROBE_INTERVAL=60,
+    RTT_FACTOR=4,
+    MIN_TIMEOUT=0.1,
+    MIN_SAMPLES=8,
+    WINDOW=64)
+
+SlaveStatus = namedtuple('SlaveStatus', [
+    'port', 'address', 'state', 'failures', 'skipped', 'p99', 'timeout'
+])
+
+
+class BreakerState(enum.Enum):
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+
+class SlaveBreaker:
+    """Round trip statistics and the circuit breaker of one slave."""
+
+    def __init__(self, port, address, config=BREAKER_DEFAULTS):
+        self._log = Logger.for_name(__name__)
+        self._lock = threading.Lock()
+        self._config = config
+        self._rtts = deque(maxlen=config.WINDOW)
+        self._interval = config.PROBE_INTERVAL
+        self._next_probe = 0
+
+        self.port = port
+        self.address = address
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.skipped = 0
+
+    @property
+    def p99(self):
+        with self._lock:
+            return self._p99()
+
+    def _p99(self):
+        if len(self._rtts) < self._config.MIN_SAMPLES:
+            return None
+        rtts = sorted(self._rtts)
+        return rtts[min(len(rtts) - 1, int(len(rtts) * 0.99))]
+
+    def timeout(self, default):
+        """Timeout for the next transaction, at most ``default``."""
+        with self._lock:
+            p99 = self._p99()
+        if p99 is None:
+            return default
+        return min(default,
+                   max(self._config.MIN_TIMEOUT, p99 * self._config.RTT_FACTOR))
+
+    def allow(self):
+        """False while the slave is skipped, True for a probe or when closed."""
+        with self._lock:
+            if self.state == BreakerState.CLOSED:
+                return True
+
+            now = time.monotonic()
+            if now < self._next_probe:
+                self.skipped += 1
+                return False
+            self.state = BreakerState.HALF_OPEN
+            # Other transactions keep skipping until the probe is answered.
+            self._next_probe = now + self._interval
+            return True
+
+    def success(self, rtt):
+        with self._lock:
+            self._rtts.append(rtt)
+            self.failures = 0
+            if self.state != BreakerState.CLOSED:
+                self.state = BreakerState.CLOSED
+                self._interval = self._config.PROBE_INTERVAL
+                self._log.info("Slave {} on {} is back".format(
+                    self.address, self.port))
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == BreakerState.HALF_OPEN:
+                self.state = BreakerState.OPEN
+                self._interval = min(self._interval * 2,
+                                     self._config.MAX_PROBE_INTERVAL)
+                self._next_probe = time.monotonic() + self._interval
+            elif self.state == BreakerState.CLOSED and \
+                    self.failures >= self._config.FAILURES:
+                self.state = BreakerState.OPEN
+                self._next_probe = time.monotonic() + self._interval
+                self._log.warning(
+                    "Slave {} on {} does not answer, skipping it".format(
+                        self.address, self.port))
+
+    def status(self, default_timeout):
+        return SlaveStatus(self.port, self.address, self.state, self.failures,
+                           self.skipped, self.p99,
+                           self.timeout(default_timeout))
+
+
+class Breakers:
+    """Breakers of all the slaves, by port and address."""
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    @classmethod
+    def registry(cls):
+        with cls.__instance_lock:
+            if not cls.__instance:
+                cls.__instance = cls()
+
+        return cls.__instance
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers = dict()
+
+    def breaker(self, port, address):
+        key = (port, address)
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = SlaveBreaker(port, address)
+                self._breakers[key] = breaker
+            return breaker
+
+    def report(self):
+        from . import mb_settings
+
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return [b.status(mb_settings().MB_TIMEOUT) for b in breakers]
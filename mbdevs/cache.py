@@ -0,0 +1,135 @@
+import time
+import threading
+
+from collections import namedtuple
+
+CacheStats = namedtuple('CacheStats', ['hits', 'misses', 'coalesced'])
+
+
+class _Pending:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.stale = False
+
+
+class RegisterCache:
+    """Read-through cache of register values with a TTL per register.
+
+    Concurrent reads of a register which is already being read wait for
+    that bus transaction instead of starting a new one. A read which was
+    in flight when its register was invalidated is returned to its
+    callers but not cached.
+
+    ``lookup()`` and ``store()`` are the same cache for callers which must
+    not block, like the asyncio devices.
+    """
+
+    def __init__(self, ttls):
+        self._ttls = dict(ttls)
+        self._lock = threading.Lock()
+        self._values = dict()
+        self._pending = dict()
+        self._generation = 0
+        self._invalidated = dict()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def ttl(self, reg):
+        return self._ttls.get(reg, 0)
+
+    def read(self, regs, load):
+        """Returns the values of ``regs`` in order.
+
+        ``load`` is called with the registers which are neither cached nor
+        being read and must return their values in the same order.
+        """
+        now = time.monotonic()
+        values = dict()
+        own = []
+        others = []
+
+        with self._lock:
+            for reg in regs:
+                cached = self._values.get(reg)
+                if cached and cached[1] > now:
+                    self.hits += 1
+                    values[reg] = cached[0]
+                elif reg in self._pending:
+                    self.coalesced += 1
+                    others.append((reg, self._pending[reg]))
+                else:
+                    self.misses += 1
+                    pending = _Pending()
+                    self._pending[reg] = pending
+                    own.append((reg, pending))
+
+        if own:
+            self._load(own, load, values)
+
+        for reg, pending in others:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            values[reg] = pending.value
+
+        return [values[reg] for reg in regs]
+
+    def _load(self, own, load, values):
+        error = None
+        try:
+            loaded = load([reg for reg, _ in own])
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            now = time.monotonic()
+            with self._lock:
+                for i, (reg, pending) in enumerate(own):
+                    del self._pending[reg]
+                    if error is None:
+                        pending.value = values[reg] = loaded[i]
+                        if not pending.stale:
+                            self._values[reg] = (loaded[i],
+                                                 now + self.ttl(reg))
+                    else:
+                        pending.error = error
+                    pending.event.set()
+
+    def lookup(self, regs):
+        """Returns the cached values of ``regs`` and a token for ``store()``."""
+        now = time.monotonic()
+        values = dict()
+        with self._lock:
+            for reg in regs:
+                cached = self._values.get(reg)
+                if cached and cached[1] > now:
+                    self.hits += 1
+                    values[reg] = cached[0]
+                else:
+                    self.misses += 1
+            return values, self._generation
+
+    def store(self, values, token):
+        """Caches the read ``values`` unless invalidated since ``lookup()``."""
+        now = time.monotonic()
+        with self._lock:
+            for reg, value in values.items():
+                if self._invalidated.get(reg, -1) <= token:
+                    self._values[reg] = (value, now + self.ttl(reg))
+
+    def invalidate(self, regs):
+        with self._lock:
+            self._generation += 1
+            for reg in regs:
+                self._invalidated[reg] = self._generation
+                self._values.pop(reg, None)
+                pending = self._pending.get(reg)
+                if pending is not None:
+                    pending.stale = True
+
+    def stats(self):
+        return CacheStats(self.hits, self.misses, self.coalesced)
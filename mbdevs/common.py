@@ -1,6 +1,5 @@
 import time
 import logging
-import serial.tools.list_ports
 
 from collections import namedtuple
 from .exceptions import ComDeviceNotFound
@@ -43,14 +42,17 @@ class Logger():
         return _Logger(name).logger
 
 
-def find_device(vid, pid):
+def find_device(vid, pid, serial_number=None):
+    from .ports import PortRegistry
+
     log = Logger.for_name(__name__)
 
-    for p in list(serial.tools.list_ports.comports()):
-        if (p.vid == vid) and (p.pid == pid):
-            log.info("Device {vid}:{pid} found: {com}!".format(
-                vid=vid, pid=pid, com=p.device))
-            return p
-    log.error("Device not found!")
-    raise ComDeviceNotFound(
-        "Not found any devices with VID:PID = {vid}:{pid}".format(**locals()))
+    try:
+        p = PortRegistry.registry().find(vid, pid, serial_number)
+    except ComDeviceNotFound:
+        log.error("Device not found!")
+        raise
+
+    log.info("Device {vid}:{pid} found: {com}!".format(
+        vid=vid, pid=pid, com=p.device))
+    return p
@@ -0,0 +1,173 @@
+import time
+import threading
+import serial
+import minimalmodbus
+
+from collections import namedtuple
+from .common import Logger
+
+ConnectionStats = namedtuple(
+    'ConnectionStats', ['port', 'is_open', 'opens', 'reopens', 'failures'])
+
+BackoffDefaults = namedtuple('BackoffDefaults', ['initial', 'factor', 'max'])
+
+BACKOFF_DEFAULTS = BackoffDefaults(initial=0.05, factor=2, max=5.0)
+
+# Ports given as URLs of these schemes are Modbus gateways, see mbdevs.tcp.
+TCP_SCHEMES = ('tcp', 'rtu+tcp')
+
+
+def is_tcp_url(port):
+    scheme, sep, _ = str(port).partition('://')
+    return bool(sep) and scheme in TCP_SCHEMES
+
+
+class SerialConnection:
+    """A persistent serial port shared by every instrument on the line.
+
+    The port is opened once and stays open. After an I/O error the port is
+    reopened on the next transaction, with exponential backoff between
+    failed attempts so a pulled adapter does not spin the bus actor.
+    """
+
+    def __init__(self, port, backoff=BACKOFF_DEFAULTS):
+        from . import mb_settings
+
+        self._log = Logger.for_name(__name__)
+        self._lock = threading.RLock()
+        self._backoff = backoff
+        self._delay = 0
+        self._next_attempt = 0
+        self._broken = False
+
+        self.opens = 0
+        self.reopens = 0
+        self.failures = 0
+
+        settings = mb_settings()
+        self._serial = serial.Serial(
+            baudrate=settings.MB_BAUDRATE,
+            parity=settings.MB_PARITY,
+            bytesize=8,
+            stopbits=1,
+            timeout=settings.MB_TIMEOUT)
+        self._serial.port = str(port)
+        self._open()
+
+    @property
+    def port(self):
+        return self._serial.port
+
+    @property
+    def serial(self):
+        return self._serial
+
+    def stats(self):
+        return ConnectionStats(self.port, self._serial.is_open, self.opens,
+                               self.reopens, self.failures)
+
+    def _open(self):
+        self._serial.open()
+        self.opens += 1
+        self._log.info('Port {} opened'.format(self.port))
+
+    def mark_broken(self):
+        """Schedules a reopen before the next transaction."""
+        with self._lock:
+            self.failures += 1
+            self._broken = True
+
+    def ensure_open(self):
+        """Reopens the port if it was marked broken.
+
+        Returns False while the backoff period after a failed reopen is
+        still running, so the caller can fail the transaction fast.
+        """
+        with self._lock:
+            if not self._broken and self._serial.is_open:
+                return True
+
+            now = time.monotonic()
+            if now < self._next_attempt:
+                return False
+
+            try:
+                self._serial.close()
+                self._open()
+            except serial.SerialException:
+                self._delay = min(
+                    max(self._delay * self._backoff.factor,
+                        self._backoff.initial), self._backoff.max)
+                self._next_attempt = now + self._delay
+                self._log.error(
+                    'Cannot reopen port {}, next attempt in {:.2f} s'.format(
+                        self.port, self._delay))
+                return False
+
+            self.reopens += 1
+            self._broken = False
+            self._delay = 0
+            self._next_attempt = 0
+            return True
+
+    def close(self):
+        with self._lock:
+            self._serial.close()
+
+
+class ConnectionManager:
+    """Keeps one open ``SerialConnection`` per physical port."""
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    @classmethod
+    def manager(cls):
+        with cls.__instance_lock:
+            if not cls.__instance:
+                cls.__instance = cls()
+
+        return cls.__instance
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections = dict()
+
+    def connection(self, port):
+        port = str(port)
+        with self._lock:
+            conn = self._connections.get(port)
+            if conn is None:
+                conn = SerialConnection(port)
+                self._connections[port] = conn
+            return conn
+
+    def connection_for(self, instrument):
+        with self._lock:
+            return self._connections.get(instrument.serial.port)
+
+    def instrument(self, port, dev_addr):
+        """Creates an RTU instrument bound to the shared port of ``port``.
+
+        For a gateway URL the instrument talks to the shared gateway client.
+        """
+        if is_tcp_url(port):
+            from .tcp import TcpInstrument, gateway
+            return TcpInstrument(gateway(port), dev_addr)
+
+        conn = self.connection(port)
+        mb = minimalmodbus.Instrument(conn.serial, dev_addr, mode='rtu')
+        mb.close_port_after_each_call = False
+        return mb
+
+    def stats(self):
+        with self._lock:
+            return [conn.stats() for conn in self._connections.values()]
+
+    def close_all(self):
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+
+        from .tcp import close_gateways
+        close_gateways()
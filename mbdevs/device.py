@@ -0,0 +1,364 @@
+"""Modbus devices defined by a schema instead of code.
+
+A schema (``mbdevs/schemas/<name>.json``) lists the registers of a device,
+the values written to its config registers on start, its poll groups and
+its actions::
+
+    {
+        "name": "door", "class": "DoorOpener", "address": 1,
+        "bus_priority": "INTERACTIVE",
+        "registers": {
+            "door": {"name": "Door", "addr": 8, "type": "coil"},
+            "door_button": {"name": "Door Button", "addr": 4103,
+                            "type": "discrete"}
+        },
+        "config": {"door_button": 0},
+        "polls": [{"name": "door button", "period": 0.05,
+                   "registers": ["door_button"], "events": true}],
+        "actions": {"OPEN": {"exclusive": true, "steps": [
+            {"write": {"door": 1}}, {"after": 0.5, "write": {"door": 0}}]}},
+        "reactions": {"door_button": {"false": "OPEN"}}
+    }
+
+``device_class()`` compiles a schema into a ``ModbusDevice`` actor class
+with the ``REGS`` and ``Action`` of the device, the handlers of its
+actions and the read plans of its polls, e.g.
+``DoorOpener = device_class(load_schema("dooropener"))``.
+
+An action writes its steps, ``after`` seconds apart, and an exclusive
+action returns False instead of starting again while its steps run.
+Every device also takes SUBSCRIBE_TO_BUTTON to the edge events of polls
+with ``events`` and VALUES, the last polled values. A reaction runs an
+action when a polled register changes to a value; the first sample only
+gives the starting value.
+"""
+
+import os
+import enum
+import json
+import threading
+
+from collections import namedtuple, OrderedDict
+from pykka import ThreadingActor, ActorDeadError
+from . import planner
+from .common import Logger, find_device
+from .connection import ConnectionManager
+from .dispatch import Dispatcher, handles
+from .events import EdgeDetector, EventPublisher
+from .exceptions import DeviceSchemaError
+from .health import DeviceStartup
+from .modbus import FunctionalCodes, Register, ModbusUser, BusPriority
+from .scheduler import BusScheduler, Priority
+from .tracing import TracedActor
+
+SCHEMA_DIR = os.path.join(os.path.dirname(__file__), 'schemas')
+
+DeviceSchema = namedtuple('DeviceSchema', [
+    'name', 'class_name', 'address', 'bus_priority', 'regs', 'config',
+    'polls', 'actions', 'reactions'
+])
+
+PollSpec = namedtuple(
+    'PollSpec', ['name', 'period', 'regs', 'priority', 'bus_priority',
+                 'events'])
+
+ActionSpec = namedtuple('ActionSpec', ['name', 'steps', 'exclusive'])
+
+Step = namedtuple('Step', ['delay', 'regs', 'values'])
+
+# Actions every device takes besides the ones of its schema.
+BUILTIN_ACTIONS = ('SUBSCRIBE_TO_BUTTON', 'VALUES')
+
+_TYPES = {
+    'coil': (FunctionalCodes.COIL, bool),
+    'discrete': (FunctionalCodes.DISCRETE, bool),
+    'input': (FunctionalCodes.INPUT, int),
+    'holding': (FunctionalCodes.HOLDING, int),
+}
+
+_VALUE_TYPES = {'bool': bool, 'int': int, 'float': float, 'str': str}
+
+
+def _enum(enum_cls, name, where):
+    try:
+        return enum_cls[name]
+    except KeyError:
+        raise DeviceSchemaError("{}: unknown {} \"{}\"".format(
+            where, enum_cls.__name__, name))
+
+
+def _register(field, spec, where):
+    if spec.get('type') not in _TYPES:
+        raise DeviceSchemaError("{}: register \"{}\" has no valid type".format(
+            where, field))
+    func_code, value_type = _TYPES[spec['type']]
+    if 'value' in spec:
+        value_type = _VALUE_TYPES[spec['value']]
+    return Register(
+        name=spec.get('name', field),
+        addr=spec['addr'],
+        func_code=func_code,
+        count=spec.get('count', 1),
+        value_type=value_type,
+        unit=spec.get('unit', ''))
+
+
+def parse_schema(data, where='schema'):
+    """Builds a ``DeviceSchema`` from decoded JSON."""
+    regs = OrderedDict(
+        (field, _register(field, spec, where))
+        for field, spec in data.get('registers', dict()).items())
+
+    def reg(field):
+        if field not in regs:
+            raise DeviceSchemaError("{}: unknown register \"{}\"".format(
+                where, field))
+        return regs[field]
+
+    config = OrderedDict(
+        (reg(field), value)
+        for field, value in data.get('config', dict()).items())
+
+    polls = tuple(
+        PollSpec(
+            name=poll['name'],
+            period=poll['period'],
+            regs=tuple(reg(field) for field in poll['registers']),
+            priority=_enum(Priority, poll.get('priority', 'NORMAL'), where),
+            bus_priority=_enum(BusPriority, poll['bus_priority'], where)
+            if 'bus_priority' in poll else None,
+            events=poll.get('events', False))
+        for poll in data.get('polls', ()))
+
+    actions = OrderedDict()
+    for name, action in data.get('actions', dict()).items():
+        if name in BUILTIN_ACTIONS:
+            raise DeviceSchemaError("{}: action \"{}\" is built in".format(
+                where, name))
+        steps = tuple(
+            Step(step.get('after', 0),
+                 tuple(reg(field) for field in step['write']),
+                 tuple(step['write'].values()))
+            for step in action['steps'])
+        actions[name] = ActionSpec(name, steps, action.get('exclusive', False))
+
+    reactions = OrderedDict()
+    for field, by_value in data.get('reactions', dict()).items():
+        for value, action in by_value.items():
+            if action not in actions:
+                raise DeviceSchemaError(
+                    "{}: reaction to unknown action \"{}\"".format(
+                        where, action))
+        reactions[reg(field)] = dict(
+            (json.loads(value), action) for value, action in by_value.items())
+
+    return DeviceSchema(
+        name=data['name'],
+        class_name=data['class'],
+        address=data['address'],
+        bus_priority=_enum(BusPriority, data.get('bus_priority', 'POLL'),
+                           where),
+        regs=regs,
+        config=config,
+        polls=polls,
+        actions=actions,
+        reactions=reactions)
+
+
+def load_schema(name, directory=SCHEMA_DIR):
+    path = os.path.join(directory, name + '.json')
+    with open(path) as f:
+        return parse_schema(json.load(f, object_pairs_hook=OrderedDict), path)
+
+
+class Reactions:
+    """Actions a device runs when its polled registers take a value.
+
+    Shared by ``ModbusDevice`` and ``aiodevices.AsyncDevice``.
+    """
+
+    def __init__(self, schema):
+        self._reactions = schema.reactions
+        self._last = dict()
+
+    def update(self, regs, values):
+        """Returns the names of the actions the new values call for."""
+        actions = []
+        for reg, value in zip(regs, values):
+            reaction = self._reactions.get(reg)
+            if reaction is None or self._last.get(reg, value) == value:
+                self._last[reg] = value
+                continue
+            self._last[reg] = value
+            if value in reaction:
+                actions.append(reaction[value])
+        return actions
+
+
+class _Internal(enum.Enum):
+    STEP = 0
+    POLLED = 1
+
+
+def _action_handler(spec):
+    return lambda device: device._start_action(spec)
+
+
+def device_class(schema, module=__name__):
+    """Compiles a schema into a ``ModbusDevice`` subclass."""
+    action = enum.Enum(schema.class_name + 'Action',
+                       list(schema.actions) + list(BUILTIN_ACTIONS))
+    regs = namedtuple(schema.class_name + 'Regs',
+                      list(schema.regs))(*schema.regs.values())
+
+    handlers = {
+        action.SUBSCRIBE_TO_BUTTON: ModbusDevice._subscribe,
+        action.VALUES: ModbusDevice._values_of,
+    }
+    for name, spec in schema.actions.items():
+        handlers[action[name]] = _action_handler(spec)
+
+    return type(schema.class_name, (ModbusDevice, ), {
+        '__module__': module,
+        'schema': schema,
+        'REGS': regs,
+        'Action': action,
+        'health_name': schema.name,
+        'bus_priority': schema.bus_priority,
+        'handlers': handlers,
+        '_read_plans_of_polls': dict(
+            (poll.regs, planner.plan_reads(poll.regs, *ModbusUser.read_gaps))
+            for poll in schema.polls),
+    })
+
+
+class ModbusDevice(DeviceStartup, TracedActor, Dispatcher, ModbusUser,
+                   ThreadingActor):
+    """Actor of a device compiled from a schema, see ``device_class()``."""
+
+    schema = None
+    _read_plans_of_polls = dict()
+
+    @classmethod
+    def from_vid_pid(cls, vip, pid, dev_addr=None, serial_number=None):
+        Logger.for_name(cls.__module__).info("Device search...")
+        dev = find_device(vip, pid, serial_number)
+        return cls.start(dev.device, dev_addr or cls.schema.address)
+
+    def __init__(self, port, dev_addr):
+        ThreadingActor.__init__(self)
+
+        self._log = Logger.for_name(self.__module__)
+
+        try:
+            ModbusUser.__init__(
+                self, ConnectionManager.manager().instrument(
+                    port, dev_addr))
+        except Exception as e:
+            self._log.error(str(e), exc_info=True)
+            raise e
+
+        self._read_plans.update(self._read_plans_of_polls)
+        self._polls = dict((poll.name, poll) for poll in self.schema.polls)
+        self._values = dict()
+        self._reactions = Reactions(self.schema)
+        self._running = dict()
+        self._generation = 0
+        self._events = EventPublisher()
+        self._edges = dict()
+
+        scheduler = BusScheduler.scheduler(self.port)
+        for poll in self.schema.polls:
+            if poll.events:
+                self._edges[poll.name] = EdgeDetector(
+                    self.schema.name,
+                    [self._field(reg) for reg in poll.regs])
+            scheduler.register(
+                poll.name,
+                poll.period,
+                lambda values, poll=poll: self._on_poll(poll, values),
+                user=self,
+                regs=poll.regs,
+                priority=poll.priority,
+                bus_priority=poll.bus_priority)
+
+    def on_stop(self):
+        scheduler = BusScheduler.scheduler(self.port)
+        for poll in self.schema.polls:
+            scheduler.unregister(poll.name)
+
+    def _initialize_gpio(self):
+        if not self.schema.config:
+            return True
+        return self._write_many(tuple(self.schema.config),
+                                tuple(self.schema.config.values()))
+
+    def _field(self, reg):
+        return self.REGS._fields[self.REGS.index(reg)]
+
+    def _on_poll(self, poll, values):
+        # Runs in the scheduler thread, the state is the actor's.
+        try:
+            self.actor_ref.tell({
+                "action": _Internal.POLLED,
+                "name": poll.name,
+                "values": values
+            })
+        except ActorDeadError:
+            pass
+
+    @handles(_Internal.POLLED)
+    def _polled(self, name, values):
+        poll = self._polls[name]
+        for reg, value in zip(poll.regs, values):
+            self._values[self._field(reg)] = value
+        for action in self._reactions.update(poll.regs, values):
+            self._start_action(self.schema.actions[action])
+
+        if name in self._edges:
+            self._events.publish(self._edges[name].update(values))
+
+    def _subscribe(self, subscriber, names=None):
+        self._events.subscribe(subscriber, names)
+
+    def _values_of(self):
+        return dict(self._values)
+
+    def _start_action(self, spec):
+        if spec.exclusive and spec.name in self._running:
+            return False
+
+        self._log.info("\"{}\": {}".format(self.health_name, spec.name))
+        self._generation += 1
+        self._running[spec.name] = self._generation
+        self._run_step(spec, 0)
+        return True
+
+    @handles(_Internal.STEP)
+    def _step(self, name, index, generation):
+        if self._running.get(name) == generation:
+            self._run_step(self.schema.actions[name], index)
+
+    def _run_step(self, spec, index):
+        step = spec.steps[index]
+        self._write_many(step.regs, step.values)
+        if index + 1 == len(spec.steps):
+            del self._running[spec.name]
+            return
+
+        timer = threading.Timer(
+            spec.steps[index + 1].delay, self._step_timer_handler,
+            [spec.name, index + 1, self._running[spec.name]])
+        timer.daemon = True
+        timer.start()
+
+    def _step_timer_handler(self, name, index, generation):
+        try:
+            self.actor_ref.tell({
+                "action": _Internal.STEP,
+                "name": name,
+                "index": index,
+                "generation": generation
+            })
+        except ActorDeadError:
+            pass
@@ -0,0 +1,65 @@
+"""Actor messages routed by a table built once per actor class.
+
+A method decorated with ``handles(action)`` takes the messages with that
+``"action"``, the other keys of a message are its keyword arguments::
+
+    class TrafficLight(Dispatcher, ThreadingActor):
+        @handles(Action.ON)
+        def turn_on(self, color):
+            ...
+
+Classes built at run time add their handlers with a ``handlers`` dict of
+action -> function. The table of a class is collected from its MRO when
+the class receives its first message.
+"""
+
+from .common import Logger
+
+_tables = dict()
+
+
+def handles(*actions):
+    def decorator(func):
+        func.handled_actions = getattr(func, 'handled_actions', ()) + actions
+        return func
+
+    return decorator
+
+
+def dispatch_table(cls):
+    """Returns the action -> function table of ``cls``."""
+    table = _tables.get(cls)
+    if table is None:
+        table = dict()
+        for klass in reversed(cls.__mro__):
+            for func in vars(klass).values():
+                for action in getattr(func, 'handled_actions', ()):
+                    table[action] = func
+            table.update(vars(klass).get('handlers', ()))
+        _tables[cls] = table
+    return table
+
+
+class Dispatcher:
+    """Actor mixin with an ``on_receive`` routed by ``handles()``.
+
+    An unknown action is logged and answered with None, as is a handler
+    raising an exception, which would stop the actor otherwise.
+    """
+
+    def on_receive(self, msg):
+        action = msg["action"]
+        handler = dispatch_table(type(self)).get(action)
+        if handler is None:
+            Logger.for_name(type(self).__module__).warning(
+                "Unknown action {}!".format(action))
+            return None
+
+        kwargs = dict(msg)
+        del kwargs["action"]
+        try:
+            return handler(self, **kwargs)
+        except Exception:
+            Logger.for_name(type(self).__module__).error(
+                "Cannot handle {}!".format(action), exc_info=True)
+            return None
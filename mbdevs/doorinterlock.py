@@ -0,0 +1,198 @@
+import enum
+import time
+import threading
+
+from collections import namedtuple
+from pykka import ThreadingActor, ActorDeadError
+from .common import Logger
+from .events import Edge, Event
+
+InterlockDefaults = namedtuple('InterlockDefaults', [
+    'DEBOUNCE', 'DOUBLE_PRESS', 'FIRST_PULSE', 'PULSE_PERIOD', 'PULSES',
+    'LATENCY_BOUND'
+])
+
+INTERLOCK_DEFAULTS = InterlockDefaults(
+    DEBOUNCE=0.15,
+    DOUBLE_PRESS=2,
+    FIRST_PULSE=3,
+    PULSE_PERIOD=3,
+    PULSES=3,
+    LATENCY_BOUND=0.1)
+
+LatencyStats = namedtuple(
+    'LatencyStats', ['pulses', 'press_to_write', 'mean_lag', 'max_lag', 'late'])
+
+
+class _Latency:
+    def __init__(self):
+        self.pulses = 0
+        self.press_to_write = 0
+        self.total_lag = 0
+        self.max_lag = 0
+        self.late = 0
+
+    def add(self, lag, late):
+        self.pulses += 1
+        self.total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+        if late:
+            self.late += 1
+
+    def stats(self):
+        mean = self.total_lag / self.pulses if self.pulses else 0
+        return LatencyStats(self.pulses, self.press_to_write, mean,
+                            self.max_lag, self.late)
+
+
+class DoublePress:
+    """Tells a double press of a door button from its edge events.
+
+    Shared by ``DoorInterlock`` and ``aiodevices.AsyncDoorInterlock``.
+    """
+
+    def __init__(self, config=INTERLOCK_DEFAULTS):
+        self._config = config
+        self._last_edge = 0
+        self._last_press = time.monotonic()
+
+    def update(self, event):
+        """True if ``event`` is the second press within DOUBLE_PRESS."""
+        if event.time - self._last_edge < self._config.DEBOUNCE:
+            return False
+        self._last_edge = event.time
+
+        if event.edge != Edge.FALLING:
+            return False
+
+        double = event.time - self._last_press <= self._config.DOUBLE_PRESS
+        self._last_press = event.time
+        return double
+
+
+class _Channel:
+    def __init__(self, door, action, config):
+        self.door = door
+        self.action = action
+        self.state = DoorInterlock.State.IDLE
+        self.presses = DoublePress(config)
+        self.press_time = 0
+        self.scheduled_at = 0
+        self.pulses_left = 0
+        self.generation = 0
+        self.timer = None
+        self.latency = _Latency()
+
+
+class DoorInterlock(ThreadingActor):
+    """Opens a door after a double press of a button, without blocking.
+
+    Subscribe the actor to door button events. ``doors`` maps an event
+    source to the ``(door actor, open action)`` its button opens. A press
+    is a falling edge; edges closer than DEBOUNCE to the previous one are
+    bounces. A second press within DOUBLE_PRESS starts PULSES open pulses,
+    the first FIRST_PULSE after the press, then every PULSE_PERIOD.
+
+    STATS returns, per button, the time from the press to the first
+    completed relay write and the lag of every pulse behind its schedule;
+    pulses lagging more than LATENCY_BOUND are counted as late.
+    """
+
+    class Action(enum.Enum):
+        PULSE = 0
+        STATS = 1
+
+    class State(enum.Enum):
+        IDLE = 0
+        OPENING = 1
+
+    def __init__(self, doors, config=INTERLOCK_DEFAULTS):
+        super().__init__()
+        self._log = Logger.for_name(__name__)
+        self._config = config
+        self._channels = {
+            source: _Channel(door, action, config)
+            for source, (door, action) in doors.items()
+        }
+
+    def on_receive(self, msg):
+        if isinstance(msg, Event):
+            self._on_event(msg)
+        elif msg["action"] == DoorInterlock.Action.PULSE:
+            self._pulse(msg["source"], msg["generation"])
+        elif msg["action"] == DoorInterlock.Action.STATS:
+            return {
+                source: ch.latency.stats()
+                for source, ch in self._channels.items()
+            }
+
+    def on_stop(self):
+        for ch in self._channels.values():
+            if ch.timer:
+                ch.timer.cancel()
+
+    def _on_event(self, event):
+        ch = self._channels.get(event.source)
+        if ch is None or not ch.presses.update(event):
+            return
+
+        self._log.info("Door button \"{}\" pressed twice".format(
+            event.source))
+        self._start_pulses(event.source, ch, event.time)
+
+    def _start_pulses(self, source, ch, press_time):
+        if ch.timer:
+            ch.timer.cancel()
+        ch.generation += 1
+        ch.state = DoorInterlock.State.OPENING
+        ch.press_time = press_time
+        ch.pulses_left = self._config.PULSES
+        self._schedule(source, ch, press_time + self._config.FIRST_PULSE)
+
+    def _schedule(self, source, ch, at):
+        ch.scheduled_at = at
+        ch.timer = threading.Timer(
+            max(0, at - time.monotonic()), self._pulse_timer_handler,
+            [source, ch.generation])
+        ch.timer.daemon = True
+        ch.timer.start()
+
+    def _pulse_timer_handler(self, source, generation):
+        try:
+            self.actor_ref.tell({
+                "action": DoorInterlock.Action.PULSE,
+                "source": source,
+                "generation": generation
+            })
+        except ActorDeadError:
+            pass
+
+    def _pulse(self, source, generation):
+        ch = self._channels[source]
+        if generation != ch.generation or \
+           ch.state != DoorInterlock.State.OPENING:
+            return
+
+        try:
+            ch.door.ask({"action": ch.action})
+        except Exception:
+            self._log.error(
+                "Cannot open the door for \"{}\"!".format(source),
+                exc_info=True)
+
+        done = time.monotonic()
+        lag = done - ch.scheduled_at
+        late = lag > self._config.LATENCY_BOUND
+        ch.latency.add(lag, late)
+        if ch.pulses_left == self._config.PULSES:
+            ch.latency.press_to_write = done - ch.press_time
+        if late:
+            self._log.warning("Door pulse for \"{}\" is {:.0f} ms late".format(
+                source, lag * 1000))
+
+        ch.pulses_left -= 1
+        if ch.pulses_left > 0:
+            self._schedule(source, ch,
+                           ch.scheduled_at + self._config.PULSE_PERIOD)
+        else:
+            ch.state = DoorInterlock.State.IDLE
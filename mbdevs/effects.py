@@ -0,0 +1,97 @@
+import enum
+import threading
+
+from collections import namedtuple
+from pykka import ThreadingActor, ActorDeadError
+from .common import Logger
+
+# ``messages`` are told to the ``target`` actor, which is busy with them
+# for ``duration`` seconds.
+Effect = namedtuple('Effect', ['name', 'target', 'messages', 'duration'])
+
+EffectStats = namedtuple('EffectStats', ['played', 'collapsed'])
+
+
+class Effects(ThreadingActor):
+    """Plays the cosmetic effects of commands, one at a time per target.
+
+    Handlers tell PLAY and go on, the effects never hold a command. While
+    an effect runs on a target, another one of the same name is dropped
+    and effects of other names replace each other in a single waiting
+    slot, so a burst of commands collapses into the running effect and
+    the last one instead of a queue of animations.
+    """
+
+    class Action(enum.Enum):
+        PLAY = 0
+        DONE = 1
+        STATS = 2
+
+    def __init__(self):
+        super().__init__()
+        self._log = Logger.for_name(__name__)
+        self._playing = dict()
+        self._waiting = dict()
+        self._timers = dict()
+        self._played = 0
+        self._collapsed = 0
+
+    def on_receive(self, msg):
+        if msg["action"] == Effects.Action.PLAY:
+            self._play(msg["effect"])
+        elif msg["action"] == Effects.Action.DONE:
+            self._done(msg["target"])
+        elif msg["action"] == Effects.Action.STATS:
+            return EffectStats(self._played, self._collapsed)
+
+    def on_stop(self):
+        for timer in self._timers.values():
+            timer.cancel()
+
+    def _play(self, effect):
+        target = effect.target.actor_urn
+        playing = self._playing.get(target)
+        if playing is None:
+            self._start(target, effect)
+            return
+
+        self._collapsed += 1
+        if playing != effect.name:
+            if target in self._waiting:
+                self._log.debug("Effect \"{}\" replaced by \"{}\"".format(
+                    self._waiting[target].name, effect.name))
+            self._waiting[target] = effect
+        else:
+            self._log.debug("Effect \"{}\" is already running".format(
+                effect.name))
+
+    def _start(self, target, effect):
+        try:
+            for msg in effect.messages:
+                effect.target.tell(dict(msg))
+        except ActorDeadError:
+            return
+
+        self._played += 1
+        self._playing[target] = effect.name
+        timer = threading.Timer(effect.duration, self._done_timer_handler,
+                                [target])
+        timer.daemon = True
+        self._timers[target] = timer
+        timer.start()
+
+    def _done_timer_handler(self, target):
+        try:
+            self.actor_ref.tell({
+                "action": Effects.Action.DONE,
+                "target": target
+            })
+        except ActorDeadError:
+            pass
+
+    def _done(self, target):
+        self._playing.pop(target, None)
+        self._timers.pop(target, None)
+        effect = self._waiting.pop(target, None)
+        if effect:
+            self._start(target, effect)
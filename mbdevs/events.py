@@ -0,0 +1,78 @@
+import enum
+import time
+import threading
+
+from collections import namedtuple
+from pykka import ActorDeadError
+from .common import Logger
+
+
+class Edge(enum.Enum):
+    RISING = 1
+    FALLING = 0
+
+
+# Events are told to the subscribers as they are, with no envelope.
+Event = namedtuple('Event', ['source', 'name', 'edge', 'value', 'time'])
+
+
+class EdgeDetector:
+    """Turns sampled values into edge events.
+
+    ``names`` are the event names of the sampled values, in sample order.
+    The first sample only sets the initial state and produces no events.
+    """
+
+    def __init__(self, source, names):
+        self._source = source
+        self._names = tuple(names)
+        self._prev = [None] * len(self._names)
+
+    def update(self, values):
+        now = time.monotonic()
+        events = []
+        for i, (name, value) in enumerate(zip(self._names, values)):
+            prev = self._prev[i]
+            self._prev[i] = value
+            if prev is None or bool(prev) == bool(value):
+                continue
+            edge = Edge.RISING if value else Edge.FALLING
+            events.append(Event(self._source, name, edge, value, now))
+        return events
+
+
+class EventPublisher:
+    """Delivers events to subscribed actors with ``tell``.
+
+    Subscribers receive the ``Event`` itself as the message and can limit
+    the subscription to some event names.
+    """
+
+    def __init__(self):
+        self._log = Logger.for_name(__name__)
+        self._lock = threading.Lock()
+        self._subscribers = []
+
+    def subscribe(self, subscriber, names=None):
+        names = frozenset(names) if names else None
+        with self._lock:
+            self._subscribers = [(s, n) for s, n in self._subscribers
+                                 if s != subscriber]
+            self._subscribers.append((subscriber, names))
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers = [(s, n) for s, n in self._subscribers
+                                 if s != subscriber]
+
+    def publish(self, events):
+        subscribers = self._subscribers
+        for event in events:
+            for subscriber, names in subscribers:
+                if names is not None and event.name not in names:
+                    continue
+                try:
+                    subscriber.tell(event)
+                except ActorDeadError:
+                    self._log.info("Subscriber {} is dead".format(subscriber))
+                    self.unsubscribe(subscriber)
@@ -4,4 +4,19 @@ class ComDeviceNotFound(IOError):
 class CannotReadARegisterValue(Exception):
     def __init__(self, reg):
         msg = "Cannot a value read {} register".format(reg.name)
-        super().__init__(msg)
\ No newline at end of file
+        super().__init__(msg)
+
+class ModbusNoResponse(IOError):
+    pass
+
+class ModbusInvalidResponse(IOError):
+    pass
+
+class ModbusCrcError(ModbusInvalidResponse):
+    pass
+
+class ModbusSlaveException(ModbusInvalidResponse):
+    pass
+
+class DeviceSchemaError(ValueError):
+    pass
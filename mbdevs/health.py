@@ -0,0 +1,129 @@
+import enum
+import time
+import threading
+
+from collections import namedtuple
+from pykka import ActorDeadError
+from .common import Logger
+from .dispatch import handles
+
+StartupDefaults = namedtuple('StartupDefaults', ['DEADLINE', 'RETRY'])
+
+# A device still starting after DEADLINE is marked degraded, RETRY is the
+# pause before initializing a failed device again.
+STARTUP_DEFAULTS = StartupDefaults(DEADLINE=5, RETRY=30)
+
+DeviceStatus = namedtuple('DeviceStatus', ['health', 'reason', 'since'])
+
+
+class Health(enum.Enum):
+    STARTING = 0
+    READY = 1
+    DEGRADED = 2
+
+
+class DeviceHealth:
+    """Health of every device of the bot, by device name."""
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    @classmethod
+    def monitor(cls):
+        with cls.__instance_lock:
+            if not cls.__instance:
+                cls.__instance = cls()
+
+        return cls.__instance
+
+    def __init__(self):
+        self._log = Logger.for_name(__name__)
+        self._cond = threading.Condition()
+        self._devices = dict()
+
+    def set(self, name, health, reason=None):
+        with self._cond:
+            old = self._devices.get(name)
+            if old and old.health == health and old.reason == reason:
+                return
+            self._devices[name] = DeviceStatus(health, reason,
+                                               time.monotonic())
+            self._cond.notify_all()
+
+        if health == Health.DEGRADED:
+            self._log.warning("Device \"{}\" is degraded: {}".format(
+                name, reason))
+        else:
+            self._log.info("Device \"{}\" is {}".format(
+                name, health.name.lower()))
+
+    def status(self, name):
+        with self._cond:
+            return self._devices.get(name)
+
+    def is_ready(self, name):
+        status = self.status(name)
+        return status is not None and status.health == Health.READY
+
+    def report(self):
+        with self._cond:
+            return dict(self._devices)
+
+    def degrade_starting(self, names, reason):
+        """Marks the devices which are still starting as degraded."""
+        with self._cond:
+            for name in names:
+                status = self._devices.get(name)
+                if status is None or status.health == Health.STARTING:
+                    self.set(name, Health.DEGRADED, reason)
+
+
+class _Startup(enum.Enum):
+    RETRY = 0
+
+
+class DeviceStartup:
+    """Initializes a device actor off its constructor.
+
+    ``_initialize_gpio`` runs in the actor thread when the actor starts
+    and returns False if the device did not take the configuration. Then
+    the device is marked degraded and a retry message initializes it
+    again later, so the actor needs a ``dispatch.Dispatcher``.
+    """
+
+    health_name = None
+    startup_retry = STARTUP_DEFAULTS.RETRY
+
+    def on_start(self):
+        DeviceHealth.monitor().set(self.health_name, Health.STARTING)
+        self._start_device()
+
+    def _start_device(self):
+        try:
+            ready = self._initialize_gpio() is not False
+            reason = "device does not answer"
+        except Exception as e:
+            Logger.for_name(__name__).error(
+                "Cannot initialize \"{}\"!".format(self.health_name),
+                exc_info=True)
+            ready = False
+            reason = str(e)
+
+        if ready:
+            DeviceHealth.monitor().set(self.health_name, Health.READY)
+            return
+
+        DeviceHealth.monitor().set(self.health_name, Health.DEGRADED, reason)
+        timer = threading.Timer(self.startup_retry, self._retry_timer_handler)
+        timer.daemon = True
+        timer.start()
+
+    @handles(_Startup.RETRY)
+    def _retry_start(self):
+        self._start_device()
+
+    def _retry_timer_handler(self):
+        try:
+            self.actor_ref.tell({"action": _Startup.RETRY})
+        except ActorDeadError:
+            pass
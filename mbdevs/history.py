@@ -0,0 +1,220 @@
+"""Recent values of the polled registers, kept in memory.
+
+Every value read by a poll goes into the series of its device and
+register: the last RAW samples as they came, plus buckets with the min,
+max, sum and count of every minute, hour and day. A series is a few
+fixed-size ``array`` rings, about 120 KB however long the bot runs, and a
+query like ``/history temperature 24h`` only reads them.
+"""
+
+import math
+import time
+import array
+import threading
+
+from collections import namedtuple
+
+HistoryDefaults = namedtuple('HistoryDefaults', ['RAW', 'TIERS'])
+
+# RAW samples are kept as read, a tier is (bucket seconds, buckets):
+# minutes of a day, hours of a month, days of a year.
+HISTORY_DEFAULTS = HistoryDefaults(
+    RAW=1024, TIERS=((60, 1440), (3600, 720), (86400, 365)))
+
+HistoryStats = namedtuple('HistoryStats', [
+    'source', 'name', 'unit', 'count', 'min', 'avg', 'max', 'since', 'step'
+])
+
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_window(text):
+    """Seconds in a window like "90s", "15m", "24h", "7d" or "2" (hours)."""
+    text = text.strip().lower()
+    unit = _UNITS.get(text[-1:])
+    number = text[:-1] if unit else text
+    value = float(number) * (unit or 3600)
+    if not math.isfinite(value) or value <= 0:
+        raise ValueError("Window must be positive: {}".format(text))
+    return value
+
+
+class _Raw:
+    def __init__(self, size):
+        self.size = size
+        self.times = array.array('q', [0] * size)
+        self.values = array.array('d', [0.0] * size)
+        self.count = 0
+        self.head = 0
+
+    def add(self, ms, value):
+        self.times[self.head] = ms
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def oldest(self):
+        if not self.count:
+            return None
+        return self.times[(self.head - self.count) % self.size]
+
+    def items(self):
+        for i in range(self.head - self.count, self.head):
+            yield self.times[i % self.size], self.values[i % self.size]
+
+
+class _Tier:
+    def __init__(self, step, size):
+        self.step = step * 1000
+        self.size = size
+        self.starts = array.array('q', [0] * size)
+        self.mins = array.array('d', [0.0] * size)
+        self.maxs = array.array('d', [0.0] * size)
+        self.sums = array.array('d', [0.0] * size)
+        self.counts = array.array('q', [0] * size)
+        self.count = 0
+        self.last = -1
+
+    def add(self, ms, value):
+        start = ms - ms % self.step
+        i = self.last
+        if self.count and self.starts[i] == start:
+            if value < self.mins[i]:
+                self.mins[i] = value
+            if value > self.maxs[i]:
+                self.maxs[i] = value
+            self.sums[i] += value
+            self.counts[i] += 1
+            return
+
+        i = self.last = (i + 1) % self.size
+        self.starts[i] = start
+        self.mins[i] = self.maxs[i] = self.sums[i] = value
+        self.counts[i] = 1
+        self.count = min(self.count + 1, self.size)
+
+    def buckets(self, since):
+        for n in range(self.count):
+            i = (self.last - n) % self.size
+            if self.starts[i] + self.step <= since:
+                return
+            yield self.starts[i], self.mins[i], self.maxs[i], \
+                self.sums[i], self.counts[i]
+
+
+def time_ms():
+    return int(time.time() * 1000)
+
+
+class Series:
+    """Samples of one value with the minute, hour and day buckets."""
+
+    def __init__(self, source, name, unit='', config=HISTORY_DEFAULTS):
+        self.source = source
+        self.name = name
+        self.unit = unit
+        self._lock = threading.Lock()
+        self._raw = _Raw(config.RAW)
+        self._tiers = [_Tier(step, size) for step, size in config.TIERS]
+        self._span = max(step * size for step, size in config.TIERS)
+
+    def add(self, value, ms=None):
+        if ms is None:
+            ms = time_ms()
+        value = float(value)
+        with self._lock:
+            self._raw.add(ms, value)
+            for tier in self._tiers:
+                tier.add(ms, value)
+
+    def stats(self, window):
+        """``HistoryStats`` of the last ``window`` seconds.
+
+        The raw samples are used while they reach back that far, then the
+        finest tier which does, so the first bucket may begin before the
+        window. A window longer than the last tier is cut to it.
+        """
+        window = min(window, self._span)
+        now = time_ms()
+        since = now - int(window * 1000)
+        with self._lock:
+            oldest = self._raw.oldest()
+            if oldest is not None and oldest <= since:
+                samples = [(t, v) for t, v in self._raw.items() if t >= since]
+                values = [v for t, v in samples]
+                return self._stats(
+                    len(values), min(values, default=None), sum(values),
+                    max(values, default=None),
+                    samples[0][0] if samples else None, 0)
+
+            tier = next(
+                (t for t in self._tiers if t.size * t.step >= now - since),
+                self._tiers[-1])
+            buckets = list(tier.buckets(since))
+
+        if not buckets:
+            return self._stats(0, None, 0, None, None, tier.step // 1000)
+        return self._stats(
+            sum(b[4] for b in buckets), min(b[1] for b in buckets),
+            sum(b[3] for b in buckets), max(b[2] for b in buckets),
+            min(b[0] for b in buckets), tier.step // 1000)
+
+    def _stats(self, count, low, total, high, first, step):
+        return HistoryStats(
+            self.source, self.name, self.unit, count, low,
+            total / count if count else None, high,
+            first / 1000 if first is not None else None, step)
+
+
+class History:
+    """Series of all the devices, by source and name."""
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    @classmethod
+    def store(cls):
+        with cls.__instance_lock:
+            if not cls.__instance:
+                cls.__instance = cls()
+
+        return cls.__instance
+
+    def __init__(self, config=HISTORY_DEFAULTS):
+        self._config = config
+        self._lock = threading.Lock()
+        self._series = dict()
+
+    def series(self, source, name, unit=''):
+        key = (source, name)
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(
+                    key, Series(source, name, unit, self._config))
+        return series
+
+    def record(self, source, name, value, unit=''):
+        self.series(source, name, unit).add(value)
+
+    def record_regs(self, source, regs, values):
+        """Records the values of a register read."""
+        ms = time_ms()
+        for reg, value in zip(regs, values):
+            if isinstance(value, (bool, int, float)):
+                self.series(source, reg.name, reg.unit).add(value, ms)
+
+    def names(self):
+        with self._lock:
+            return sorted(self._series)
+
+    def find(self, name):
+        """Series named ``name``, or ``"source name"``, in any case."""
+        name = ' '.join(name.lower().split())
+        with self._lock:
+            series = list(self._series.values())
+        return [
+            s for s in series
+            if name in (s.name.lower(),
+                        "{} {}".format(s.source, s.name).lower())
+        ]
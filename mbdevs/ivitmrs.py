@@ -1,9 +1,12 @@
+import sys
+import time
 import minimalmodbus
-import serial.tools.list_ports
 from collections import namedtuple
 
 from .common import find_device, Logger
-from .modbus import FunctionalCodes, Register, Modbus, Action, ModbusUser
+from .connection import ConnectionManager
+from .modbus import FunctionalCodes, Register, ModbusUser, BusPriority
+from .scheduler import BusScheduler, Priority
 
 IvitMRSRegs = namedtuple('IvitMRSRegs', [
     'humidity', 'humidity_no_correction', 'humidity_no_adjustment', 'temp',
@@ -28,6 +31,13 @@ REGS = IvitMRSRegs(
                                 FunctionalCodes.INPUT, 2, float, 'C'),
 )
 
+# The sensor values change slowly, so a burst of requests is answered from
+# the cache instead of queueing on the bus.
+CACHE_TTL = 2.0
+
+# Temperature and humidity are polled this often for /history, seconds.
+HISTORY_PERIOD = 10
+
 # REGS = IvitMRSRegs(
 #     humidity=Register("Relative humidity", 0x0016, FunctionalCodes.INPUT, 2,
 #                       ">f", '%'),
@@ -48,24 +58,36 @@ REGS = IvitMRSRegs(
 
 
 class IvitMRS(ModbusUser):
+    cache_ttls = {reg: CACHE_TTL for reg in REGS}
+    bus_priority = BusPriority.INTERACTIVE
+    history_source = "ivitmrs"
+
     @classmethod
-    def from_vid_pid(cls, vip, pid, dev_addr=247):
+    def from_vid_pid(cls, vip, pid, dev_addr=247, serial_number=None):
         Logger.for_name(__name__).info("Device search...")
-        dev = find_device(vip, pid)
+        dev = find_device(vip, pid, serial_number)
         return cls(dev.device, dev_addr)
 
     def __init__(self, port, dev_addr=247):
         log = Logger.for_name(__name__)
 
         try:
-            self._mb = minimalmodbus.Instrument(
-                str(port), dev_addr, mode='rtu')
+            self._mb = ConnectionManager.manager().instrument(
+                port, dev_addr)
             super().__init__(self._mb)
             # super().__init__(dev_addr, str(port), 115200)
         except Exception as e:
             log.error(str(e), exc_info=True)
             raise e
 
+        BusScheduler.scheduler(self.port).register(
+            "ivitmrs history",
+            HISTORY_PERIOD,
+            lambda values: None,
+            user=self,
+            regs=(REGS.temp, REGS.humidity),
+            priority=Priority.LOW)
+
     @property
     def humidity(self):
         return self._read_reg(REGS.humidity)
@@ -97,24 +119,12 @@ class IvitMRS(ModbusUser):
     def poll_sesors_and_print(self):
         log = Logger.for_name(__name__)
 
-        log.info(
-            '%s:   %.1f%s\t' % (REGS.temp.name, self.temp, REGS.temp.unit))
-        log.info('%s:   %.1f%s\t' % (REGS.temp_sht.name, self.temp_sht,
-                                     REGS.temp_sht.unit))
-        log.info('%s:   %.1f%s\t' %
-                 (REGS.temp_no_correction.name, self.temp_no_correction,
-                  REGS.temp_no_correction.unit))
-        log.info('%s:   %.1f%s\t' %
-                 (REGS.temp_no_adjustment.name, self.temp_no_adjustment,
-                  REGS.temp_no_adjustment.unit))
-        log.info('%s:   %.1f%s\t' % (REGS.humidity.name, self.humidity,
-                                     REGS.humidity.unit))
-        log.info('%s:   %.1f%s\t' %
-                 (REGS.humidity_no_adjustment.name,
-                  self.humidity_no_adjustment, REGS.humidity.unit))
-        log.info('%s:   %.1f%s\t' %
-                 (REGS.humidity_no_correction.name,
-                  self.humidity_no_correction, REGS.humidity.unit))
+        regs = (REGS.temp, REGS.temp_sht, REGS.temp_no_correction,
+                REGS.temp_no_adjustment, REGS.humidity,
+                REGS.humidity_no_adjustment, REGS.humidity_no_correction)
+
+        for reg, value in zip(regs, self.read_many(regs)):
+            log.info('%s:   %.1f%s\t' % (reg.name, value, reg.unit))
         log.info('\n')
 
 
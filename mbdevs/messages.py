@@ -0,0 +1,107 @@
+"""Requests to the bus actor.
+
+A request is a small object with fixed fields, checked when it is made
+instead of when the bus gets to it. ``Batch`` carries several requests,
+of one device or more, in a single message, for example every register
+group a device polls; the bus answers with the list of their results.
+"""
+
+def _check_reg(reg, writing=False):
+    codes = reg.func_code.value
+    if (codes.write if writing else codes.read) is None:
+        raise ValueError("\"{}\" register cannot be {}".format(
+            reg.name, "written" if writing else "read"))
+
+
+class BusRequest:
+    """``mb`` is the instrument of the slave, ``priority`` a ``BusPriority``.
+
+    ``trace`` is the ``tracing.Trace`` of the command waiting for it.
+    """
+
+    __slots__ = ('mb', 'priority', 'trace')
+
+    def __init__(self, mb, priority):
+        self.mb = mb
+        self.priority = priority
+        self.trace = None
+
+    def set_trace(self, trace):
+        self.trace = trace
+
+    @staticmethod
+    def skipped():
+        """Result of the request when the slave is skipped."""
+        return None
+
+
+class ReadReq(BusRequest):
+    __slots__ = ('reg', )
+
+    def __init__(self, mb, reg, priority):
+        _check_reg(reg)
+        super().__init__(mb, priority)
+        self.reg = reg
+
+
+class WriteReq(BusRequest):
+    __slots__ = ('reg', 'value')
+
+    def __init__(self, mb, reg, value, priority):
+        _check_reg(reg, writing=True)
+        super().__init__(mb, priority)
+        self.reg = reg
+        self.value = value
+
+    @staticmethod
+    def skipped():
+        return False
+
+
+class ReadManyReq(BusRequest):
+    """Reads the blocks of a ``planner.plan_reads()`` plan."""
+
+    __slots__ = ('plan', )
+
+    def __init__(self, mb, plan, priority):
+        super().__init__(mb, priority)
+        self.plan = plan
+
+    @staticmethod
+    def skipped():
+        return dict()
+
+
+class WriteManyReq(BusRequest):
+    """Writes the blocks of a ``planner.plan_writes()`` plan."""
+
+    __slots__ = ('plan', )
+
+    def __init__(self, mb, plan, priority):
+        for block in plan:
+            for reg in block.regs:
+                _check_reg(reg, writing=True)
+        super().__init__(mb, priority)
+        self.plan = plan
+
+    @staticmethod
+    def skipped():
+        return []
+
+
+class Batch(BusRequest):
+    """Requests served one after another, as the most urgent of them."""
+
+    __slots__ = ('requests', )
+
+    def __init__(self, requests):
+        requests = tuple(requests)
+        if not requests:
+            raise ValueError("Empty batch")
+        super().__init__(None, min(r.priority for r in requests))
+        self.requests = requests
+
+    def set_trace(self, trace):
+        self.trace = trace
+        for request in self.requests:
+            request.set_trace(trace)
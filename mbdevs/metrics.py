@@ -0,0 +1,219 @@
+"""Counters and histograms of the buses in the Prometheus text format.
+
+``serve()`` exposes them on ``http://127.0.0.1:9105/metrics``. Updating a
+metric is a dict lookup and a few additions under a lock, cheap next to a
+Modbus transaction.
+"""
+
+import bisect
+import threading
+
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from .common import Logger
+
+MetricsDefaults = namedtuple('MetricsDefaults', ['HOST', 'PORT', 'BUCKETS'])
+
+# BUCKETS are the upper bounds of the latency histograms, in seconds.
+METRICS_DEFAULTS = MetricsDefaults(
+    HOST='127.0.0.1',
+    PORT=9105,
+    BUCKETS=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+             2.5, 5))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name,
+        str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+            '\n', '\\n')) for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = dict()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def expose(self):
+        with self._lock:
+            values = sorted(self._values.items(), key=lambda i: str(i[0]))
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} counter'.format(self.name)]
+        for labels, value in values:
+            lines.append('{}{} {}'.format(
+                self.name, _labels(self.labels, labels), _number(value)))
+        return lines
+
+
+class _Buckets:
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0
+        self.count = 0
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(),
+                 buckets=METRICS_DEFAULTS.BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = dict()
+
+    def observe(self, labels, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            b = self._values.get(labels)
+            if b is None:
+                b = self._values[labels] = _Buckets(len(self.buckets) + 1)
+            b.counts[i] += 1
+            b.sum += value
+            b.count += 1
+
+    def expose(self):
+        with self._lock:
+            values = sorted(
+                ((labels, list(b.counts), b.sum, b.count)
+                 for labels, b in self._values.items()),
+                key=lambda i: str(i[0]))
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} histogram'.format(self.name)]
+        bounds = self.buckets + (float('inf'), )
+        for labels, counts, total, count in values:
+            cumulative = 0
+            for bound, n in zip(bounds, counts):
+                cumulative += n
+                lines.append('{}_bucket{} {}'.format(
+                    self.name,
+                    _labels(self.labels, labels, (('le', _number(bound)), )),
+                    cumulative))
+            lines.append('{}_sum{} {}'.format(
+                self.name, _labels(self.labels, labels), _number(total)))
+            lines.append('{}_count{} {}'.format(
+                self.name, _labels(self.labels, labels), count))
+        return lines
+
+
+class Gauge:
+    """A value read when the metrics are scraped.
+
+    ``collect`` returns ``(labels, value)`` pairs.
+    """
+
+    def __init__(self, name, help, labels, collect):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._collect = collect
+
+    def expose(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} gauge'.format(self.name)]
+        for labels, value in self._collect():
+            lines.append('{}{} {}'.format(
+                self.name, _labels(self.labels, labels), _number(value)))
+        return lines
+
+
+class Metrics:
+    """All the metrics of the process, by name."""
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    @classmethod
+    def registry(cls):
+        with cls.__instance_lock:
+            if not cls.__instance:
+                cls.__instance = cls()
+
+        return cls.__instance
+
+    def __init__(self):
+        self._log = Logger.for_name(__name__)
+        self._lock = threading.Lock()
+        self._metrics = dict()
+
+    def _add(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(),
+                  buckets=METRICS_DEFAULTS.BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, labels, collect):
+        return self._add(Gauge(name, help, labels, collect))
+
+    def exposition(self):
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.expose())
+            except Exception:
+                self._log.error(
+                    "Cannot collect \"{}\"!".format(metric.name),
+                    exc_info=True)
+        return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = Metrics.registry().exposition().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(host=METRICS_DEFAULTS.HOST, port=METRICS_DEFAULTS.PORT):
+    """Serves ``/metrics`` from a daemon thread, returns the server."""
+    server = _MetricsServer((host, port), _MetricsHandler)
+    threading.Thread(
+        target=server.serve_forever, name="Metrics", daemon=True).start()
+    Logger.for_name(__name__).info(
+        "Metrics on http://{}:{}/metrics".format(*server.server_address))
+    return server
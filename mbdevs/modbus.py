@@ -1,8 +1,22 @@
-from collections import namedtuple
-from enum import Enum
+import time
+import queue
+import threading
+
+from collections import namedtuple, OrderedDict
+from enum import Enum, IntEnum
+from . import planner, tracing
+from .breaker import Breakers
+from .cache import RegisterCache
 from .common import Logger
-from .exceptions import CannotReadARegisterValue
+from .connection import ConnectionManager, is_tcp_url
+from .exceptions import CannotReadARegisterValue, ModbusNoResponse, \
+    ModbusCrcError, ModbusSlaveException
+from .messages import BusRequest, ReadReq, WriteReq, ReadManyReq, \
+    WriteManyReq, Batch
+from .metrics import Metrics
+from .scheduler import BusScheduler
 import pykka
+import serial
 import minimalmodbus
 
 FunctionCode = namedtuple('FunctionCodes', ['read', 'write'])
@@ -18,99 +32,681 @@ class FunctionalCodes(Enum):
 Register = namedtuple(
     'MbRegister', ['name', 'addr', 'func_code', 'count', 'value_type', 'unit'])
 
+WriteStats = namedtuple('WriteStats', ['suppressed', 'merged'])
+
+BusStats = namedtuple(
+    'BusStats',
+    ['port', 'transactions', 'errors', 'busy', 'utilization', 'queue'])
+
+QueueStats = namedtuple(
+    'QueueStats', ['port', 'priority', 'requests', 'mean_wait', 'max_wait'])
+
+BusQueueDefaults = namedtuple('BusQueueDefaults', ['AGING'])
+
+# A waiting request moves up one priority class every AGING seconds, so
+# polls and lights are delayed by commands but never starved.
+BUS_QUEUE_DEFAULTS = BusQueueDefaults(AGING=0.5)
+
+
+class BusPriority(IntEnum):
+    """Order in which a serial bus serves the requests waiting for it."""
+    SAFETY = 0
+    INTERACTIVE = 1
+    POLL = 2
+    COSMETIC = 3
+
+
+_TRANSACTION_SECONDS = Metrics.registry().histogram(
+    'modbus_transaction_seconds', 'Duration of Modbus transactions.',
+    ('port', 'slave', 'function'))
+
+_ERRORS = Metrics.registry().counter(
+    'modbus_errors_total', 'Failed Modbus transactions by kind of error.',
+    ('port', 'slave', 'function', 'kind'))
+
+
+def error_kind(e):
+    """One of timeout, crc, slave (exception response) and other."""
+    if isinstance(e, BusTransactions.SLAVE_DOWN_ERRORS):
+        return 'timeout'
+    if isinstance(e, ModbusCrcError) or \
+       (isinstance(e, minimalmodbus.InvalidResponseError) and
+            str(e).startswith('Checksum error')):
+        return 'crc'
+    if isinstance(e, (ModbusSlaveException,
+                      minimalmodbus.SlaveReportedException)):
+        return 'slave'
+    return 'other'
+
+
+class _QueueMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.wait = 0
+        self.max_wait = 0
+
 
-class Action(Enum):
-    READ = 0
-    WRITE = 1
+class _BusMetrics:
+    def __init__(self, port):
+        self.port = port
+        self.started = time.monotonic()
+        self.transactions = 0
+        self.errors = 0
+        self.busy = 0
+        self.waits = dict((p, _QueueMetrics()) for p in BusPriority)
 
-class Modbus(pykka.ThreadingActor):
-    __instance = None
+
+class _PriorityInbox(queue.Queue):
+    """Actor inbox handing out the most urgent request first.
+
+    A request ranks by its ``BusPriority`` less one class for every
+    ``AGING`` seconds it waited, equal ranks go in arrival order. Messages
+    without a priority, like the actor stop, go after all the requests.
+    """
+
+    metrics = None
+
+    def _init(self, maxsize):
+        self.queue = []
+        self._seq = 0
+
+    def _qsize(self):
+        return len(self.queue)
+
+    def _put(self, envelope):
+        message = envelope.message
+        if isinstance(message, BusRequest):
+            priority = message.priority
+        else:
+            priority = len(BusPriority)
+        self._seq += 1
+        self.queue.append((priority, self._seq, time.monotonic(), envelope))
+
+    def _get(self):
+        now = time.monotonic()
+        aging = BUS_QUEUE_DEFAULTS.AGING
+        best = min(
+            range(len(self.queue)),
+            key=lambda i: (self.queue[i][0] - (now - self.queue[i][2]) / aging,
+                           self.queue[i][1]))
+        priority, _, queued, envelope = self.queue.pop(best)
+
+        waits = self.metrics.waits.get(priority) if self.metrics else None
+        if waits:
+            wait = now - queued
+            waits.requests += 1
+            waits.wait += wait
+            waits.max_wait = max(waits.max_wait, wait)
+        return envelope
+
+
+class CoilShadow:
+    """Last value written to every coil of the slaves on a port.
+
+    One per port, shared by all its devices and updated by the bus as the
+    writes go out, because several devices may drive the same coil. The
+    coils of a slave are forgotten when a transaction with it fails and
+    all of them when the port is reopened.
+    """
+
+    __shadows = dict()
+    __shadows_lock = threading.Lock()
 
     @classmethod
-    def modbus(cls):
-        if not cls.__instance:
-            cls.__instance = cls.start()
+    def for_port(cls, port):
+        with cls.__shadows_lock:
+            shadow = cls.__shadows.get(port)
+            if shadow is None:
+                shadow = cls.__shadows[port] = cls()
 
-        return cls.__instance
+        return shadow
 
     def __init__(self):
-        super().__init__()
-        self._log = Logger.for_name(__name__)
-        self._mb = None
+        self._lock = threading.Lock()
+        self._values = dict()
+        self._opens = None
 
-    def on_receive(self, msg):
-        self._mb = msg["mb"]
-        if self._mb:
-            reg = msg["reg"]
-            if msg["action"] == Action.READ:
-                return self._read(msg["reg"])
-            elif msg["action"] == Action.WRITE:
-                return self._write(msg["reg"], msg["value"])
-
-    def _read(self, reg):
+    def get(self, slave, addr):
+        return self._values.get((slave, addr))
+
+    def set(self, slave, addr, value):
+        with self._lock:
+            self._values[(slave, addr)] = bool(value)
+
+    def forget(self, slave, addrs):
+        with self._lock:
+            for addr in addrs:
+                self._values.pop((slave, addr), None)
+
+    def forget_slave(self, slave):
+        with self._lock:
+            for key in [key for key in self._values if key[0] == slave]:
+                del self._values[key]
+
+    def check_opens(self, opens):
+        # A reopened port may mean a power cycled adapter, so the coils are
+        # not trusted to hold the last written values any more.
+        with self._lock:
+            if opens != self._opens:
+                self._values.clear()
+                self._opens = opens
+
+
+class BusTransactions:
+    """Register level requests on the instrument of a bus request.
+
+    Shared by the serial bus actor and the TCP gateway bus. A slave which
+    stopped answering is skipped by its breaker, see ``mbdevs.breaker``.
+    Only clean transactions count as its successes and round trips, an
+    exception response of the slave counts as neither.
+    """
+
+    # Errors meaning that nobody answered at the slave address.
+    SLAVE_DOWN_ERRORS = (minimalmodbus.NoResponseError, ModbusNoResponse)
+
+    _slave_down = False
+    _clean = True
+    _failed = False
+
+    def _execute(self, req):
+        mb = req.mb
+        breaker = Breakers.registry().breaker(self._metrics.port, mb.address)
+        if not breaker.allow():
+            return req.skipped()
+
+        self._set_timeout(mb, breaker)
+        self._slave_down = False
+        self._clean = True
+        self._failed = False
+        handler, span, frames = self._handlers[type(req)]
+        start = time.perf_counter()
+        if req.trace is None:
+            result = handler(self, req)
+        else:
+            with tracing.attach(req.trace), tracing.span(span):
+                result = handler(self, req)
+
+        if self._failed:
+            breaker.failure()
+        elif self._clean:
+            breaker.success(
+                (time.perf_counter() - start) / max(frames(req), 1))
+        return result
+
+    def _set_timeout(self, mb, breaker):
+        pass
+
+    def _observe(self, mb, func_code, start, error=None):
+        labels = (self._metrics.port, mb.address, func_code)
+        _TRANSACTION_SECONDS.observe(labels, time.perf_counter() - start)
+        if error is not None:
+            _ERRORS.inc(labels + (error_kind(error), ))
+            CoilShadow.for_port(self._metrics.port).forget_slave(mb.address)
+
+    def _read(self, mb, reg):
+        func_code = reg.func_code.value.read
+        start = time.perf_counter()
         try:
-            if reg.func_code == FunctionalCodes.COIL or\
-               reg.func_code == FunctionalCodes.DISCRETE:
-                return bool(
-                    self._mb.read_bit(reg.addr, reg.func_code.value.read))
-            elif reg.value_type is float:
-                return reg.value_type(
-                    self._mb.read_float(reg.addr, reg.func_code.value.read))
-            elif reg.value_type is str:
-                return reg.value_type(
-                    self._mb.read_string(reg.addr, reg.count,
-                                         reg.func_code.value.read))
-            else:
-                return reg.value_type(
-                    self._mb.read_register(reg.addr, reg.count,
-                                           reg.func_code.value.read))
+            value = planner.codec(reg).read(mb, reg)
         except Exception as e:
+            self._observe(mb, func_code, start, e)
             self._log.error(
                 "Cannot read a \"{}\" register!".format(reg.name),
                 exc_info=True)
+            self._check_connection(e)
             return None
 
-    def _write(self, reg, val):
+        self._observe(mb, func_code, start)
+        return value
+
+    def _read_many(self, mb, plan):
+        values = dict()
+        for block in plan:
+            if self._slave_down:
+                break
+            func_code = block.func_code.value.read
+            start = time.perf_counter()
+            try:
+                if planner.is_bit(block.regs[0]):
+                    raw = mb.read_bits(block.addr, block.count,
+                                             func_code)
+                else:
+                    raw = mb.read_registers(block.addr, block.count,
+                                            func_code)
+            except Exception as e:
+                self._observe(mb, func_code, start, e)
+                self._log.error(
+                    "Cannot read registers {}!".format(", ".join(
+                        "\"{}\"".format(reg.name) for reg in block.regs)),
+                    exc_info=True)
+                self._check_connection(e)
+                continue
+
+            self._observe(mb, func_code, start)
+            for reg, decode in block.decoders:
+                values[reg] = decode(raw)
+
+        return values
+
+    def _write(self, mb, reg, val):
+        # Everything but a coil goes out as "write multiple registers".
+        codec = planner.codec(reg)
+        func_code = codec.write_code
+        start = time.perf_counter()
         try:
-            if reg.func_code == FunctionalCodes.COIL:
-                self._mb.write_bit(reg.addr, val, reg.func_code.value.write)
-            elif reg.value_type is float:
-                self._mb.write_float(reg.addr, reg.value_type(val),
-                                     reg.func_code.value.write)
-            elif reg.value_type is str:
-                self._mb.write_string(reg.addr, reg.value_type(val))
-            else:
-                return self._mb.write_registers(reg.addr, val)
+            codec.write(mb, reg, val)
         except Exception as e:
+            self._observe(mb, func_code, start, e)
             self._log.error(
                 "Cannot write to a \"{}\" register!".format(reg.name),
                 exc_info=True)
+            self._check_connection(e)
+            return False
+
+        self._observe(mb, func_code, start)
+        if planner.is_bit(reg):
+            CoilShadow.for_port(self._metrics.port).set(
+                mb.address, reg.addr, val)
+        return True
+
+    def _write_many(self, mb, plan):
+        """Returns the registers which were written successfully."""
+        written = []
+        for block in plan:
+            if self._slave_down:
+                break
+            if len(block.regs) == 1:
+                if self._write(mb, block.regs[0], block.values[0]):
+                    written.append(block.regs[0])
+                continue
+
+            start = time.perf_counter()
+            try:
+                mb.write_bits(block.addr,
+                              [int(bool(v)) for v in block.values])
+            except Exception as e:
+                self._observe(mb, 15, start, e)
+                self._log.error(
+                    "Cannot write to registers {}!".format(", ".join(
+                        "\"{}\"".format(reg.name) for reg in block.regs)),
+                    exc_info=True)
+                self._check_connection(e)
+                continue
+
+            self._observe(mb, 15, start)
+            shadow = CoilShadow.for_port(self._metrics.port)
+            for reg, value in zip(block.regs, block.values):
+                shadow.set(mb.address, reg.addr, value)
+            written.extend(block.regs)
+
+        return written
+
+    def _check_connection(self, e):
+        self._metrics.errors += 1
+        self._clean = False
+        if error_kind(e) != 'slave':
+            self._failed = True
+        if isinstance(e, self.SLAVE_DOWN_ERRORS):
+            self._slave_down = True
+
+    # Request type -> (handler, span name, frames of the request), built
+    # once for all the requests.
+    _handlers = {
+        ReadReq: (lambda self, r: self._read(r.mb, r.reg), "modbus read",
+                  lambda r: 1),
+        WriteReq: (lambda self, r: self._write(r.mb, r.reg, r.value),
+                   "modbus write", lambda r: 1),
+        ReadManyReq: (lambda self, r: self._read_many(r.mb, r.plan),
+                      "modbus read_many", lambda r: len(r.plan)),
+        WriteManyReq: (lambda self, r: self._write_many(r.mb, r.plan),
+                       "modbus write_many", lambda r: len(r.plan)),
+    }
+
+
+class Modbus(BusTransactions, pykka.ThreadingActor):
+    """Serializes the transactions of one serial line.
+
+    Every port gets its own bus actor, so devices on different adapters
+    do not wait for each other. Ports given as ``tcp://host:port`` or
+    ``rtu+tcp://host:port`` get a ``TcpBus`` instead, see ``mbdevs.tcp``.
+
+    Waiting requests are served by their ``"priority"``, a door command
+    does not queue behind the polls of the other devices.
+    """
+
+    __buses = dict()
+    __buses_lock = threading.Lock()
+
+    @classmethod
+    def for_port(cls, port):
+        with cls.__buses_lock:
+            bus, metrics, depth = cls.__buses.get(port, (None, None, None))
+            if bus is None or not bus.is_alive():
+                metrics = _BusMetrics(port)
+                if is_tcp_url(port):
+                    from .tcp import TcpBus
+                    bus = TcpBus(port, metrics)
+                    depth = bus.in_flight
+                else:
+                    bus = cls.start(metrics)
+                    depth = bus.actor_inbox.qsize
+                cls.__buses[port] = (bus, metrics, depth)
+
+        return bus
+
+    @classmethod
+    def stats(cls):
+        """Returns ``BusStats`` of every bus, utilization is since its start.
+
+        Requests to a TCP gateway overlap, so its utilization may be
+        above 1.
+        """
+        with cls.__buses_lock:
+            buses = list(cls.__buses.values())
+
+        now = time.monotonic()
+        return [
+            BusStats(m.port, m.transactions, m.errors, m.busy,
+                     m.busy / max(now - m.started, 1e-9), depth())
+            for bus, m, depth in buses
+        ]
+
+    @classmethod
+    def queue_stats(cls):
+        """Returns ``QueueStats`` of every bus and priority class."""
+        with cls.__buses_lock:
+            buses = list(cls.__buses.values())
+
+        return [
+            QueueStats(m.port, priority, w.requests,
+                       w.wait / w.requests if w.requests else 0, w.max_wait)
+            for bus, m, depth in buses
+            for priority, w in sorted(m.waits.items())
+        ]
+
+    @staticmethod
+    def _create_actor_inbox():
+        return _PriorityInbox()
+
+    def __init__(self, metrics):
+        super().__init__()
+        self.actor_inbox.metrics = metrics
+        self._log = Logger.for_name(__name__)
+        self._connections = ConnectionManager.manager()
+        self._metrics = metrics
+        self._conn = None
+
+    def on_receive(self, msg):
+        if isinstance(msg, Batch):
+            return [self._serve(req) for req in msg.requests]
+        return self._serve(msg)
+
+    def _serve(self, req):
+        self._conn = self._connections.connection_for(req.mb)
+        if self._conn and not self._conn.ensure_open():
+            self._log.error("Port {} is not available!".format(
+                self._conn.port))
+            return None
+
+        start = time.perf_counter()
+        try:
+            return self._execute(req)
+        finally:
+            self._metrics.transactions += 1
+            self._metrics.busy += time.perf_counter() - start
+
+    def _check_connection(self, e):
+        BusTransactions._check_connection(self, e)
+        # Modbus-level errors (no answer, bad CRC) leave the port usable,
+        # anything else coming from the serial layer means reopen it.
+        if isinstance(e, minimalmodbus.ModbusException):
+            return
+        if self._conn and isinstance(e, (serial.SerialException, OSError)):
+            self._conn.mark_broken()
+
+    def _set_timeout(self, mb, breaker):
+        from . import mb_settings
+
+        # Changing the timeout of an open port reconfigures it, so only
+        # do it when the slave's timeout moved.
+        timeout = breaker.timeout(mb_settings().MB_TIMEOUT)
+        port = mb.serial
+        if port.timeout != timeout:
+            port.timeout = timeout
+
+Metrics.registry().gauge(
+    'modbus_queue_depth', 'Requests waiting for the bus or in flight.',
+    ('port', ), lambda: [((bus.port, ), bus.queue) for bus in Modbus.stats()])
+
+Metrics.registry().gauge(
+    'modbus_queue_wait_seconds_max', 'Longest wait for the bus so far.',
+    ('port', 'priority'),
+    lambda: [((q.port, q.priority.name.lower()), q.max_wait)
+             for q in Modbus.queue_stats()])
 
-        return None
 
 class ModbusUser:
+    read_gaps = (planner.PLANNER_DEFAULTS.BIT_GAP,
+                 planner.PLANNER_DEFAULTS.WORD_GAP)
+
+    # Register -> seconds its value may be served from the cache.
+    cache_ttls = dict()
+
+    # Bus priority of the device's requests unless a call gives its own.
+    bus_priority = BusPriority.POLL
+
     def __init__(self, mb_instrument):
         self._mb = mb_instrument
-        self._mb_actor = Modbus.modbus()
-    
-    def _read_reg(self, reg):
-        ans = self._mb_actor.ask({
-            "mb": self._mb,
-            "action": Action.READ,
-            "reg": reg
-        })
+        self._mb_actor = Modbus.for_port(self.port)
+        self._read_plans = dict()
+        self._cache = RegisterCache(self.cache_ttls)
+
+        # Last value written to the coils of the port, and the writes
+        # waiting for the bus. Writes queued while another thread is
+        # writing go out with the next batch.
+        self._shadow = CoilShadow.for_port(self.port)
+        self._pending = OrderedDict()
+        self._pending_priority = BusPriority.COSMETIC
+        self._write_cond = threading.Condition()
+        self._flushing = False
+        self._batch = 0
+        self._flushed = 0
+        self._failed = frozenset()
+        self.suppressed_writes = 0
+        self.merged_writes = 0
+
+    @property
+    def port(self):
+        return self._mb.serial.port
+
+    @property
+    def slave_address(self):
+        return self._mb.address
+
+    @property
+    def history_source(self):
+        """Name of the device in ``mbdevs.history``."""
+        return getattr(self, 'health_name', None) or \
+            "slave {}".format(self._mb.address)
+
+    @property
+    def cache_stats(self):
+        return self._cache.stats()
+
+    @property
+    def write_stats(self):
+        return WriteStats(self.suppressed_writes, self.merged_writes)
+
+    def read_many(self, regs, priority=BusPriority.POLL):
+        """Reads several registers of the device with merged requests.
+
+        Returns the values in the order of ``regs``.
+        """
+        regs = tuple(regs)
+        if any(self._cache.ttl(reg) for reg in regs):
+            return self._cache.read(
+                regs, lambda regs: self._read_many(regs, priority))
+
+        return self._read_many(regs, priority)
+
+    def read_batch(self, groups, priority=BusPriority.POLL):
+        """Reads several groups of registers with a single bus message.
+
+        Returns the values of every group in the order of its registers,
+        or the ``CannotReadARegisterValue`` of a group which failed.
+        """
+        groups = [tuple(regs) for regs in groups]
+        results = [None] * len(groups)
+        live = []
+        for i, regs in enumerate(groups):
+            if any(self._cache.ttl(reg) for reg in regs):
+                try:
+                    results[i] = self.read_many(regs, priority)
+                except CannotReadARegisterValue as e:
+                    results[i] = e
+            else:
+                live.append(i)
+
+        if len(live) == 1:
+            i = live[0]
+            try:
+                results[i] = self._read_many(groups[i], priority)
+            except CannotReadARegisterValue as e:
+                results[i] = e
+        elif live:
+            answers = self._ask(
+                Batch(
+                    ReadManyReq(self._mb, self._read_plan(groups[i]),
+                                priority) for i in live))
+            for i, values in zip(live, answers):
+                try:
+                    results[i] = self._ordered_values(groups[i], values)
+                except CannotReadARegisterValue as e:
+                    results[i] = e
+
+        return results
+
+    def _read_plan(self, regs):
+        plan = self._read_plans.get(regs)
+        if plan is None:
+            plan = planner.plan_reads(regs, *self.read_gaps)
+            self._read_plans[regs] = plan
+        return plan
+
+    @staticmethod
+    def _ordered_values(regs, values):
+        for reg in regs:
+            if values is None or reg not in values:
+                raise CannotReadARegisterValue(reg)
+
+        return [values[reg] for reg in regs]
+
+    def _read_many(self, regs, priority=BusPriority.POLL):
+        regs = tuple(regs)
+        values = self._ask(
+            ReadManyReq(self._mb, self._read_plan(regs), priority))
+        return self._ordered_values(regs, values)
+
+    def _read_reg(self, reg, priority=None):
+        if priority is None:
+            priority = self.bus_priority
+        if self._cache.ttl(reg):
+            return self._cache.read(
+                (reg, ), lambda regs: [self._read_reg_live(reg, priority)])[0]
+
+        return self._read_reg_live(reg, priority)
+
+    def _read_reg_live(self, reg, priority):
+        ans = self._ask(ReadReq(self._mb, reg, priority))
 
         if ans is None:
             raise CannotReadARegisterValue(reg)
 
         return ans
 
-    def _write_reg(self, reg, val):
-        ans = self._mb_actor.ask({
-            "mb": self._mb,
-            "action": Action.WRITE,
-            "reg": reg,
-            "value": val
-        })
+    def _write_reg(self, reg, val, priority=None):
+        return self._write_many((reg, ), (val, ), priority)
 
-        return ans
+    def _write_many(self, regs, values, priority=None):
+        """Writes several registers, adjacent coils in a single request.
+
+        A coil write which would not change the last written value is
+        dropped. Returns False if some of the registers were not written.
+        A batch of writes goes out with the highest priority in it.
+        """
+        if priority is None:
+            priority = self.bus_priority
+        self._cache.invalidate(regs)
+        with self._write_cond:
+            self._check_shadow()
+            queued = False
+            slave = self._mb.address
+            for reg, value in zip(regs, values):
+                if planner.is_bit(reg) and reg not in self._pending and \
+                   self._shadow.get(slave, reg.addr) == bool(value):
+                    self.suppressed_writes += 1
+                    continue
+                if reg in self._pending:
+                    self.merged_writes += 1
+                self._pending[reg] = value
+                queued = True
+
+            if not queued:
+                return True
+            self._pending_priority = min(self._pending_priority, priority)
+
+            batch = self._batch
+            while self._flushed <= batch:
+                if not self._flushing:
+                    return self._flush()
+                self._write_cond.wait()
+
+            return self._failed.isdisjoint(regs)
+
+    def _flush(self):
+        # Called and returns with the write condition held.
+        self._flushing = True
+        pending = self._pending
+        priority = self._pending_priority
+        self._pending = OrderedDict()
+        self._pending_priority = BusPriority.COSMETIC
+        self._batch += 1
+
+        regs = tuple(pending.keys())
+        plan = planner.plan_writes(regs, tuple(pending.values()))
+        self.merged_writes += len(regs) - len(plan)
+
+        # Until the bus writes them the coils may hold anything, a device
+        # sharing them must not drop its own writes meanwhile.
+        self._shadow.forget(self._mb.address,
+                            [reg.addr for reg in regs if planner.is_bit(reg)])
+
+        written = []
+        self._write_cond.release()
+        try:
+            with BusScheduler.scheduler(self.port).preempt():
+                written = self._ask(
+                    WriteManyReq(self._mb, plan, priority)) or []
+        finally:
+            self._write_cond.acquire()
+            written = set(written)
+            self._failed = frozenset(regs) - written
+            self._flushed = self._batch
+            self._flushing = False
+            self._write_cond.notify_all()
+
+        return not self._failed
+
+    def _ask(self, req):
+        # The wait for the bus is the "bus" stage of a traced command.
+        trace = tracing.current()
+        if trace is None:
+            return self._mb_actor.ask(req)
+
+        req.set_trace(trace)
+        with tracing.span("bus"):
+            return self._mb_actor.ask(req)
+
+    def _check_shadow(self):
+        conn = ConnectionManager.manager().connection_for(self._mb)
+        self._shadow.check_opens(conn.opens if conn else None)
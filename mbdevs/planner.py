@@ -0,0 +1,221 @@
+import struct
+import functools
+import threading
+
+from collections import namedtuple, OrderedDict
+
+PlannerDefaults = namedtuple(
+    'PlannerDefaults', ['BIT_GAP', 'WORD_GAP', 'MAX_BITS', 'MAX_WORDS'])
+
+# Extra bits cost an eighth of a byte each, so bit blocks can bridge much
+# wider holes than register blocks before one frame gets slower than two.
+PLANNER_DEFAULTS = PlannerDefaults(
+    BIT_GAP=32, WORD_GAP=8, MAX_BITS=2000, MAX_WORDS=125)
+
+# ``decoders`` are the ``(reg, decode)`` pairs taking the values of
+# ``regs`` from the result of the block read.
+ReadBlock = namedtuple('ReadBlock',
+                       ['func_code', 'addr', 'count', 'regs', 'decoders'])
+
+# How the instrument reads, writes and (de)serializes one register:
+#   read(mb, reg) and write(mb, reg, value) are single transactions,
+#   decode(raw, offset) takes the value from the result of a block read,
+#   encode(value) gives the 16-bit words of a value,
+#   write_code is the function code of write().
+Codec = namedtuple('Codec',
+                   ['read', 'write', 'decode', 'encode', 'write_code'])
+
+
+def is_bit(reg):
+    return reg.func_code.value.read in (1, 2)
+
+
+def span(reg):
+    """Number of coils or 16-bit registers occupied by ``reg``."""
+    if is_bit(reg):
+        return 1
+    if reg.value_type is float or reg.value_type is str:
+        return reg.count
+    return 1
+
+
+def _encode_words(value):
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [int(value)]
+
+
+def _bit_codec(reg):
+    def read(mb, reg):
+        return bool(mb.read_bit(reg.addr, reg.func_code.value.read))
+
+    def write(mb, reg, value):
+        mb.write_bit(reg.addr, value, reg.func_code.value.write)
+
+    return Codec(read, write, lambda raw, offset: bool(raw[offset]),
+                 lambda value: [int(bool(value))], reg.func_code.value.write)
+
+
+def _float_codec(reg):
+    value_type = reg.value_type
+
+    def read(mb, reg):
+        return value_type(mb.read_float(reg.addr, reg.func_code.value.read))
+
+    def write(mb, reg, value):
+        mb.write_float(reg.addr, value_type(value), reg.func_code.value.write)
+
+    def decode(raw, offset):
+        return value_type(
+            struct.unpack('>f', struct.pack('>HH', *raw[offset:offset + 2]))
+            [0])
+
+    def encode(value):
+        return list(struct.unpack('>HH', struct.pack('>f', float(value))))
+
+    return Codec(read, write, decode, encode, 16)
+
+
+def _str_codec(reg):
+    value_type = reg.value_type
+    words = struct.Struct('>{}H'.format(reg.count))
+
+    def read(mb, reg):
+        return value_type(
+            mb.read_string(reg.addr, reg.count, reg.func_code.value.read))
+
+    def write(mb, reg, value):
+        mb.write_string(reg.addr, value_type(value))
+
+    def decode(raw, offset):
+        return value_type(
+            words.pack(*raw[offset:offset + reg.count]).decode('latin1'))
+
+    def encode(value):
+        data = str(value).encode('latin1').ljust(2 * reg.count)
+        return list(words.unpack(data[:2 * reg.count]))
+
+    return Codec(read, write, decode, encode, 16)
+
+
+def _word_codec(reg):
+    value_type = reg.value_type
+    # Mirrors read_register(), where count is the number of decimals.
+    scale = 10**reg.count
+
+    def read(mb, reg):
+        return value_type(
+            mb.read_register(reg.addr, reg.count, reg.func_code.value.read))
+
+    def write(mb, reg, value):
+        mb.write_registers(reg.addr, _encode_words(value))
+
+    if scale == 1:
+        decode = lambda raw, offset: value_type(raw[offset])
+    else:
+        decode = lambda raw, offset: value_type(raw[offset] / scale)
+
+    return Codec(read, write, decode, _encode_words, 16)
+
+
+_codecs = dict()
+_codecs_lock = threading.Lock()
+
+
+def codec(reg):
+    """Returns the ``Codec`` of ``reg``, built once per register."""
+    c = _codecs.get(reg)
+    if c is None:
+        if is_bit(reg):
+            c = _bit_codec(reg)
+        elif reg.value_type is float:
+            c = _float_codec(reg)
+        elif reg.value_type is str:
+            c = _str_codec(reg)
+        else:
+            c = _word_codec(reg)
+        with _codecs_lock:
+            c = _codecs.setdefault(reg, c)
+    return c
+
+
+def _read_block(func_code, start, end, regs):
+    decoders = tuple(
+        (reg, functools.partial(codec(reg).decode, offset=reg.addr - start))
+        for reg in regs)
+    return ReadBlock(func_code, start, end - start, tuple(regs), decoders)
+
+
+def plan_reads(regs,
+               bit_gap=PLANNER_DEFAULTS.BIT_GAP,
+               word_gap=PLANNER_DEFAULTS.WORD_GAP):
+    """Groups registers of one slave into as few read requests as possible.
+
+    Registers are grouped by function code and sorted by address; a
+    register joins the current block while the hole before it is not
+    wider than the gap and the block fits into a single Modbus frame.
+    """
+    groups = OrderedDict()
+    for reg in regs:
+        groups.setdefault(reg.func_code, []).append(reg)
+
+    blocks = []
+    for func_code, group in groups.items():
+        bits = is_bit(group[0])
+        gap = bit_gap if bits else word_gap
+        limit = PLANNER_DEFAULTS.MAX_BITS if bits \
+            else PLANNER_DEFAULTS.MAX_WORDS
+
+        start, end, members = None, None, []
+        for reg in sorted(set(group), key=lambda r: r.addr):
+            reg_end = reg.addr + span(reg)
+            if members and reg.addr - end <= gap and \
+               max(end, reg_end) - start <= limit:
+                end = max(end, reg_end)
+                members.append(reg)
+                continue
+
+            if members:
+                blocks.append(_read_block(func_code, start, end, members))
+            start, end, members = reg.addr, reg_end, [reg]
+
+        if members:
+            blocks.append(_read_block(func_code, start, end, members))
+
+    return tuple(blocks)
+
+
+def decode(reg, raw, offset):
+    """Decodes ``reg`` from the raw bits/registers of a block read."""
+    return codec(reg).decode(raw, offset)
+
+
+def encode(reg, value):
+    """Encodes a register value into 16-bit words, the inverse of decode."""
+    return codec(reg).encode(value)
+
+
+WriteBlock = namedtuple('WriteBlock', ['func_code', 'addr', 'regs', 'values'])
+
+
+def plan_writes(regs, values):
+    """Merges writes to adjacent coils into write-multiple-coils blocks.
+
+    Unlike reads, writes never bridge a gap: every coil in a block is
+    written. Other registers are written one by one.
+    """
+    pending = sorted(zip(regs, values), key=lambda rv: rv[0].addr)
+
+    blocks = []
+    for reg, value in pending:
+        last = blocks[-1] if blocks else None
+        if last and is_bit(reg) and last.func_code == reg.func_code and \
+           reg.addr == last.addr + len(last.regs):
+            last.regs.append(reg)
+            last.values.append(value)
+            continue
+        blocks.append(WriteBlock(reg.func_code, reg.addr, [reg], [value]))
+
+    return tuple(
+        WriteBlock(b.func_code, b.addr, tuple(b.regs), tuple(b.values))
+        for b in blocks)
@@ -0,0 +1,112 @@
+import time
+import threading
+import serial.tools.list_ports
+
+from collections import namedtuple
+from .common import Logger
+from .exceptions import ComDeviceNotFound
+
+PortRegistryStats = namedtuple(
+    'PortRegistryStats', ['scans', 'last_scan_time', 'total_scan_time', 'ports'])
+
+
+class PortRegistry:
+    """Serial ports of the machine, enumerated once and looked up by VID:PID.
+
+    Every lookup for the same adapter returns the same port object, so all
+    devices on a bus end up on one connection. An unknown adapter triggers
+    a rescan, which picks up hotplugged ones.
+    """
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    @classmethod
+    def registry(cls):
+        with cls.__instance_lock:
+            if not cls.__instance:
+                cls.__instance = cls()
+
+        return cls.__instance
+
+    def __init__(self):
+        self._log = Logger.for_name(__name__)
+        self._lock = threading.Lock()
+        self._ports = None
+        self._by_id = dict()
+
+        self.scans = 0
+        self.last_scan_time = 0
+        self.total_scan_time = 0
+
+    def rescan(self):
+        """Enumerates the ports again, returns the added and removed ones."""
+        with self._lock:
+            return self._scan()
+
+    def _scan(self):
+        start = time.monotonic()
+        old = {p.device: p for p in self._ports or ()}
+        ports = []
+        for p in sorted(serial.tools.list_ports.comports(),
+                        key=lambda p: p.device):
+            # Keep the known objects, they are what devices were given.
+            known = old.get(p.device)
+            if known and (known.vid, known.pid, known.serial_number) == \
+               (p.vid, p.pid, p.serial_number):
+                p = known
+            ports.append(p)
+
+        by_id = dict()
+        for p in ports:
+            by_id.setdefault((p.vid, p.pid), []).append(p)
+
+        added = [p for p in ports if old.get(p.device) is not p]
+        removed = [p for name, p in old.items()
+                   if name not in {p.device for p in ports}]
+        self._ports = ports
+        self._by_id = by_id
+
+        self.scans += 1
+        self.last_scan_time = time.monotonic() - start
+        self.total_scan_time += self.last_scan_time
+        self._log.info("Found {} serial ports in {:.3f} s".format(
+            len(ports), self.last_scan_time))
+        return added, removed
+
+    def ports(self, vid, pid):
+        with self._lock:
+            if self._ports is None:
+                self._scan()
+            return list(self._by_id.get((vid, pid), ()))
+
+    def find(self, vid, pid, serial_number=None):
+        """Returns the port of an adapter, the first one if several match."""
+        with self._lock:
+            if self._ports is None:
+                self._scan()
+            port = self._match(vid, pid, serial_number)
+            if port is None:
+                self._scan()
+                port = self._match(vid, pid, serial_number)
+
+        if port is None:
+            raise ComDeviceNotFound(
+                "Not found any devices with VID:PID = {vid}:{pid}{sn}".format(
+                    vid=vid,
+                    pid=pid,
+                    sn=" and serial number {}".format(serial_number)
+                    if serial_number else ""))
+        return port
+
+    def _match(self, vid, pid, serial_number):
+        for p in self._by_id.get((vid, pid), ()):
+            if serial_number is None or p.serial_number == serial_number:
+                return p
+        return None
+
+    def stats(self):
+        with self._lock:
+            return PortRegistryStats(
+                self.scans, self.last_scan_time, self.total_scan_time,
+                tuple(p.device for p in self._ports or ()))
@@ -0,0 +1,109 @@
+import struct
+
+from .exceptions import ModbusInvalidResponse, ModbusCrcError, \
+    ModbusSlaveException
+
+EXCEPTION_FLAG = 0x80
+
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+
+_CRC_TABLE = _crc_table()
+
+
+def crc16(data):
+    crc = 0xFFFF
+    for byte in data:
+        crc = (crc >> 8) ^ _CRC_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def frame(slave, pdu):
+    """Wraps a PDU into an RTU frame: address, PDU and CRC."""
+    adu = bytes((slave, )) + pdu
+    return adu + struct.pack('<H', crc16(adu))
+
+
+def unframe(adu):
+    if len(adu) < 4:
+        raise ModbusInvalidResponse("Too short frame: {!r}".format(adu))
+    if struct.unpack('<H', adu[-2:])[0] != crc16(adu[:-2]):
+        raise ModbusCrcError("CRC mismatch: {!r}".format(adu))
+    return adu[0], adu[1:-2]
+
+
+def pack_bits(values):
+    data = bytearray((len(values) + 7) // 8)
+    for i, value in enumerate(values):
+        if value:
+            data[i // 8] |= 1 << (i % 8)
+    return bytes(data)
+
+
+def unpack_bits(data, count):
+    return [(data[i // 8] >> (i % 8)) & 1 for i in range(count)]
+
+
+def read_request(func_code, addr, count):
+    return struct.pack('>BHH', func_code, addr, count)
+
+
+def write_bit_request(addr, value):
+    return struct.pack('>BHH', 5, addr, 0xFF00 if value else 0)
+
+
+def write_register_request(addr, value):
+    return struct.pack('>BHH', 6, addr, value)
+
+
+def write_bits_request(addr, values):
+    data = pack_bits(values)
+    return struct.pack('>BHHB', 15, addr, len(values), len(data)) + data
+
+
+def write_registers_request(addr, values):
+    return struct.pack('>BHHB{}H'.format(len(values)), 16, addr, len(values),
+                       2 * len(values), *values)
+
+
+def response_length(request):
+    """Length of the response PDU to a request PDU."""
+    func_code = request[0]
+    if func_code in (1, 2):
+        count = struct.unpack('>H', request[3:5])[0]
+        return 2 + (count + 7) // 8
+    elif func_code in (3, 4):
+        count = struct.unpack('>H', request[3:5])[0]
+        return 2 + 2 * count
+    return 5
+
+
+def parse_response(request, response):
+    """Returns read bits/registers, or None for a write acknowledge."""
+    func_code = request[0]
+    if response[0] == func_code | EXCEPTION_FLAG:
+        raise ModbusSlaveException(
+            "Slave exception {} for function {}".format(
+                response[1] if len(response) > 1 else None, func_code))
+    if response[0] != func_code or len(response) != response_length(request):
+        raise ModbusInvalidResponse("Unexpected response: {!r}".format(response))
+
+    if func_code in (1, 2):
+        count = struct.unpack('>H', request[3:5])[0]
+        return unpack_bits(response[2:], count)
+    elif func_code in (3, 4):
+        count = struct.unpack('>H', request[3:5])[0]
+        return list(struct.unpack('>{}H'.format(count), response[2:]))
+
+    if response[1:5] != request[1:5]:
+        raise ModbusInvalidResponse("Write is not acknowledged: {!r}".format(
+            response))
+    return None
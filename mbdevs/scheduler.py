@@ -0,0 +1,310 @@
+import enum
+import math
+import time
+import threading
+
+from collections import namedtuple
+from contextlib import contextmanager
+from . import planner
+from .common import Logger
+from .exceptions import CannotReadARegisterValue
+from .history import History
+from .telemetry import Telemetry
+
+SchedulerDefaults = namedtuple(
+    'SchedulerDefaults', ['BUDGET', 'TURNAROUND', 'MAX_STRETCH'])
+
+# BUDGET is the share of the bus polling may take, the rest is left for
+# command writes. TURNAROUND covers slave processing and the USB latency
+# of the adapter for every transaction.
+SCHEDULER_DEFAULTS = SchedulerDefaults(
+    BUDGET=0.8, TURNAROUND=0.004, MAX_STRETCH=10)
+
+PollReport = namedtuple('PollReport', [
+    'name', 'priority', 'period', 'effective_period', 'cost', 'runs',
+    'overruns', 'max_lag'
+])
+
+
+class Priority(enum.IntEnum):
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+def frame_time(block, baudrate, parity='N'):
+    """Estimated bus time of a single read request, in seconds."""
+    char_bits = 10 if parity == 'N' else 11
+    if planner.is_bit(block.regs[0]):
+        data = int(math.ceil(block.count / 8))
+    else:
+        data = 2 * block.count
+    chars = 8 + 5 + data
+    # Above 19200 baud the inter-frame gap is fixed at 1.75 ms.
+    gap = 3.5 * char_bits / baudrate if baudrate <= 19200 else 0.00175
+    return chars * char_bits / baudrate + 2 * gap + \
+        SCHEDULER_DEFAULTS.TURNAROUND
+
+
+class _PollSet:
+    def __init__(self, name, period, callback, user, regs, priority,
+                 bus_priority):
+        self.name = name
+        self.period = period
+        self.effective_period = period
+        self.callback = callback
+        self.user = user
+        self.regs = tuple(regs)
+        self.priority = priority
+        self.bus_priority = bus_priority
+        self.cost = 0
+        self.next_due = time.monotonic()
+        self.runs = 0
+        self.overruns = 0
+        self.max_lag = 0
+
+    def report(self):
+        return PollReport(self.name, self.priority, self.period,
+                          self.effective_period, self.cost, self.runs,
+                          self.overruns, self.max_lag)
+
+
+class BusScheduler:
+    """Runs every periodic poll of a bus from a single thread.
+
+    There is one scheduler per serial port, so the buses are polled in
+    parallel. Poll sets without registers go to the scheduler of no port.
+
+    Devices register poll sets with a period and a priority instead of
+    running their own sleep loops. The due poll set with the highest
+    priority runs first, and when the registered rates do not fit into
+    the bus budget at the configured baudrate the periods of the least
+    important sets are stretched and a warning is logged.
+
+    Poll sets of one device which are due together are read with a
+    single ``read_batch()`` message to the bus. The values of every poll
+    go to ``mbdevs.history``.
+
+    Command writes wrapped into ``preempt()`` hold back the next poll
+    until they are done, so they wait for at most one poll in flight.
+    """
+
+    __instances = dict()
+    __instances_lock = threading.Lock()
+
+    @classmethod
+    def scheduler(cls, port=None):
+        with cls.__instances_lock:
+            instance = cls.__instances.get(port)
+            if not instance:
+                instance = cls(port=port)
+                instance.start()
+                cls.__instances[port] = instance
+
+        return instance
+
+    @classmethod
+    def schedulers(cls):
+        with cls.__instances_lock:
+            return dict(cls.__instances)
+
+    def __init__(self, budget=SCHEDULER_DEFAULTS.BUDGET, port=None):
+        self._log = Logger.for_name(__name__)
+        self.port = port
+        self._cond = threading.Condition()
+        self._sets = dict()
+        self._budget = budget
+        self._preempting = 0
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run,
+            name="BusScheduler {}".format(self.port),
+            daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def register(self,
+                 name,
+                 period,
+                 callback,
+                 user=None,
+                 regs=(),
+                 priority=Priority.NORMAL,
+                 bus_priority=None):
+        """Polls ``regs`` of ``user`` every ``period`` seconds.
+
+        ``callback`` receives the values in the order of ``regs``. A poll
+        set without registers just calls ``callback()`` on schedule.
+        ``bus_priority`` overrides the ``BusPriority.POLL`` of the reads
+        in the queue of the bus.
+        """
+        poll_set = _PollSet(name, period, callback, user, regs, priority,
+                            bus_priority)
+        with self._cond:
+            self._sets[name] = poll_set
+            self._plan()
+            self._cond.notify_all()
+        return name
+
+    def unregister(self, name):
+        with self._cond:
+            self._sets.pop(name, None)
+            self._plan()
+
+    @property
+    def load(self):
+        """Requested share of the bus, 1.0 is a fully busy bus."""
+        with self._cond:
+            return sum(p.cost / p.period for p in self._sets.values())
+
+    def report(self):
+        with self._cond:
+            return [p.report() for p in self._sets.values()]
+
+    @contextmanager
+    def preempt(self):
+        with self._cond:
+            self._preempting += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._preempting -= 1
+                self._cond.notify_all()
+
+    def _plan(self):
+        from . import mb_settings
+        settings = mb_settings()
+
+        for p in self._sets.values():
+            p.cost = sum(
+                frame_time(block, settings.MB_BAUDRATE, settings.MB_PARITY)
+                for block in planner.plan_reads(p.regs)) if p.regs else 0
+            p.effective_period = p.period
+
+        load = sum(p.cost / p.period for p in self._sets.values())
+        excess = load - self._budget
+        if excess <= 0:
+            return
+
+        for p in sorted(self._sets.values(), key=lambda p: -p.priority):
+            if excess <= 0 or not p.cost:
+                continue
+            share = p.cost / p.period
+            allowed = max(share - excess, share / SCHEDULER_DEFAULTS.MAX_STRETCH)
+            excess -= share - allowed
+            p.effective_period = p.cost / allowed
+            self._log.warning(
+                "Poll \"{}\" cannot run every {:.3f} s, stretched to {:.3f} s"
+                .format(p.name, p.period, p.effective_period))
+
+        if excess > 0:
+            self._log.error(
+                "Requested polls need {:.0f}% of the bus, budget is {:.0f}%!"
+                .format(load * 100, self._budget * 100))
+
+    def _next_jobs(self):
+        # The other due sets of the device go out in the same bus message.
+        with self._cond:
+            while not self._stopped:
+                now = time.monotonic()
+                if not self._preempting:
+                    due = [p for p in self._sets.values() if p.next_due <= now]
+                    if due:
+                        job = min(due, key=lambda p: (p.priority, p.next_due))
+                        jobs = [job]
+                        if job.regs and hasattr(job.user, 'read_batch'):
+                            jobs += [
+                                p for p in due if p is not job and p.regs and
+                                p.user is job.user
+                            ]
+                        self._schedule(jobs, now)
+                        return jobs
+
+                timeout = None
+                if self._sets and not self._preempting:
+                    timeout = min(p.next_due
+                                  for p in self._sets.values()) - now
+                self._cond.wait(timeout)
+
+    @staticmethod
+    def _schedule(jobs, now):
+        # Called with the condition held, report() reads the same fields.
+        for job in jobs:
+            lag = now - job.next_due
+            job.max_lag = max(job.max_lag, lag)
+            job.next_due += job.effective_period
+            if job.next_due < now:
+                job.overruns += 1
+                job.next_due = now + job.effective_period
+            job.runs += 1
+
+    def _run(self):
+        while True:
+            jobs = self._next_jobs()
+            if jobs is None:
+                return
+
+            if len(jobs) > 1:
+                self._run_batch(jobs)
+                continue
+
+            job = jobs[0]
+            try:
+                if job.regs and job.bus_priority is not None:
+                    self._done(
+                        job, job.user.read_many(job.regs, job.bus_priority))
+                elif job.regs:
+                    self._done(job, job.user.read_many(job.regs))
+                else:
+                    job.callback()
+            except CannotReadARegisterValue as e:
+                self._log.warning("Poll \"{}\": {}".format(job.name, e))
+            except Exception:
+                self._log.error(
+                    "Poll \"{}\" failed!".format(job.name), exc_info=True)
+
+    def _done(self, job, values):
+        """Hands the values to the device, then records them."""
+        job.callback(values)
+        try:
+            History.store().record_regs(
+                job.user.history_source, job.regs, values)
+            Telemetry.log().record_regs(job.user.port, job.user.slave_address,
+                                        job.regs, values)
+        except Exception:
+            self._log.error(
+                "Cannot record poll \"{}\"!".format(job.name), exc_info=True)
+
+    def _run_batch(self, jobs):
+        priorities = [j.bus_priority for j in jobs
+                      if j.bus_priority is not None]
+        try:
+            if priorities:
+                results = jobs[0].user.read_batch(
+                    [j.regs for j in jobs], min(priorities))
+            else:
+                results = jobs[0].user.read_batch([j.regs for j in jobs])
+        except Exception:
+            self._log.error(
+                "Polls {} failed!".format(", ".join(
+                    "\"{}\"".format(j.name) for j in jobs)), exc_info=True)
+            return
+
+        for job, values in zip(jobs, results):
+            try:
+                if isinstance(values, CannotReadARegisterValue):
+                    raise values
+                self._done(job, values)
+            except CannotReadARegisterValue as e:
+                self._log.warning("Poll \"{}\": {}".format(job.name, e))
+            except Exception:
+                self._log.error(
+                    "Poll \"{}\" failed!".format(job.name), exc_info=True)
@@ -0,0 +1,425 @@
+"""Modbus RTU slaves on a pseudo terminal, for running without hardware.
+
+The master side opens ``RtuSimulator.port`` like a real adapter, e.g.::
+
+    sim = RtuSimulator.with_devices(latency=0.005)
+    sim.start()
+    door = DoorOpener.start(sim.port, 1)
+
+``TcpSimulator`` serves the same slaves as a Modbus TCP gateway. Run
+``python -m mbdevs.simulator`` to serve the default devices until
+interrupted.
+"""
+
+import os
+import time
+import tty
+import select
+import socket
+import struct
+import threading
+
+from collections import namedtuple
+from . import planner, rtu
+from . import dooropener, dooropener2, emergency, ivitmrs, toilet, \
+    toiletdudka, trafflight
+from .common import Logger
+
+SimulatorStats = namedtuple('SimulatorStats',
+                            ['requests', 'errors', 'bad_frames'])
+
+# Slave address -> register maps it answers to. Several modules are
+# different coils of the same I/O board.
+DEVICES = {
+    1: (dooropener.REGS, ),
+    2: (dooropener2.REGS, trafflight.REGS, emergency.REGS, toiletdudka.REGS),
+    5: (toilet.REGS, ),
+    247: (ivitmrs.REGS, ),
+}
+
+# Starting values of the input registers which are not all zeroes.
+INITIAL_VALUES = {
+    ivitmrs.REGS.temp: 22.5,
+    ivitmrs.REGS.temp_sht: 22.4,
+    ivitmrs.REGS.temp_no_correction: 22.6,
+    ivitmrs.REGS.temp_no_adjustment: 22.6,
+    ivitmrs.REGS.humidity: 40.0,
+    ivitmrs.REGS.humidity_no_correction: 41.0,
+    ivitmrs.REGS.humidity_no_adjustment: 41.0,
+}
+
+_ILLEGAL_FUNCTION = 1
+_ILLEGAL_ADDRESS = 2
+
+
+class SlaveModel:
+    """Register tables of one slave.
+
+    Discrete inputs start at 1, buttons of the boards are active low.
+    Addresses out of the register maps read as zero, like the gaps the
+    read planner bridges on the real boards.
+    """
+
+    def __init__(self, address, reg_maps=(), initial=INITIAL_VALUES):
+        self.address = address
+        self.coils = dict()
+        self.discrete = dict()
+        self.input = dict()
+        self.holding = dict()
+        self.requests = 0
+
+        for regs in reg_maps:
+            for reg in regs:
+                table = self._table(reg.func_code.value.read)
+                if table is self.discrete:
+                    table[reg.addr] = 1
+                elif reg in initial:
+                    self.set(reg, initial[reg])
+                elif reg.addr not in table:
+                    table[reg.addr] = 0
+
+    def _table(self, func_code):
+        return {
+            1: self.coils,
+            2: self.discrete,
+            3: self.holding,
+            4: self.input
+        }[func_code]
+
+    def set(self, reg, value):
+        table = self._table(reg.func_code.value.read)
+        if planner.is_bit(reg):
+            table[reg.addr] = int(bool(value))
+            return
+        for i, word in enumerate(planner.encode(reg, value)):
+            table[reg.addr + i] = word
+
+    def get(self, reg):
+        table = self._table(reg.func_code.value.read)
+        raw = [table.get(reg.addr + i, 0) for i in range(reg.count)]
+        return planner.decode(reg, raw, 0)
+
+    def handle(self, pdu):
+        """Returns the response PDU to a request PDU."""
+        self.requests += 1
+        func_code = pdu[0]
+        try:
+            if func_code in (1, 2, 3, 4):
+                addr, count = struct.unpack('>HH', pdu[1:5])
+                table = self._table(func_code)
+                values = [table.get(addr + i, 0) for i in range(count)]
+                if func_code in (1, 2):
+                    data = rtu.pack_bits(values)
+                else:
+                    data = struct.pack('>{}H'.format(count), *values)
+                return bytes((func_code, len(data))) + data
+            elif func_code == 5:
+                addr, value = struct.unpack('>HH', pdu[1:5])
+                self.coils[addr] = int(value == 0xFF00)
+            elif func_code == 6:
+                addr, value = struct.unpack('>HH', pdu[1:5])
+                self.holding[addr] = value
+            elif func_code == 15:
+                addr, count = struct.unpack('>HH', pdu[1:5])
+                for i, bit in enumerate(rtu.unpack_bits(pdu[6:], count)):
+                    self.coils[addr + i] = bit
+            elif func_code == 16:
+                addr, count = struct.unpack('>HH', pdu[1:5])
+                words = struct.unpack('>{}H'.format(count), pdu[6:])
+                for i, word in enumerate(words):
+                    self.holding[addr + i] = word
+            else:
+                return bytes((func_code | rtu.EXCEPTION_FLAG,
+                              _ILLEGAL_FUNCTION))
+        except (struct.error, IndexError):
+            return bytes((func_code | rtu.EXCEPTION_FLAG, _ILLEGAL_ADDRESS))
+
+        return pdu[:5]
+
+
+def request_length(buffer):
+    """Length of the RTU request frame at the buffer start, None if unknown."""
+    if len(buffer) < 2:
+        return None
+    if buffer[1] in (1, 2, 3, 4, 5, 6):
+        return 8
+    if buffer[1] in (15, 16):
+        return 9 + buffer[6] if len(buffer) >= 7 else None
+    return None
+
+
+class RtuSimulator:
+    """Serves ``SlaveModel`` slaves on the slave side of a pty pair.
+
+    ``latency`` is added before every response, as slave processing time.
+    """
+
+    def __init__(self, slaves, latency=0):
+        self._log = Logger.for_name(__name__)
+        self.slaves = {slave.address: slave for slave in slaves}
+        self.latency = latency
+        self.errors = 0
+        self.bad_frames = 0
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @classmethod
+    def with_devices(cls, devices=DEVICES, latency=0):
+        return cls([SlaveModel(addr, maps) for addr, maps in devices.items()],
+                   latency)
+
+    @property
+    def port(self):
+        return os.ttyname(self._slave)
+
+    def slave(self, address):
+        return self.slaves[address]
+
+    def start(self):
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._serve, name="RTU simulator", daemon=True)
+        self._thread.start()
+        self._log.info("Simulated RTU bus on {}".format(self.port))
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+
+    def stats(self):
+        return SimulatorStats(
+            sum(slave.requests for slave in self.slaves.values()),
+            self.errors, self.bad_frames)
+
+    def _serve(self):
+        buffer = bytearray()
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self._master], [], [], 0.1)
+            if not ready:
+                # A silent line ends any partial frame.
+                buffer.clear()
+                continue
+            buffer.extend(os.read(self._master, 512))
+
+            while True:
+                length = request_length(buffer)
+                if length is None:
+                    if len(buffer) >= 2:
+                        self.bad_frames += 1
+                        buffer.clear()
+                    break
+                if len(buffer) < length:
+                    break
+                adu = bytes(buffer[:length])
+                del buffer[:length]
+                self._answer(adu)
+
+    def _answer(self, adu):
+        try:
+            address, pdu = rtu.unframe(adu)
+        except IOError:
+            self.bad_frames += 1
+            return
+
+        slave = self.slaves.get(address)
+        if slave is None:
+            return
+
+        response = slave.handle(pdu)
+        if response[0] & rtu.EXCEPTION_FLAG:
+            self.errors += 1
+        if self.latency:
+            time.sleep(self.latency)
+        os.write(self._master, rtu.frame(address, response))
+
+
+class TcpSimulator:
+    """Serves ``SlaveModel`` slaves as a Modbus TCP gateway on localhost.
+
+    Requests are answered after ``latency`` independently of each other,
+    in any order, as pipelining gateways do. With ``rtu=True`` it is a
+    transparent RTU over TCP gateway answering one frame at a time.
+    """
+
+    def __init__(self, slaves, latency=0, rtu=False, host='127.0.0.1',
+                 port=0):
+        self._log = Logger.for_name(__name__)
+        self.slaves = {slave.address: slave for slave in slaves}
+        self.latency = latency
+        self.rtu = rtu
+        self.errors = 0
+        self.bad_frames = 0
+        self._address = (host, port)
+        self._lock = threading.Lock()
+        self._server = None
+        self._clients = []
+
+    @classmethod
+    def with_devices(cls, devices=DEVICES, latency=0, rtu=False,
+                     host='127.0.0.1', port=0):
+        return cls([SlaveModel(addr, maps) for addr, maps in devices.items()],
+                   latency, rtu, host, port)
+
+    @property
+    def port(self):
+        """The URL to give to the devices instead of a serial port."""
+        host, port = self._server.getsockname()
+        return '{}://{}:{}'.format('rtu+tcp' if self.rtu else 'tcp', host,
+                                   port)
+
+    def slave(self, address):
+        return self.slaves[address]
+
+    def start(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(self._address)
+        self._server.listen(8)
+        threading.Thread(
+            target=self._accept, name="TCP simulator", daemon=True).start()
+        self._log.info("Simulated Modbus gateway on {}".format(self.port))
+        return self
+
+    def stop(self):
+        server, self._server = self._server, None
+        if server:
+            server.close()
+        for client in self._clients:
+            client.close()
+        self._clients = []
+
+    def stats(self):
+        return SimulatorStats(
+            sum(slave.requests for slave in self.slaves.values()),
+            self.errors, self.bad_frames)
+
+    def _accept(self):
+        while self._server:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._clients.append(client)
+            threading.Thread(
+                target=self._serve_rtu if self.rtu else self._serve_tcp,
+                args=(client, ),
+                daemon=True).start()
+
+    def _handle(self, address, pdu):
+        slave = self.slaves.get(address)
+        if slave is None:
+            return None
+        with self._lock:
+            response = slave.handle(pdu)
+            if response[0] & rtu.EXCEPTION_FLAG:
+                self.errors += 1
+        return response
+
+    def _serve_tcp(self, client):
+        send_lock = threading.Lock()
+
+        def answer(header, response):
+            tid, pid, _, unit = struct.unpack('>HHHB', header)
+            with send_lock:
+                client.sendall(
+                    struct.pack('>HHHB', tid, pid,
+                                len(response) + 1, unit) + response)
+
+        try:
+            while True:
+                header = _recv_exactly(client, 7)
+                length = struct.unpack('>H', header[4:6])[0]
+                pdu = _recv_exactly(client, length - 1)
+                response = self._handle(header[6], pdu)
+                if response is None:
+                    continue
+                if self.latency:
+                    threading.Timer(self.latency, answer,
+                                    (header, response)).start()
+                else:
+                    answer(header, response)
+        except OSError:
+            client.close()
+
+    def _serve_rtu(self, client):
+        buffer = bytearray()
+        try:
+            while True:
+                length = request_length(buffer)
+                if length is None or len(buffer) < length:
+                    if length is None and len(buffer) >= 2:
+                        self.bad_frames += 1
+                        buffer.clear()
+                    data = client.recv(512)
+                    if not data:
+                        break
+                    buffer.extend(data)
+                    continue
+
+                adu = bytes(buffer[:length])
+                del buffer[:length]
+                try:
+                    address, pdu = rtu.unframe(adu)
+                except IOError:
+                    self.bad_frames += 1
+                    continue
+                response = self._handle(address, pdu)
+                if response is None:
+                    continue
+                if self.latency:
+                    time.sleep(self.latency)
+                client.sendall(rtu.frame(address, response))
+        except OSError:
+            pass
+        client.close()
+
+
+def _recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        data.extend(chunk)
+    return bytes(data)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulated Modbus devices")
+    parser.add_argument("latency", type=float, nargs="?", default=0,
+                        help="slave response latency, s")
+    parser.add_argument("--tcp", type=int, metavar="PORT",
+                        help="serve as a Modbus TCP gateway on PORT")
+    parser.add_argument("--rtu-over-tcp", action="store_true",
+                        help="with --tcp, pass raw RTU frames")
+    args = parser.parse_args()
+
+    if args.tcp is not None:
+        sim = TcpSimulator.with_devices(latency=args.latency,
+                                        rtu=args.rtu_over_tcp,
+                                        host='0.0.0.0',
+                                        port=args.tcp)
+    else:
+        sim = RtuSimulator.with_devices(latency=args.latency)
+    sim.start()
+    print(sim.port)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        sim.stop()
@@ -0,0 +1,413 @@
+"""Modbus devices behind a TCP gateway.
+
+A device port given as ``tcp://host:502`` talks Modbus TCP to the
+gateway, ``rtu+tcp://host:4001`` sends raw RTU frames over TCP. The
+device classes and their ``REGS`` stay the same, e.g.
+``DoorOpener.start("tcp://gateway:502", 1)``.
+
+Modbus TCP requests carry a transaction ID, so several of them are in
+flight on a connection at once and the gateway answers as its serial
+side allows. RTU over TCP has no IDs and stays one request at a time.
+"""
+
+import time
+import socket
+import struct
+import threading
+
+from collections import namedtuple
+from urllib.parse import urlsplit
+from . import rtu
+from .common import Logger
+from .exceptions import ModbusInvalidResponse, ModbusNoResponse
+from .messages import Batch
+from .modbus import BusTransactions
+
+TcpDefaults = namedtuple('TcpDefaults',
+                         ['PORT', 'RTU_PORT', 'CONNECTIONS'])
+
+TCP_DEFAULTS = TcpDefaults(PORT=502, RTU_PORT=4001, CONNECTIONS=2)
+
+# What minimalmodbus instruments have in ``serial`` that the buses use.
+Endpoint = namedtuple('Endpoint', ['port'])
+
+_MBAP = struct.Struct('>HHHB')
+
+
+class _Waiter:
+    def __init__(self):
+        self.event = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class _TcpConnection:
+    """One socket to the gateway with any number of requests in flight."""
+
+    def __init__(self, host, port, timeout):
+        self._log = Logger.for_name(__name__)
+        self._address = (host, port)
+        self._timeout = timeout
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._waiters = dict()
+        self._sock = None
+
+    @property
+    def in_flight(self):
+        return len(self._waiters)
+
+    @property
+    def is_open(self):
+        return self._sock is not None
+
+    def open(self):
+        sock = socket.create_connection(self._address, self._timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(None)
+        self._sock = sock
+        threading.Thread(
+            target=self._receive,
+            args=(sock, ),
+            name="Modbus TCP {}:{}".format(*self._address),
+            daemon=True).start()
+        self._log.info("Connected to {}:{}".format(*self._address))
+
+    def close(self):
+        sock, self._sock = self._sock, None
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    def send(self, tid, adu):
+        waiter = _Waiter()
+        with self._lock:
+            self._waiters[tid] = waiter
+        try:
+            with self._send_lock:
+                self._sock.sendall(adu)
+        except (OSError, AttributeError) as e:
+            self._fail(ConnectionError(
+                "Cannot send to {}:{}: {}".format(*self._address, e)))
+        return waiter
+
+    def forget(self, tid):
+        with self._lock:
+            self._waiters.pop(tid, None)
+
+    def _receive(self, sock):
+        try:
+            while True:
+                header = self._read_exactly(sock, _MBAP.size)
+                tid, _, length, unit = _MBAP.unpack(header)
+                pdu = self._read_exactly(sock, length - 1)
+                with self._lock:
+                    waiter = self._waiters.pop(tid, None)
+                if waiter:
+                    waiter.response = (unit, pdu)
+                    waiter.event.set()
+        except OSError as e:
+            if sock is self._sock:
+                self._log.warning("Connection to {}:{} lost: {}".format(
+                    *self._address, e))
+                self._fail(e)
+
+    def _fail(self, error):
+        self.close()
+        with self._lock:
+            waiters, self._waiters = self._waiters, dict()
+        for waiter in waiters.values():
+            waiter.error = error
+            waiter.event.set()
+
+    @staticmethod
+    def _read_exactly(sock, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Connection closed by the gateway")
+            data.extend(chunk)
+        return bytes(data)
+
+
+class ModbusTcpClient:
+    """Pipelining Modbus TCP master with a pool of gateway connections.
+
+    A request goes to the connection with the fewest requests in flight,
+    dropped connections are reopened by the next request.
+    """
+
+    def __init__(self,
+                 host,
+                 port=TCP_DEFAULTS.PORT,
+                 connections=TCP_DEFAULTS.CONNECTIONS,
+                 timeout=3):
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._tid = 0
+        self._connections = [
+            _TcpConnection(host, port, timeout) for _ in range(connections)
+        ]
+
+    @property
+    def in_flight(self):
+        return sum(conn.in_flight for conn in self._connections)
+
+    def close(self):
+        for conn in self._connections:
+            conn.close()
+
+    def transact(self, slave, request, timeout=None):
+        """Sends a request PDU and returns the parsed response."""
+        if timeout is None:
+            timeout = self._timeout
+        with self._lock:
+            self._tid = (self._tid + 1) & 0xFFFF
+            tid = self._tid
+            conn = min(self._connections, key=lambda c: c.in_flight)
+            if not conn.is_open:
+                conn.open()
+
+        waiter = conn.send(
+            tid, _MBAP.pack(tid, 0, len(request) + 1, slave) + request)
+        if not waiter.event.wait(timeout):
+            conn.forget(tid)
+            raise ModbusNoResponse("No answer from slave {}".format(slave))
+        if waiter.error is not None:
+            raise waiter.error
+
+        unit, response = waiter.response
+        if unit != slave:
+            raise ModbusInvalidResponse(
+                "Answer of slave {} to slave {}".format(unit, slave))
+        return rtu.parse_response(request, response)
+
+
+class RtuOverTcpClient:
+    """RTU frames through a transparent TCP gateway, one at a time."""
+
+    def __init__(self, host, port=TCP_DEFAULTS.RTU_PORT, timeout=3):
+        self._log = Logger.for_name(__name__)
+        self._address = (host, port)
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+
+    @property
+    def in_flight(self):
+        return int(self._lock.locked())
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def transact(self, slave, request, timeout=None):
+        with self._lock:
+            if self._sock is None:
+                self._sock = socket.create_connection(self._address,
+                                                      self._timeout)
+                self._sock.setsockopt(socket.IPPROTO_TCP,
+                                      socket.TCP_NODELAY, 1)
+                self._log.info("Connected to {}:{}".format(*self._address))
+
+            self._sock.settimeout(self._timeout if timeout is None
+                                  else timeout)
+            try:
+                self._sock.sendall(rtu.frame(slave, request))
+                head = self._read_exactly(2)
+                if head[1] & rtu.EXCEPTION_FLAG:
+                    rest = self._read_exactly(3)
+                else:
+                    rest = self._read_exactly(
+                        rtu.response_length(request) + 1)
+            except socket.timeout:
+                self._close()
+                raise ModbusNoResponse("No answer from slave {}".format(slave))
+            except OSError:
+                self._close()
+                raise
+
+        address, response = rtu.unframe(head + rest)
+        if address != slave:
+            raise ModbusInvalidResponse(
+                "Answer of slave {} to slave {}".format(address, slave))
+        return rtu.parse_response(request, response)
+
+    def _read_exactly(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self._sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Connection closed by the gateway")
+            data.extend(chunk)
+        return bytes(data)
+
+
+_gateways = dict()
+_gateways_lock = threading.Lock()
+
+
+def gateway(url):
+    """Returns the client shared by all devices behind a gateway URL."""
+    from . import mb_settings
+
+    with _gateways_lock:
+        client = _gateways.get(url)
+        if client is None:
+            parts = urlsplit(url)
+            timeout = mb_settings().MB_TIMEOUT
+            if parts.scheme == 'rtu+tcp':
+                client = RtuOverTcpClient(
+                    parts.hostname, parts.port or TCP_DEFAULTS.RTU_PORT,
+                    timeout)
+            else:
+                client = ModbusTcpClient(
+                    parts.hostname,
+                    parts.port or TCP_DEFAULTS.PORT,
+                    timeout=timeout)
+            client.url = url
+            _gateways[url] = client
+        return client
+
+
+def close_gateways():
+    with _gateways_lock:
+        for client in _gateways.values():
+            client.close()
+        _gateways.clear()
+
+
+class TcpInstrument:
+    """The part of ``minimalmodbus.Instrument`` the buses use, over TCP.
+
+    ``timeout`` is the answer timeout of the slave, None for the one of
+    the gateway client.
+    """
+
+    def __init__(self, client, address):
+        self.address = address
+        self.serial = Endpoint(client.url)
+        self.timeout = None
+        self._client = client
+
+    def _transact(self, request):
+        return self._client.transact(self.address, request, self.timeout)
+
+    def _read(self, func_code, addr, count):
+        return self._transact(rtu.read_request(func_code, addr, count))
+
+    def read_bit(self, registeraddress, functioncode=2):
+        return self._read(functioncode, registeraddress, 1)[0]
+
+    def read_bits(self, registeraddress, number_of_bits, functioncode=2):
+        return self._read(functioncode, registeraddress, number_of_bits)
+
+    def read_registers(self, registeraddress, number_of_registers,
+                       functioncode=3):
+        return self._read(functioncode, registeraddress,
+                          number_of_registers)
+
+    def read_register(self, registeraddress, number_of_decimals=0,
+                      functioncode=3, signed=False):
+        value = self._read(functioncode, registeraddress, 1)[0]
+        if signed and value & 0x8000:
+            value -= 0x10000
+        return value / 10**number_of_decimals if number_of_decimals \
+            else value
+
+    def read_float(self, registeraddress, functioncode=3,
+                   number_of_registers=2):
+        words = self._read(functioncode, registeraddress, number_of_registers)
+        fmt = '>f' if number_of_registers == 2 else '>d'
+        return struct.unpack(
+            fmt, struct.pack('>{}H'.format(number_of_registers), *words))[0]
+
+    def read_string(self, registeraddress, number_of_registers=16,
+                    functioncode=3):
+        words = self._read(functioncode, registeraddress, number_of_registers)
+        return struct.pack('>{}H'.format(number_of_registers),
+                           *words).decode('latin1')
+
+    def write_bit(self, registeraddress, value, functioncode=5):
+        self._transact(rtu.write_bit_request(registeraddress, value))
+
+    def write_bits(self, registeraddress, values):
+        self._transact(rtu.write_bits_request(registeraddress, values))
+
+    def write_registers(self, registeraddress, values):
+        self._transact(
+            rtu.write_registers_request(registeraddress, list(values)))
+
+    def write_float(self, registeraddress, value, number_of_registers=2):
+        fmt = '>f' if number_of_registers == 2 else '>d'
+        words = struct.unpack('>{}H'.format(number_of_registers),
+                              struct.pack(fmt, value))
+        self.write_registers(registeraddress, words)
+
+    def write_string(self, registeraddress, textstring,
+                     number_of_registers=16):
+        data = textstring.encode('latin1').ljust(2 * number_of_registers)
+        self.write_registers(
+            registeraddress,
+            struct.unpack('>{}H'.format(number_of_registers), data))
+
+
+class TcpBus(BusTransactions):
+    """Bus of a TCP gateway, used like the ``Modbus`` actor ref.
+
+    ``ask`` runs the request in the calling thread instead of queueing it
+    behind the others, so requests of different threads overlap.
+    """
+
+    def __init__(self, url, metrics):
+        self._log = Logger.for_name(__name__)
+        self._url = url
+        self._metrics = metrics
+        self._lock = threading.Lock()
+
+    def is_alive(self):
+        return True
+
+    def in_flight(self):
+        return gateway(self._url).in_flight
+
+    def ask(self, msg):
+        if isinstance(msg, Batch):
+            return [self._serve(req) for req in msg.requests]
+        return self._serve(msg)
+
+    def _serve(self, req):
+        request = _TcpRequest(self._log, self._metrics, self._lock)
+        start = time.perf_counter()
+        try:
+            return request._execute(req)
+        finally:
+            with self._lock:
+                self._metrics.transactions += 1
+                self._metrics.busy += time.perf_counter() - start
+
+
+class _TcpRequest(BusTransactions):
+    def __init__(self, log, metrics, lock):
+        self._log = log
+        self._metrics = metrics
+        self._lock = lock
+
+    def _check_connection(self, e):
+        # The gateway client reconnects on its own.
+        with self._lock:
+            BusTransactions._check_connection(self, e)
+
+    def _set_timeout(self, mb, breaker):
+        from . import mb_settings
+
+        mb.timeout = breaker.timeout(mb_settings().MB_TIMEOUT)
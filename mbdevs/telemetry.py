@@ -0,0 +1,344 @@
+"""Register samples logged to disk for offline analysis.
+
+The log is a directory of segment files. A segment is a 16 byte header
+(magic, version, record size, number of records) and fixed-width
+records of timestamp (ms), register address, slave, function code, port
+and value::
+
+    <q H B B H 2x d>  time, addr, slave, func, port, value
+
+The port of a record is the line of its name in ``ports.txt``, see
+``ports()``, so the same slave address on two buses is two series.
+
+Segments are written through ``mmap`` and a full one is closed and a new
+one started, the oldest ones go away after MAX_SEGMENTS. Pollers hand
+samples to ``Telemetry.log().record()``, which appends to a bounded queue
+and returns; a daemon thread writes them out every FLUSH seconds. Bits
+are logged when they change, other registers on every sample.
+
+``segments()`` maps the records of every segment for reading, as
+zero-copy NumPy record arrays when NumPy is installed::
+
+    for records in segments("telemetry"):
+        temp = records[(records["port"] == 0) & (records["slave"] == 247) &
+                       (records["addr"] == 0x22)]
+        print(temp["time"], temp["value"])
+
+``python -m mbdevs.telemetry [directory]`` prints a summary of a log.
+"""
+
+import os
+import sys
+import mmap
+import time
+import struct
+import threading
+
+from collections import namedtuple, deque
+from . import planner
+from .common import Logger
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+TelemetryDefaults = namedtuple(
+    'TelemetryDefaults',
+    ['DIRECTORY', 'SEGMENT_BYTES', 'MAX_SEGMENTS', 'QUEUE', 'FLUSH'])
+
+# A segment of SEGMENT_BYTES holds about 170k records. Up to QUEUE
+# samples wait for the writer, more are dropped instead of blocking.
+TELEMETRY_DEFAULTS = TelemetryDefaults(
+    DIRECTORY='telemetry',
+    SEGMENT_BYTES=4 * 1024 * 1024,
+    MAX_SEGMENTS=256,
+    QUEUE=65536,
+    FLUSH=1.0)
+
+MAGIC = b'MBTL'
+VERSION = 2
+SUFFIX = '.mbt'
+PORTS = 'ports.txt'
+
+HEADER = struct.Struct('<4sHHQ')
+RECORD = struct.Struct('<qHBBH2xd')
+
+Record = namedtuple('Record',
+                    ['time', 'addr', 'slave', 'func', 'port', 'value'])
+
+TelemetryStats = namedtuple('TelemetryStats',
+                            ['queued', 'written', 'dropped', 'segments'])
+
+if numpy is not None:
+    DTYPE = numpy.dtype([('time', '<i8'), ('addr', '<u2'), ('slave', 'u1'),
+                         ('func', 'u1'), ('port', '<u2'), ('pad', 'V2'),
+                         ('value', '<f8')])
+else:
+    DTYPE = None
+
+
+class SegmentWriter:
+    """Appends records to mmapped segment files of a directory."""
+
+    def __init__(self, directory, config=TELEMETRY_DEFAULTS):
+        self._log = Logger.for_name(__name__)
+        self._directory = directory
+        self._config = config
+        self._capacity = (config.SEGMENT_BYTES - HEADER.size) // RECORD.size
+        self._file = None
+        self._map = None
+        self._count = 0
+        self._seq = 0
+        self._ports = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write_ports(self, names):
+        """Writes the port names, ``names[i]`` is port ``i`` of the records."""
+        if len(names) == self._ports:
+            return
+        path = os.path.join(self._directory, PORTS)
+        with open(path + '.tmp', 'w') as f:
+            f.write("".join(name + "\n" for name in names))
+        os.replace(path + '.tmp', path)
+        self._ports = len(names)
+
+    def write(self, records):
+        """Writes ``(time, addr, slave, func, port, value)`` tuples."""
+        for record in records:
+            if self._map is None or self._count == self._capacity:
+                self._rotate(record[0])
+            RECORD.pack_into(self._map, HEADER.size +
+                             self._count * RECORD.size, *record)
+            self._count += 1
+
+    def flush(self):
+        """Publishes the records written so far to the readers."""
+        if self._map is not None:
+            HEADER.pack_into(self._map, 0, MAGIC, VERSION, RECORD.size,
+                             self._count)
+            self._map.flush()
+
+    def close(self):
+        if self._map is not None:
+            self.flush()
+            self._map.close()
+            self._file.close()
+            self._map = self._file = None
+
+    def _rotate(self, ms):
+        self.close()
+        self._seq += 1
+        path = os.path.join(self._directory,
+                            "{:013d}-{:04d}{}".format(ms, self._seq, SUFFIX))
+        self._file = open(path, 'w+b')
+        self._file.truncate(HEADER.size + self._capacity * RECORD.size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._count = 0
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, RECORD.size, 0)
+        self._log.info("Telemetry segment {}".format(path))
+
+        for old in segment_paths(self._directory)[:-self._config.MAX_SEGMENTS]:
+            try:
+                os.remove(old)
+            except OSError:
+                self._log.warning("Cannot remove {}".format(old),
+                                  exc_info=True)
+
+
+class Telemetry:
+    """Queue of samples written to the log by a daemon thread.
+
+    ``record()`` never waits for the disk, nothing is queued until
+    ``start()``.
+    """
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    @classmethod
+    def log(cls):
+        with cls.__instance_lock:
+            if not cls.__instance:
+                cls.__instance = cls()
+
+        return cls.__instance
+
+    def __init__(self, config=TELEMETRY_DEFAULTS):
+        self._log = Logger.for_name(__name__)
+        self._config = config
+        self._queue = deque()
+        self._last_bits = dict()
+        self._ports_lock = threading.Lock()
+        self._ports = dict()
+        self._port_names = []
+        self._writer = None
+        self._stopped = threading.Event()
+        self._thread = None
+        self._written = 0
+        self._dropped = 0
+
+    def start(self, directory=TELEMETRY_DEFAULTS.DIRECTORY):
+        # Ports keep their numbers across restarts.
+        self._port_names = ports(directory)
+        self._ports = dict(
+            (name, i) for i, name in enumerate(self._port_names))
+        self._writer = SegmentWriter(directory, self._config)
+        self._thread = threading.Thread(
+            target=self._run, name="Telemetry", daemon=True)
+        self._thread.start()
+        self._log.info("Telemetry to {}".format(directory))
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+
+    def stats(self):
+        return TelemetryStats(
+            len(self._queue), self._written, self._dropped,
+            len(segment_paths(self._writer._directory))
+            if self._writer else 0)
+
+    def record_regs(self, port, slave, regs, values):
+        """Queues the values of a register read of ``slave`` on ``port``."""
+        if self._writer is None:
+            return
+
+        ms = int(time.time() * 1000)
+        for reg, value in zip(regs, values):
+            if not isinstance(value, (bool, int, float)):
+                continue
+            if planner.is_bit(reg):
+                key = (port, slave, reg.func_code, reg.addr)
+                if self._last_bits.get(key) == value:
+                    continue
+                self._last_bits[key] = value
+            self.record(ms, port, slave, reg.func_code.value.read, reg.addr,
+                        value)
+
+    def record(self, ms, port, slave, func, addr, value):
+        if self._writer is None:
+            return
+        if len(self._queue) >= self._config.QUEUE:
+            self._dropped += 1
+            return
+        self._queue.append(
+            (ms, addr, slave, func, self._port_id(port), float(value)))
+
+    def _port_id(self, port):
+        port_id = self._ports.get(port)
+        if port_id is None:
+            with self._ports_lock:
+                port_id = self._ports.get(port)
+                if port_id is None:
+                    port_id = self._ports[port] = len(self._port_names)
+                    self._port_names.append(port)
+        return port_id
+
+    def _run(self):
+        while not self._stopped.wait(self._config.FLUSH):
+            self._drain()
+        self._drain()
+        self._writer.close()
+
+    def _drain(self):
+        records = []
+        while True:
+            try:
+                records.append(self._queue.popleft())
+            except IndexError:
+                break
+
+        if not records:
+            return
+        try:
+            self._writer.write_ports(list(self._port_names))
+            self._writer.write(records)
+            self._writer.flush()
+            self._written += len(records)
+        except Exception:
+            self._dropped += len(records)
+            self._log.error("Cannot write telemetry!", exc_info=True)
+
+
+def segment_paths(directory):
+    """Paths of the segments of a log, oldest first."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [
+        os.path.join(directory, name) for name in sorted(names)
+        if name.endswith(SUFFIX)
+    ]
+
+
+def ports(directory):
+    """Names of the ports of a log, by their number in the records."""
+    try:
+        with open(os.path.join(directory, PORTS)) as f:
+            return f.read().splitlines()
+    except FileNotFoundError:
+        return []
+
+
+def _open(path):
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, size, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION or size != RECORD.size:
+        data.close()
+        raise ValueError("{} is not a telemetry segment".format(path))
+    return data, count
+
+
+def segments(directory):
+    """Yields the records of every segment, oldest first.
+
+    With NumPy a segment is a record array viewing the mapped file, with
+    the fields of ``Record``; without it a list of ``Record``.
+    """
+    for path in segment_paths(directory):
+        data, count = _open(path)
+        if numpy is not None:
+            yield numpy.frombuffer(data, DTYPE, count, HEADER.size)
+            continue
+
+        try:
+            yield [
+                Record._make(RECORD.unpack_from(data, HEADER.size + i *
+                                                RECORD.size))
+                for i in range(count)
+            ]
+        finally:
+            data.close()
+
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 \
+        else TELEMETRY_DEFAULTS.DIRECTORY
+    names = ports(directory)
+    series = dict()
+    for records in segments(directory):
+        if numpy is not None:
+            records = [Record._make(r) for r in
+                       zip(*(records[field].tolist()
+                             for field in Record._fields))]
+        for r in records:
+            key = (r.port, r.slave, r.func, r.addr)
+            first, last, count = series.get(key, (r.time, r.time, 0))
+            series[key] = (first, r.time, count + 1)
+
+    for (port, slave, func, addr), (first, last, count) in \
+            sorted(series.items()):
+        print("{} slave {} func {} addr {:#06x}: {} records, {} .. {}".format(
+            names[port] if port < len(names) else port, slave, func, addr,
+            count,
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(first / 1000)),
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last / 1000))))
+
+
+if __name__ == "__main__":
+    main()
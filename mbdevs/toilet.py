@@ -11,8 +11,16 @@ from pykka import ThreadingActor
 from functools import partial
 
 from .common import Logger, find_device
+from .connection import ConnectionManager
+from .dispatch import Dispatcher, handles
+from .events import Edge, EdgeDetector, Event, EventPublisher
 from .exceptions import ComDeviceNotFound
-from .modbus import FunctionalCodes, Register, Modbus, Action, ModbusUser
+from .health import DeviceStartup
+from .history import History
+from .tracing import TracedActor
+from .modbus import (FunctionalCodes, Register, Modbus, ModbusUser,
+                      BusPriority)
+from .scheduler import BusScheduler, Priority
 
 ToiletRegs = namedtuple(
     'ToiletRegs',['button_end','button_like','button_dislike','lamp_button','lamp_green','lamp_red','lamp_connection','button_like_config','button_dislike_config','button_end_config','lamp_config_green','lamp_config_red','lamp_config_connection','lamp_config_button'])
@@ -118,7 +126,69 @@ REGS = ToiletRegs(
         unit=''))
 
 
-class Toilet(ModbusUser, ThreadingActor):
+class ToiletButtons:
+    """Paper state and score kept from the polled toilet buttons.
+
+    Shared by ``Toilet`` and ``aiodevices.AsyncToilet``. ``update()`` takes
+    the end, like and dislike buttons and returns the lamp writes and the
+    events they call for.
+    """
+
+    def __init__(self):
+        self.paper_absent = False
+        self.paper_msg = 'Device is not ready'
+        self.likes = 0
+        self.dislikes = 0
+        self.score = 0
+        self._prev = (0, 0, 0)
+        self._edges = EdgeDetector(
+            "toilet", ("button_end", "button_like", "button_dislike"))
+
+    @property
+    def score_msg(self):
+        return 'likes: %d dislikes: %d score: %d' % (
+            self.likes, self.dislikes, self.score)
+
+    def update(self, values):
+        button_end, button_like, button_dislike = values
+        prev_end, prev_like, prev_dislike = self._prev
+        self._prev = tuple(values)
+        events = self._edges.update(values)
+        writes = []
+
+        if button_end != prev_end and button_end:
+            self.paper_absent = not self.paper_absent
+            self.paper_msg = 'No paper left!' if self.paper_absent \
+                else 'Paper is ok!'
+            writes.append((REGS.lamp_button, int(self.paper_absent)))
+            events.append(
+                Event("toilet", "paper_absent", Edge.RISING
+                      if self.paper_absent else Edge.FALLING,
+                      self.paper_absent, time.monotonic()))
+
+        if button_like != prev_like:
+            writes.append((REGS.lamp_green, int(button_like)))
+            if button_like:
+                self.likes += 1
+                self.score += 1
+
+        if button_dislike != prev_dislike:
+            writes.append((REGS.lamp_red, int(button_dislike)))
+            if button_dislike:
+                self.dislikes += 1
+                self.score -= 1
+
+        if (button_like, button_dislike) != (prev_like, prev_dislike):
+            History.store().record("toilet", "paper score", self.score)
+
+        return writes, events
+
+
+class Toilet(DeviceStartup, TracedActor, Dispatcher, ModbusUser,
+             ThreadingActor):
+    health_name = "toilet"
+    bus_priority = BusPriority.COSMETIC
+
     class Action(enum.Enum):
         lamp_ON = 1
         lamp_OFF = 0
@@ -129,20 +199,10 @@ class Toilet(ModbusUser, ThreadingActor):
         ON = 1
         OFF = 0
 
-    class PaperState(enum.Enum):
-        LEFT = 1
-        ABSCENT = 0
-    
-    paperState = PaperState.LEFT
-    paperScore = 0
-    paperLikes = 0
-    paperDislikes = 0
-    paperMsg = 'Device is not ready'
-
     @classmethod
-    def from_vid_pid(cls, vip, pid, dev_addr=5):
+    def from_vid_pid(cls, vip, pid, dev_addr=5, serial_number=None):
         Logger.for_name(__name__).info("Device search...")
-        dev = find_device(vip, pid)
+        dev = find_device(vip, pid, serial_number)
         return cls.start(dev.device, dev_addr)
 
     def __init__(self, port, dev_addr):
@@ -152,36 +212,51 @@ class Toilet(ModbusUser, ThreadingActor):
 
         try:
             ModbusUser.__init__(
-                self, minimalmodbus.Instrument(
-                    str(port), dev_addr, mode='rtu'))
+                self, ConnectionManager.manager().instrument(
+                    port, dev_addr))
         except Exception as e:
             self._log.error(str(e), exc_info=True)
             raise e
 
-        self._initialize_gpio()
-
         self._button_state = Toilet.State.OFF
+        self._buttons = ToiletButtons()
+        self._events = EventPublisher()
+
+        BusScheduler.scheduler(self.port).register(
+            "toilet buttons",
+            0.05,
+            self._button_check,
+            user=self,
+            regs=(REGS.button_end, REGS.button_like, REGS.button_dislike),
+            priority=Priority.HIGH)
+
+    @handles('get_paper_score')
+    def _paper_score(self):
+        return self._buttons.score_msg
 
-        self._button_check_th = Thread(target=self._button_check_thread)
-        self._button_check_th.start()
+    @handles('is_paper_left')
+    def _paper_left(self):
+        return self._buttons.paper_msg
 
-    def on_receive(self, msg):
-        action = msg.pop('action')
-        if action == 'get_paper_score':
-            return 'likes: %d dislikes: %d score: %d' % (self.paperLikes, self.paperDislikes, self.paperScore)
-        if action == 'is_paper_left':
-            return self.paperMsg 
-        if action == 'connected':
-            self._write_reg(REGS.lamp_connection, 1)
+    @handles('connected')
+    def _connected(self):
+        self._write_reg(REGS.lamp_connection, 1)
 
+    @handles(Action.SUBSCRIBE_TO_BUTTON)
+    def _subscribe(self, subscriber, names=None):
+        self._events.subscribe(subscriber, names)
+
+    @handles(Action.lamp_ON)
     def lamp_on(self):
         self._log.info("Lamp on!")
         self._write_reg(REGS.lamp_button, 1)
 
+    @handles(Action.lamp_OFF)
     def lamp_off(self):
         self._log.info("Lamp off!")
         self._write_reg(REGS.lamp_button, 0)
 
+    @handles(Action.BUTTON_STATE)
     def _button_handler(self, state):
         self._button_state = state
         if state == Toilet.State.ON:
@@ -191,73 +266,16 @@ class Toilet(ModbusUser, ThreadingActor):
             self._log.info("Toilet button disabled")
             self.lamp_off()
 
-
-    def _match_action(self, action, **kwarg):
-        try:
-            {
-                Toilet.Action.lamp_ON:
-                self.lamp_on,
-                Toilet.Action.lamp_OFF:
-                self.lamp_off,
-                Toilet.Action.BUTTON_STATE:
-                lambda: self._button_handler(**kwarg)
-            }[action]()
-        except:
-            self._log.info("", exc_info=True)
-
     def _initialize_gpio(self):
-        self._write_reg(REGS.button_end_config, 0)
-        self._write_reg(REGS.button_like_config, 0)
-        self._write_reg(REGS.button_dislike_config, 0)
-        self._write_reg(REGS.lamp_config_button, 1)
-        self._write_reg(REGS.lamp_config_green, 1)
-        self._write_reg(REGS.lamp_config_red, 1)
-        self._write_reg(REGS.lamp_config_connection, 1)
-
-    def _button_check_thread(self):
-        prev_button_end = 0
-        prev_button_like = 0
-        prev_button_dislike = 0
-        lamp_button_state = 0
-        while True:
-            button_end = self._read_reg(REGS.button_end)
-            button_like = self._read_reg(REGS.button_like)
-            button_dislike = self._read_reg(REGS.button_dislike)
-
-
-            if button_end != prev_button_end:
-                if button_end == True:
-                    if lamp_button_state == 0:
-                        self._write_reg(REGS.lamp_button,1)
-                        self.paperState = self.PaperState.ABSCENT
-                        self.paperMsg = 'No paper left!'
-                        lamp_button_state = 1
-                    else:
-                        self._write_reg(REGS.lamp_button,0)
-                        self.paperState = self.PaperState.LEFT
-                        self.paperMsg = 'Paper is ok!'
-                        lamp_button_state = 0
-
-                
-                    
-            if button_like != prev_button_like:
-                if button_like == True:
-                    self._write_reg(REGS.lamp_green,1)
-                    self.paperLikes = self.paperLikes + 1
-                    self.paperScore = self.paperScore + 1 
-                else:
-                    self._write_reg(REGS.lamp_green,0)
-
-            if button_dislike != prev_button_dislike:
-                if button_dislike == True:
-                    self._write_reg(REGS.lamp_red,1)
-                    self.paperDislikes = self.paperDislikes + 1
-                    self.paperScore = self.paperScore - 1 
-                else:
-                    self._write_reg(REGS.lamp_red,0)
-
-            prev_button_dislike = button_dislike
-            prev_button_end = button_end
-            prev_button_like = button_like
-                
-            time.sleep(0.05)
+        return self._write_many(
+            (REGS.button_end_config, REGS.button_like_config,
+             REGS.button_dislike_config, REGS.lamp_config_button,
+             REGS.lamp_config_green, REGS.lamp_config_red,
+             REGS.lamp_config_connection),
+            (0, 0, 0, 1, 1, 1, 1))
+
+    def _button_check(self, values):
+        writes, events = self._buttons.update(values)
+        if writes:
+            self._write_many(*zip(*writes))
+        self._events.publish(events)
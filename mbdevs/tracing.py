@@ -0,0 +1,148 @@
+"""Where the time of a bot command goes.
+
+A command handler wrapped into ``command()`` starts a trace in its thread,
+``span()`` adds the time of a stage to the trace of the current thread.
+Actor messages carry the trace under ``"trace"``, so the stages run by
+the device actors and the bus actor land in the same trace.
+
+A finished trace is logged and feeds ``bot_command_seconds`` and
+``bot_command_stage_seconds``. Without a trace ``span()`` costs a
+thread-local lookup.
+"""
+
+import time
+import functools
+import threading
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from .common import Logger
+from .metrics import Metrics
+
+TRACE_KEY = "trace"
+
+_COMMAND_SECONDS = Metrics.registry().histogram(
+    'bot_command_seconds', 'Time from a command to the end of its handler.',
+    ('command', ))
+
+_STAGE_SECONDS = Metrics.registry().histogram(
+    'bot_command_stage_seconds', 'Time a command spent in every stage.',
+    ('command', 'stage'))
+
+_local = threading.local()
+
+
+class Trace:
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages = OrderedDict()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self._stages[stage] = self._stages.get(stage, 0) + seconds
+
+    def stages(self):
+        with self._lock:
+            return OrderedDict(self._stages)
+
+
+class _Span:
+    def __init__(self, trace, name):
+        self._trace = trace
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._trace.add(self._name, time.perf_counter() - self._start)
+        return False
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def current():
+    return getattr(_local, 'trace', None)
+
+
+def span(name):
+    trace = current()
+    return _NO_SPAN if trace is None else _Span(trace, name)
+
+
+@contextmanager
+def attach(trace):
+    """Runs the block in ``trace``, which may come from another thread."""
+    previous = current()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+def ask(actor, msg, name):
+    """``actor.ask(msg)`` as the "ask ``name``" stage of the current trace."""
+    trace = current()
+    if trace is None:
+        return actor.ask(msg)
+
+    msg = dict(msg)
+    msg[TRACE_KEY] = trace
+    with _Span(trace, "ask " + name):
+        return actor.ask(msg)
+
+
+def command(name):
+    """Decorates a command handler to trace every call of it."""
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def traced(*args, **kwargs):
+            trace = Trace(name)
+            with attach(trace):
+                try:
+                    return handler(*args, **kwargs)
+                finally:
+                    _finish(trace)
+
+        return traced
+
+    return decorator
+
+
+def _finish(trace):
+    total = time.perf_counter() - trace.start
+    stages = trace.stages()
+    _COMMAND_SECONDS.observe((trace.name, ), total)
+    for stage, seconds in stages.items():
+        _STAGE_SECONDS.observe((trace.name, stage), seconds)
+
+    Logger.for_name(__name__).info("/{} took {:.1f} ms{}".format(
+        trace.name, total * 1000, "".join(
+            ", {} {:.1f} ms".format(stage, seconds * 1000)
+            for stage, seconds in stages.items())))
+
+
+class TracedActor:
+    """Actor mixin handling a message in the trace of its sender."""
+
+    def _handle_receive(self, message):
+        if isinstance(message, dict) and TRACE_KEY in message:
+            message = dict(message)
+            with attach(message.pop(TRACE_KEY)):
+                return super()._handle_receive(message)
+
+        return super()._handle_receive(message)
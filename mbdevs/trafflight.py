@@ -1,17 +1,18 @@
 #!/usr/bin/env python
 
-import time
 import enum
-import minimalmodbus
-import serial.tools.list_ports
+import threading
 
-from collections import namedtuple
-from pykka import ThreadingActor
+from collections import namedtuple, deque
+from pykka import ThreadingActor, ActorDeadError
 from functools import partial
 
 from .common import Logger, find_device
-from .exceptions import ComDeviceNotFound
-from .modbus import FunctionalCodes, Register, Modbus, Action, ModbusUser
+from .connection import ConnectionManager
+from .dispatch import Dispatcher, handles
+from .health import DeviceStartup
+from .tracing import TracedActor
+from .modbus import FunctionalCodes, Register, ModbusUser, BusPriority
 
 TrafficLightRegs = namedtuple(
     'TrafficLightRegs',
@@ -63,16 +64,52 @@ REGS = TrafficLightRegs(
 )
 
 
-class TrafficLightDeviceNotFound(ComDeviceNotFound):
-    pass
+# Lights in the order of their coils.
+LIGHTS = (REGS.red, REGS.yellow, REGS.green)
 
+Frame = namedtuple('Frame', ['delay', 'values'])
+
+
+def merge_frames(frames, start):
+    """Drops frames that are overwritten before they can be seen.
+
+    A frame without a delay is replaced by the next one, and a frame that
+    does not change any light only extends the delay of the previous one.
+    """
+    merged = []
+    prev = start
+    for frame in frames:
+        if merged and merged[-1].delay == 0:
+            merged.pop()
+            prev = merged[-1].values if merged else start
+        if merged and frame.values == prev:
+            merged[-1] = Frame(merged[-1].delay + frame.delay, prev)
+            continue
+        merged.append(frame)
+        prev = frame.values
+    return merged
+
+
+class TrafficLight(DeviceStartup, TracedActor, Dispatcher, ModbusUser,
+                   ThreadingActor):
+    """Traffic light with a timer-driven pattern player.
+
+    Patterns are compiled into frames of all three lights and played from
+    timers, so the actor keeps serving messages while a pattern runs.
+    ON, OFF, TOGGLE and SEQUENCE are queued behind a running pattern to
+    keep their order; SEQUENCE with ``replace=True`` and CANCEL stop it.
+    """
+
+    health_name = "trafflight"
+    bus_priority = BusPriority.COSMETIC
 
-class TrafficLight(ModbusUser, ThreadingActor):
     class Action(enum.Enum):
         ON = 1
         OFF = 0
         SEQUENCE = 2
         TOGGLE = 3
+        CANCEL = 4
+        STEP = 5
 
     class State(enum.Enum):
         ON = 1
@@ -85,9 +122,9 @@ class TrafficLight(ModbusUser, ThreadingActor):
         ALL = -1
 
     @classmethod
-    def from_vid_pid(cls, vip, pid, dev_addr=2):
+    def from_vid_pid(cls, vip, pid, dev_addr=2, serial_number=None):
         Logger.for_name(__name__).info("Device search...")
-        dev = find_device(vip, pid)
+        dev = find_device(vip, pid, serial_number)
         return cls.start(dev.device, dev_addr)
 
     def __init__(self, port, dev_addr):
@@ -100,45 +137,43 @@ class TrafficLight(ModbusUser, ThreadingActor):
             TrafficLight.Color.YELLOW: TrafficLight.State.OFF,
         }
 
+        self._patterns = deque()
+        self._frames = None
+        self._index = 0
+        self._generation = 0
+        self._timer = None
+
         try:
             ModbusUser.__init__(
-                self, minimalmodbus.Instrument(
-                    str(port), dev_addr, mode='rtu'))
+                self, ConnectionManager.manager().instrument(
+                    port, dev_addr))
         except Exception as e:
             self._log.error(str(e), exc_info=True)
             raise e
 
-        self.initialize_gpio()
-        self.all(TrafficLight.State.OFF)
-
-    def on_receive(self, msg):
-        action = msg.pop('action')
-        self._match_action(action, **msg)
+    def on_stop(self):
+        self.cancel()
 
     def _reg(self, color):
-        return {
-            TrafficLight.Color.RED: REGS.red,
-            TrafficLight.Color.GREEN: REGS.green,
-            TrafficLight.Color.YELLOW: REGS.yellow
-        }[color]
+        return COLOR_REGS[color]
 
-    def _match_action(self, action, **kwarg):
-        try:
-            {
-                TrafficLight.Action.OFF: partial(self.turn_off, **kwarg),
-                TrafficLight.Action.ON: partial(self.turn_on, **kwarg),
-                TrafficLight.Action.TOGGLE: partial(self.toggle, **kwarg),
-                TrafficLight.Action.SEQUENCE: partial(self.sequence, **kwarg)
-            }[action]()
-        except:
-            self._log.info("", exc_info=True)
-
-    def initialize_gpio(self):
-        self._write_reg(REGS.red_config, 1)
-        self._write_reg(REGS.yellow_config, 1)
-        self._write_reg(REGS.green_config, 1)
+    def _initialize_gpio(self):
+        return self._write_many(
+            (REGS.red_config, REGS.yellow_config, REGS.green_config),
+            (1, 1, 1)) and self._write_many(LIGHTS, (0, 0, 0))
+
+    def _snapshot(self):
+        return tuple(self.states[color] == TrafficLight.State.ON
+                     for color in ORDER)
+
+    def _show(self, values):
+        for color, value in zip(ORDER, values):
+            self.states[color] = TrafficLight.State.ON if value \
+                else TrafficLight.State.OFF
+        self._write_many(LIGHTS, [int(v) for v in values])
 
     def _turn(self, color, state):
+        self.states[color] = state
         reg = self._reg(color)
         if state == TrafficLight.State.ON:
             self._write_reg(reg, 1)
@@ -146,51 +181,130 @@ class TrafficLight(ModbusUser, ThreadingActor):
             self._write_reg(reg, 0)
 
     def all(self, state):
-        self.green(state)
-        self.yellow(state)
-        self.red(state)
+        self._show((state == TrafficLight.State.ON, ) * len(ORDER))
 
     def green(self, state):
-        self.states[TrafficLight.Color.GREEN] = state
         self._turn(TrafficLight.Color.GREEN, state)
 
     def yellow(self, state):
-        self.states[TrafficLight.Color.YELLOW] = state
         self._turn(TrafficLight.Color.YELLOW, state)
 
     def red(self, state):
-        self.states[TrafficLight.Color.RED] = state
         self._turn(TrafficLight.Color.RED, state)
 
+    @handles(Action.ON)
     def turn_on(self, color):
-        if color == TrafficLight.Color.ALL:
-            self.all(TrafficLight.State.ON)
-        else:
-            self.states[color] = TrafficLight.State.ON
-            self._turn(color, TrafficLight.State.ON)
+        self._submit(partial(compile_set, color, True))
 
+    @handles(Action.OFF)
     def turn_off(self, color):
-        if color == TrafficLight.Color.ALL:
-            self.all(TrafficLight.State.OFF)
-        else:
-            self.states[color] = TrafficLight.State.OFF
-            self._turn(color, TrafficLight.State.OFF)
+        self._submit(partial(compile_set, color, False))
 
+    @handles(Action.TOGGLE)
     def toggle(self, colors):
-        for color in colors:
-            if isinstance(color, TrafficLight.Color):
-                if self.states[color] == TrafficLight.State.ON:
-                    self._turn(color, TrafficLight.State.OFF)
-                else:
-                    self._turn(color, TrafficLight.State.ON)
-
-    def sequence(self, sleep_time, colors):
-        for color in colors:
-            if isinstance(color, TrafficLight.Color):
-                if self.states[color] == TrafficLight.State.ON:
-                    state = TrafficLight.State.OFF
-                else:
-                    state = TrafficLight.State.ON
-                self._turn(color, state)
-                self.states[color] = state
-                time.sleep(sleep_time)
+        self._submit(partial(compile_toggle, colors))
+
+    @handles(Action.SEQUENCE)
+    def sequence(self, sleep_time, colors, replace=False):
+        self._submit(
+            partial(compile_sequence, sleep_time, colors), replace)
+
+    @handles(Action.CANCEL)
+    def cancel(self):
+        """Stops the running pattern and drops the queued ones."""
+        self._generation += 1
+        self._patterns.clear()
+        self._frames = None
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def _submit(self, compile, replace=False):
+        if replace:
+            self.cancel()
+        self._patterns.append(compile)
+        if self._frames is None:
+            self._next_pattern()
+
+    def _next_pattern(self):
+        # Patterns are compiled when they start, against the lights left
+        # by the previous one.
+        while self._patterns:
+            frames = self._patterns.popleft()(self._snapshot())
+            if frames:
+                self._frames = frames
+                self._index = 0
+                self._step(self._generation)
+                return
+        self._frames = None
+
+    @handles(Action.STEP)
+    def _step(self, generation):
+        if generation != self._generation or self._frames is None:
+            return
+
+        if self._index >= len(self._frames):
+            self._frames = None
+            self._next_pattern()
+            return
+
+        frame = self._frames[self._index]
+        self._index += 1
+        if frame.values != self._snapshot():
+            self._show(frame.values)
+
+        if frame.delay > 0:
+            self._timer = threading.Timer(frame.delay, self._step_timer_handler,
+                                          [generation])
+            self._timer.daemon = True
+            self._timer.start()
+        else:
+            self._step(generation)
+
+    def _step_timer_handler(self, generation):
+        try:
+            self.actor_ref.tell({
+                "action": TrafficLight.Action.STEP,
+                "generation": generation
+            })
+        except ActorDeadError:
+            pass
+
+
+# Colors in the order of LIGHTS.
+ORDER = (TrafficLight.Color.RED, TrafficLight.Color.YELLOW,
+         TrafficLight.Color.GREEN)
+
+COLOR_REGS = {
+    TrafficLight.Color.RED: REGS.red,
+    TrafficLight.Color.GREEN: REGS.green,
+    TrafficLight.Color.YELLOW: REGS.yellow
+}
+
+
+def compile_set(color, value, start):
+    values = list(start)
+    for i, c in enumerate(ORDER):
+        if color in (c, TrafficLight.Color.ALL):
+            values[i] = value
+    return [Frame(0, tuple(values))]
+
+
+def compile_toggle(colors, start):
+    values = list(start)
+    for color in colors:
+        if color in ORDER:
+            i = ORDER.index(color)
+            values[i] = not values[i]
+    return [Frame(0, tuple(values))]
+
+
+def compile_sequence(sleep_time, colors, start):
+    frames = []
+    values = list(start)
+    for color in colors:
+        if color in ORDER:
+            i = ORDER.index(color)
+            values[i] = not values[i]
+            frames.append(Frame(sleep_time, tuple(values)))
+    return merge_frames(frames, start)
@@ -0,0 +1,30 @@
+import unittest
+
+from mbdevs.history import Series, parse_window
+
+
+class ParseWindowTest(unittest.TestCase):
+    def test_units(self):
+        self.assertEqual(parse_window("90s"), 90)
+        self.assertEqual(parse_window("15m"), 900)
+        self.assertEqual(parse_window("2"), 7200)
+        self.assertEqual(parse_window("7d"), 7 * 86400)
+
+    def test_rejects_bad_windows(self):
+        for text in ("inf", "infh", "-inf", "nan", "nanm", "1e400", "0",
+                     "-5h", "h", ""):
+            with self.assertRaises(ValueError, msg=text):
+                parse_window(text)
+
+
+class SeriesTest(unittest.TestCase):
+    def test_long_window_is_cut_to_the_last_tier(self):
+        series = Series("test", "value")
+        series.add(1.5)
+        stats = series.stats(float("inf"))
+        self.assertEqual(stats.count, 1)
+        self.assertEqual(stats.step, 86400)
+
+
+if __name__ == "__main__":
+    unittest.main()
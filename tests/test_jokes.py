@@ -0,0 +1,96 @@
+import time
+import threading
+import unittest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from jokes import JOKE_DEFAULTS, JokeClient, JokeNotFound, JokePrefetcher, \
+    parse_joke
+
+# The joke is cut across chunks and has a nested div, the page goes on
+# after it. A test fails if the tail is ever needed.
+HEAD = [
+    b'<html><body><div class="quote">',
+    b'<div class="text">First line<br>second ',
+    b'<div>line</div> ends</d',
+    b'iv>',
+]
+TAIL = [b'<div class="text">Another joke</div></div></body></html>']
+JOKE = "First line\nsecond line ends"
+
+
+class _PageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for chunk in HEAD:
+                self._chunk(chunk)
+            # The rest of the page comes only after the test is over.
+            self.server.release.wait()
+            for chunk in TAIL:
+                self._chunk(chunk)
+            self._chunk(b'')
+        except OSError:
+            pass
+
+    def _chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ParseJokeTest(unittest.TestCase):
+    def test_stops_at_the_end_of_the_first_joke(self):
+        def chunks():
+            yield from HEAD
+            self.fail("Read past the joke")
+
+        self.assertEqual(parse_joke(chunks()), JOKE)
+
+    def test_no_joke(self):
+        with self.assertRaises(JokeNotFound):
+            parse_joke([b'<html><body>', b'<div>Nothing</div>'])
+
+
+class JokeClientTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _PageHandler)
+        self.server.daemon_threads = True
+        self.server.release = threading.Event()
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_fetch_stops_at_the_end_of_the_first_joke(self):
+        # The server holds the tail back, so waiting for it times out.
+        client = JokeClient(
+            self.url, JOKE_DEFAULTS._replace(READ_TIMEOUT=1, RETRIES=0))
+        try:
+            self.assertEqual(client.fetch(), JOKE)
+        finally:
+            client.close()
+
+
+class JokePrefetcherTest(unittest.TestCase):
+    def test_get_returns_none_after_the_timeout(self):
+        prefetcher = JokePrefetcher(client=None)
+        start = time.monotonic()
+        self.assertIsNone(prefetcher.get(timeout=0.1))
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertEqual(prefetcher.stats().empty, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+
+from mbdevs import telemetry
+from mbdevs.dooropener import REGS as DOOR_REGS
+from mbdevs.ivitmrs import REGS as IVIT_MRS_REGS
+from mbdevs.telemetry import HEADER, MAGIC, RECORD, Record, SegmentWriter, \
+    Telemetry, TELEMETRY_DEFAULTS, VERSION, ports, segment_paths, segments
+
+# Three records a segment and two segments kept.
+CONFIG = TELEMETRY_DEFAULTS._replace(
+    SEGMENT_BYTES=HEADER.size + 3 * RECORD.size, MAX_SEGMENTS=2, FLUSH=0.01)
+
+RECORDS = [(1000 + i, 0x22, 247, 4, i % 2, 20.0 + i) for i in range(8)]
+
+
+def _tuples(records):
+    if telemetry.numpy is not None:
+        records = zip(*(records[field].tolist() for field in Record._fields))
+    return [tuple(r) for r in records]
+
+
+class SegmentWriterTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.directory = self._tmp.name
+        writer = SegmentWriter(self.directory, CONFIG)
+        writer.write(RECORDS)
+        writer.close()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_rotation_keeps_the_last_segments(self):
+        paths = segment_paths(self.directory)
+        self.assertEqual(len(paths), CONFIG.MAX_SEGMENTS)
+        self.assertEqual([os.path.basename(path) for path in paths],
+                         ["0000000001003-0002.mbt", "0000000001006-0003.mbt"])
+
+    def test_record_layout(self):
+        self.assertEqual(RECORD.size, 24)
+        with open(segment_paths(self.directory)[-1], 'rb') as f:
+            data = f.read()
+        self.assertEqual(len(data), CONFIG.SEGMENT_BYTES)
+        self.assertEqual(HEADER.unpack_from(data, 0),
+                         (MAGIC, VERSION, RECORD.size, 2))
+        self.assertEqual(data[HEADER.size:HEADER.size + RECORD.size],
+                         RECORD.pack(*RECORDS[6]))
+
+    @unittest.skipIf(telemetry.numpy is None, "NumPy is not installed")
+    def test_read_back_with_numpy(self):
+        read = [_tuples(records) for records in segments(self.directory)]
+        self.assertEqual(read, [RECORDS[3:6], RECORDS[6:]])
+
+    def test_read_back_without_numpy(self):
+        with mock.patch.object(telemetry, 'numpy', None):
+            read = [_tuples(records) for records in segments(self.directory)]
+        self.assertEqual(read, [RECORDS[3:6], RECORDS[6:]])
+
+
+class TelemetryPortsTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.directory = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _log(self, samples):
+        log = Telemetry(CONFIG).start(self.directory)
+        for port, slave, reg, value in samples:
+            log.record_regs(port, slave, (reg, ), (value, ))
+        log.stop()
+
+    def test_ports_keep_their_numbers_across_restarts(self):
+        temp = IVIT_MRS_REGS.temp
+        self._log([("/dev/ttyUSB0", 247, temp, 22.5),
+                   ("tcp://gateway:502", 247, temp, 23.5)])
+        self._log([("tcp://gateway:502", 247, temp, 24.5),
+                   ("/dev/ttyUSB1", 247, temp, 25.5)])
+
+        self.assertEqual(
+            ports(self.directory),
+            ["/dev/ttyUSB0", "tcp://gateway:502", "/dev/ttyUSB1"])
+        with mock.patch.object(telemetry, 'numpy', None):
+            read = [(r.port, r.value) for records in segments(self.directory)
+                    for r in records]
+        self.assertEqual(read, [(0, 22.5), (1, 23.5), (1, 24.5), (2, 25.5)])
+
+    def test_bits_are_logged_when_they_change(self):
+        door = DOOR_REGS.door
+        self._log([("/dev/ttyUSB0", 1, door, True),
+                   ("/dev/ttyUSB0", 1, door, True),
+                   ("/dev/ttyUSB0", 1, door, False)])
+
+        with mock.patch.object(telemetry, 'numpy', None):
+            read = [(r.addr, r.slave, r.func, r.value)
+                    for records in segments(self.directory) for r in records]
+        self.assertEqual(read, [(door.addr, 1, 1, 1.0),
+                                (door.addr, 1, 1, 0.0)])
+
+
+if __name__ == "__main__":
+    unittest.main()